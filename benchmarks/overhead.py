@@ -0,0 +1,303 @@
+"""Per-request tracing overhead benchmark
+
+Drives the test Flask and Django applications with their WSGI test clients
+with tracing disabled, enabled and enabled with HTTP body capture.
+Spans are either kept in memory or sent to a local UDP sink.
+
+Run it from the repository root:
+
+    $ python -m benchmarks.overhead --requests 2000
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from timeit import default_timer
+
+import mock
+import opentracing
+from jaeger_client.reporter import InMemoryReporter
+
+from intracing.base import TracingHelper
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.django_app.settings')
+
+FRAMEWORKS = ('flask', 'django')
+MODES = ('off', 'on', 'body')
+REPORTERS = ('memory', 'udp')
+
+FINISHED_SPANS = ('jaeger:finished_spans', ())
+REPORTER_BYTES = ('intracing:reporter_bytes', ())
+
+ENV_VARIABLES = {
+    'off': {
+        'TRACING_ENABLED': '0',
+    },
+    'on': {
+        'TRACING_ENABLED': '1',
+        'TRACING_STORE_HTTP_BODY': '0',
+    },
+    'body': {
+        'TRACING_ENABLED': '1',
+        'TRACING_STORE_HTTP_BODY': '1',
+    },
+}
+
+
+class UDPSink(object):
+    """Local UDP server counting received packets and bytes"""
+
+    def __init__(self, host='127.0.0.1'):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, 0))
+        self.socket.settimeout(0.1)
+        self.host, self.port = self.socket.getsockname()
+        self.packets = 0
+        self.bytes = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._receive)
+        self._thread.daemon = True
+
+    def _receive(self):
+        while not self._stopped.is_set():
+            try:
+                data = self.socket.recv(65535)
+            except socket.timeout:
+                continue
+            self.packets += 1
+            self.bytes += len(data)
+
+    def reset(self):
+        self.packets = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        self.socket.close()
+
+
+def percentile(sorted_values, percent):
+    # nearest-rank method
+    index = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, index)]
+
+
+def get_flask_client(payload):
+    from flask import request
+
+    from tests.utils import get_flask_app
+
+    app = get_flask_app()
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        return request.get_data(), 200, {
+            'Content-Type': request.content_type,
+        }
+
+    client = app.test_client()
+
+    def send():
+        return client.post('/echo', data=payload,
+                           content_type='application/json')
+
+    return send
+
+
+def get_django_client(payload):
+    import django
+    from django.conf import settings
+    from django.test.client import Client
+
+    from intracing.django import IntracingDjangoMiddleware
+
+    django.setup()
+    settings.MIDDLEWARE = []
+    IntracingDjangoMiddleware.tracing_configured = False
+    IntracingDjangoMiddleware.configure_tracing()
+    client = Client()
+
+    def send():
+        return client.post('/echo', data=payload,
+                           content_type='application/json')
+
+    return send
+
+
+CLIENT_FACTORIES = {
+    'flask': get_flask_client,
+    'django': get_django_client,
+}
+
+
+def wait_for(future, timeout):
+    deadline = default_timer() + timeout
+    while not future.done() and default_timer() < deadline:
+        time.sleep(0.01)
+
+
+def run_scenario(framework, mode, reporter_type, sink, options):
+    payload = b'{"data": "%s"}' % (b'x' * options.body_size)
+    env = dict(
+        ENV_VARIABLES[mode],
+        TRACING_SERVICE_NAME='intracing-benchmark',
+        TRACING_AGENT_HOST=sink.host,
+        TRACING_AGENT_PORT=str(sink.port),
+        TRACING_SAMPLER_TYPE='const',
+        TRACING_SAMPLER_PARAM='1',
+    )
+    if options.body_limit:
+        env['TRACING_HTTP_BODY_SIZE_LIMIT'] = str(options.body_limit)
+
+    with mock.patch.dict(os.environ, env):
+        send = CLIENT_FACTORIES[framework](payload)
+
+    tracer = reporter = None
+    if mode != 'off':
+        # the tracers are initialized lazily
+        tracer = opentracing.tracer._tracer
+        reporter = tracer.reporter
+        if reporter_type == 'memory':
+            tracer.reporter = InMemoryReporter()
+
+    for _ in range(options.warmup):
+        send()
+
+    stats = TracingHelper.stats
+    stats.reset()
+    sink.reset()
+
+    latencies = []
+    started = default_timer()
+    for _ in range(options.requests):
+        request_started = default_timer()
+        send()
+        latencies.append(default_timer() - request_started)
+    elapsed = default_timer() - started
+    spans = stats.counters.get(FINISHED_SPANS, 0)
+
+    allocated = peak = None
+    if tracemalloc is not None and options.allocation_requests:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(options.allocation_requests):
+            send()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocated = (current - before) / float(options.allocation_requests)
+        peak -= before
+
+    if tracer is not None:
+        tracer.sampler.close()
+        wait_for(reporter.close(), options.flush_timeout)
+
+    latencies.sort()
+    result = OrderedDict((
+        ('framework', framework),
+        ('mode', mode),
+        ('reporter', reporter_type if tracer is not None else '-'),
+        ('requests', options.requests),
+        ('p50_ms', percentile(latencies, 50) * 1000),
+        ('p99_ms', percentile(latencies, 99) * 1000),
+        ('requests_per_sec', options.requests / elapsed),
+        ('spans_per_sec', spans / elapsed),
+        ('retained_bytes_per_request', allocated),
+        ('peak_alloc_kib', None if peak is None else peak / 1024.0),
+    ))
+    if reporter_type == 'udp' and tracer is not None:
+        result['reporter_bytes'] = stats.counters.get(REPORTER_BYTES, 0)
+        result['udp_packets'] = sink.packets
+        result['udp_bytes'] = sink.bytes
+    return result
+
+
+def run(options):
+    results = []
+    with UDPSink() as sink:
+        for framework in options.frameworks:
+            for mode in options.modes:
+                reporters = options.reporters if mode != 'off' else ('-',)
+                for reporter_type in reporters:
+                    results.append(run_scenario(
+                        framework, mode, reporter_type, sink, options
+                    ))
+    return results
+
+
+def format_value(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return '{:.3f}'.format(value)
+    return str(value)
+
+
+def print_table(results):
+    columns = []
+    for result in results:
+        columns.extend(key for key in result if key not in columns)
+
+    rows = [columns] + [
+        [format_value(result.get(column)) for column in columns]
+        for result in results
+    ]
+    widths = [max(len(row[index]) for row in rows)
+              for index in range(len(columns))]
+    for row in rows:
+        print('  '.join(
+            value.rjust(width) for value, width in zip(row, widths)
+        ))
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='number of timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=100,
+                        help='number of requests before timing')
+    parser.add_argument('--allocation-requests', type=int, default=100,
+                        help='number of requests traced by tracemalloc')
+    parser.add_argument('--body-size', type=int, default=1024,
+                        help='size of request and response bodies')
+    parser.add_argument('--body-limit', type=int,
+                        help='value of TRACING_HTTP_BODY_SIZE_LIMIT')
+    parser.add_argument('--flush-timeout', type=float, default=5,
+                        help='seconds to wait for the reporter to flush')
+    parser.add_argument('--frameworks', nargs='+', choices=FRAMEWORKS,
+                        default=FRAMEWORKS)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--reporters', nargs='+', choices=REPORTERS,
+                        default=REPORTERS)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    results = run(options)
+    if options.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Span serialization throughput benchmark
+
+Encodes typical Flask and Django request spans into Jaeger batches
+with the compact protocol used by the reporter, with and without
+the cache of encoded strings. Reporter modes split the spans into
+packet-sized batches beforehand, with estimated sizes of spans
+or measuring every span exactly.
+
+Run it from the repository root:
+
+    $ python -m benchmarks.serialization --spans 10000
+"""
+from __future__ import print_function
+
+import argparse
+import functools
+import json
+import os
+from collections import OrderedDict
+from timeit import default_timer
+
+import mock
+import six
+from jaeger_client import Tracer, thrift
+from jaeger_client.reporter import InMemoryReporter
+from jaeger_client.sampler import ConstSampler
+from thrift.compat import str_to_binary
+from thrift.protocol.TCompactProtocol import TCompactProtocol
+from thrift.transport.TTransport import TMemoryBuffer
+
+from benchmarks.overhead import print_table
+from intracing import reporter
+from intracing.base import TracingHelper
+
+FRAMEWORKS = OrderedDict((
+    ('flask', ('Flask', 'echo', '/echo')),
+    ('django', ('Django', 'home', '^$')),
+))
+MODES = ('cached', 'uncached', 'reporter', 'reporter-exact')
+
+
+def write_string_uncached(proto, value):
+    # the encoding used before the cache of encoded strings
+    if not isinstance(value, six.binary_type):
+        value = str_to_binary(value)
+    proto.writeBinary(value)
+
+
+WRITE_STRING = {
+    'cached': reporter.write_string,
+    'uncached': write_string_uncached,
+    'reporter': reporter.write_string,
+    'reporter-exact': reporter.write_string,
+}
+
+
+def make_spans(framework, count, body_size):
+    component, operation_name, route = FRAMEWORKS[framework]
+    helper = type('BenchmarkHelper', (TracingHelper,), {
+        'COMPONENT': component,
+    })
+    env = {
+        'TRACING_SERVICE_NAME': 'intracing-benchmark',
+        'TRACING_STORE_HTTP_BODY': '1' if body_size else '0',
+    }
+    with mock.patch.dict(os.environ, env):
+        helper.init_config()
+
+    body = b'{"data": "%s"}' % (b'x' * body_size) if body_size else None
+    tracer = Tracer(service_name='intracing-benchmark',
+                    reporter=InMemoryReporter(), sampler=ConstSampler(True))
+    for index in range(count):
+        span = tracer.start_span(operation_name)
+        helper.set_request_tags(
+            span, 'POST', 'http://localhost/{}?page={}'.format(
+                operation_name, index
+            ),
+            'python-requests/2.25.1', 'application/json', body, route,
+        )
+        helper.set_response_tags(span, 200, 'application/json', body)
+        span.finish()
+    return tracer.reporter.get_spans()
+
+
+def serialize(spans, process, batch_size):
+    size = 0
+    for start in range(0, len(spans), batch_size):
+        batch = thrift.make_jaeger_batch(
+            spans=spans[start:start + batch_size], process=process
+        )
+        buffer = TMemoryBuffer()
+        batch.write(TCompactProtocol(buffer))
+        size += len(buffer.getvalue())
+    return size
+
+
+def report(spans, process, batch_size, span_reporter):
+    # batches are split and encoded as the reporter sends them
+    size = 0
+    for start in range(0, len(spans), batch_size):
+        for batch in span_reporter.make_batches(
+                spans[start:start + batch_size], process
+        ):
+            size += len(reporter.encode(batch))
+    return size
+
+
+def run_scenario(framework, mode, options):
+    spans = make_spans(framework, options.spans, options.body_size)
+    process = thrift.make_process(
+        service_name='intracing-benchmark', tags={}, max_length=1024
+    )
+
+    if mode.startswith('reporter'):
+        span_reporter = reporter.IntracingReporter(channel=mock.Mock())
+        encode = functools.partial(report, span_reporter=span_reporter)
+    else:
+        encode = serialize
+    # every span was encoded to be measured before sizes were estimated
+    estimate_size = (reporter.get_size if mode == 'reporter-exact'
+                     else reporter.estimate_size)
+
+    reporter._encoded_strings.clear()
+    with mock.patch.object(TCompactProtocol, 'writeString',
+                           WRITE_STRING[mode]), \
+            mock.patch.object(reporter, 'estimate_size', estimate_size):
+        encode(spans[:options.batch_size], process, options.batch_size)
+        started = default_timer()
+        for _ in range(options.rounds):
+            size = encode(spans, process, options.batch_size)
+        elapsed = default_timer() - started
+
+    return OrderedDict((
+        ('framework', framework),
+        ('mode', mode),
+        ('spans', options.spans * options.rounds),
+        ('spans_per_sec', options.spans * options.rounds / elapsed),
+        ('bytes_per_span', size / float(options.spans)),
+    ))
+
+
+def run(options):
+    return [
+        run_scenario(framework, mode, options)
+        for framework in options.frameworks
+        for mode in options.modes
+    ]
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--spans', type=int, default=5000,
+                        help='number of spans per framework')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='number of times the spans are serialized')
+    parser.add_argument('--batch-size', type=int, default=10,
+                        help='number of spans per batch')
+    parser.add_argument('--body-size', type=int, default=0,
+                        help='size of captured request and response bodies')
+    parser.add_argument('--frameworks', nargs='+', choices=list(FRAMEWORKS),
+                        default=list(FRAMEWORKS))
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    results = run(options)
+    if options.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,48 @@
-import six
-from thrift.compat import str_to_binary
-from thrift.protocol.TCompactProtocol import TCompactProtocol
-
-try:
-    from .django import IntracingDjangoMiddleware  # noqa: F401
-    default_app_config = 'intracing.django.IntracingAppConfig'
-except ImportError:
-    pass
-
-try:
-    from .flask import configure_tracing  # noqa: F401
-except ImportError:
-    pass
-
-
-def write_string(proto, value):
-    if not isinstance(value, six.binary_type):
-        value = str_to_binary(value)
-    proto.writeBinary(value)
-
-
-# monkey patching in purpose to avoid Python 3 compatibility issue
-TCompactProtocol.writeString = write_string
+import importlib
+import sys
+
+# integrations are imported on first access to their attributes,
+# so importing the package alone doesn't import any framework
+LAZY_ATTRIBUTES = {
+    'IntracingDjangoMiddleware': '.django',
+    'configure_tracing': '.flask',
+    # thrift strings are written by it once the reporter is imported
+    'write_string': '.reporter',
+}
+DEFAULT_APP_CONFIG = 'intracing.django.IntracingAppConfig'
+
+
+def _import_attribute(name):
+    if name == 'default_app_config':
+        importlib.import_module('.django', __name__)
+        return DEFAULT_APP_CONFIG
+
+    module = importlib.import_module(LAZY_ATTRIBUTES[name], __name__)
+    return getattr(module, name)
+
+
+def __getattr__(name):
+    if name == 'default_app_config' or name in LAZY_ATTRIBUTES:
+        try:
+            value = _import_attribute(name)
+        except ImportError:
+            pass
+        else:
+            globals()[name] = value
+            return value
+
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name)
+    )
+
+
+if sys.version_info < (3, 7):
+    # module level `__getattr__` is not supported, see PEP 562
+    for _name in ['default_app_config'] + sorted(LAZY_ATTRIBUTES):
+        try:
+            globals()[_name] = _import_attribute(_name)
+        except ImportError:
+            pass
 
 
 __version__ = '1.2.0'
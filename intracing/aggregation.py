@@ -0,0 +1,187 @@
+import threading
+from collections import OrderedDict
+
+from jaeger_client import Tracer
+from opentracing.ext import tags
+
+from intracing.cache import make_tag
+
+DEFAULT_MAX_TRACES = 1000
+
+SPANS_DROPPED = 'spans.dropped'
+AGGREGATED_COUNT = 'aggregated.count'
+AGGREGATED_TOTAL = 'aggregated.duration.total'
+AGGREGATED_MIN = 'aggregated.duration.min'
+AGGREGATED_MAX = 'aggregated.duration.max'
+
+# tags identifying SQL queries and outbound HTTP requests
+STATEMENT_TAGS = frozenset([
+    'sql',
+    tags.DATABASE_STATEMENT,
+    tags.HTTP_METHOD,
+    tags.HTTP_URL,
+])
+
+
+def get_statement(span):
+    """Key of spans which can be aggregated, `None` for other spans"""
+
+    statement = []
+    for tag in span.tags:
+        if tag.key == tags.ERROR:
+            return None
+        if tag.key in STATEMENT_TAGS:
+            statement.append((tag.key, tag.vStr))
+
+    if statement:
+        return span.parent_id, span.operation_name, tuple(statement)
+
+
+class AggregatedSpan(object):
+    """Run of consecutive spans with the same statement
+
+    The first span stands for the whole run, it lasts until
+    the last one is finished and gets count and duration tags.
+    """
+
+    __slots__ = ('span', 'statement', 'count', 'total', 'min', 'max')
+
+    def __init__(self, span, statement):
+        duration = span.end_time - span.start_time
+        self.span = span
+        self.statement = statement
+        self.count = 1
+        self.total = self.min = self.max = duration
+
+    def add(self, span):
+        duration = span.end_time - span.start_time
+        self.count += 1
+        self.total += duration
+        self.min = min(self.min, duration)
+        self.max = max(self.max, duration)
+        self.span.end_time = max(self.span.end_time, span.end_time)
+
+    def finish(self):
+        if self.count > 1:
+            self.span.tags.extend([
+                make_tag(AGGREGATED_COUNT, self.count),
+                make_tag(AGGREGATED_TOTAL, self.total),
+                make_tag(AGGREGATED_MIN, self.min),
+                make_tag(AGGREGATED_MAX, self.max),
+            ])
+        return self.span
+
+
+class TraceState(object):
+    """Spans of a trace started in this process"""
+
+    __slots__ = ('root', 'started', 'dropped', 'pending')
+
+    def __init__(self, root):
+        self.root = root
+        self.started = 1
+        # IDs of spans above the limit, discarded when finished
+        self.dropped = set()
+        # parent span ID -> the last run of its children
+        self.pending = {}
+
+    def flush(self, parent_id=None):
+        if parent_id is None:
+            pending = list(self.pending.values())
+            self.pending.clear()
+        else:
+            aggregated = self.pending.pop(parent_id, None)
+            pending = [] if aggregated is None else [aggregated]
+        return [aggregated.finish() for aggregated in pending]
+
+
+class AggregatingTracer(Tracer):
+    """Tracer collapsing repeated client spans and capping trace size
+
+    The first sampled span of a trace started in this process is its root.
+    Consecutive spans with the same SQL statement or HTTP request
+    under one parent are reported as a single span once a different
+    sibling or the parent is finished.
+    Spans above `max_spans_per_trace` stay sampled, so that downstream
+    services keep tracing, but they are not reported,
+    their number is stored in `spans.dropped` tag of the root.
+    At most `max_traces` unfinished traces are tracked.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.span_aggregation = kwargs.pop('span_aggregation', False)
+        self.max_spans_per_trace = kwargs.pop('max_spans_per_trace', None)
+        self.max_traces = kwargs.pop('max_traces', DEFAULT_MAX_TRACES)
+        self._traces = OrderedDict()
+        self._traces_lock = threading.Lock()
+        super(AggregatingTracer, self).__init__(*args, **kwargs)
+        self.aggregated_counter = self.metrics_factory.create_counter(
+            name='intracing:aggregated_spans'
+        )
+        self.dropped_counter = self.metrics_factory.create_counter(
+            name='intracing:dropped_spans'
+        )
+
+    def start_span(self, *args, **kwargs):
+        span = super(AggregatingTracer, self).start_span(*args, **kwargs)
+        if span.is_sampled():
+            self._track_span(span)
+        return span
+
+    def _track_span(self, span):
+        evicted = []
+        dropped = False
+        with self._traces_lock:
+            trace = self._traces.get(span.trace_id)
+            if trace is None:
+                self._traces[span.trace_id] = TraceState(span)
+                while len(self._traces) > self.max_traces:
+                    evicted.extend(self._traces.popitem(last=False)[1].flush())
+            elif self.max_spans_per_trace and (
+                    trace.started >= self.max_spans_per_trace
+            ):
+                trace.dropped.add(span.span_id)
+                dropped = True
+            else:
+                trace.started += 1
+
+        self._report_spans(evicted)
+        if dropped:
+            self.dropped_counter(1)
+
+    def _report_spans(self, spans):
+        for span in spans:
+            super(AggregatingTracer, self).report_span(span)
+
+    def report_span(self, span):
+        with self._traces_lock:
+            trace = self._traces.get(span.trace_id)
+            if trace is None:
+                spans = [span]
+            elif span is trace.root:
+                del self._traces[span.trace_id]
+                spans = trace.flush()
+                if trace.dropped:
+                    span.tags.append(make_tag(SPANS_DROPPED, len(trace.dropped)))
+                spans.append(span)
+            elif span.span_id in trace.dropped:
+                spans = []
+            else:
+                spans = trace.flush(span.span_id)
+                spans.extend(self._aggregate(trace, span))
+
+        self._report_spans(spans)
+
+    def _aggregate(self, trace, span):
+        statement = self.span_aggregation and get_statement(span)
+        if not statement:
+            return [span]
+
+        aggregated = trace.pending.get(span.parent_id)
+        if aggregated is not None and aggregated.statement == statement:
+            aggregated.add(span)
+            self.aggregated_counter(1)
+            return []
+
+        trace.pending[span.parent_id] = AggregatedSpan(span, statement)
+        return [] if aggregated is None else [aggregated.finish()]
@@ -0,0 +1,144 @@
+from __future__ import absolute_import
+
+import opentracing
+from opentracing_instrumentation.request_context import RequestContextManager
+
+from .base import TracingHelper
+from .body import BodyPrefix
+from .context import use_contextvars
+from .stats import timed
+
+
+def get_headers(headers):
+    return {
+        key.decode('latin-1').lower(): value.decode('latin-1')
+        for key, value in headers
+    }
+
+
+def get_url(scope, headers):
+    host = headers.get('host')
+    if host is None:
+        server = scope.get('server')
+        host = '{}:{}'.format(*server) if server else 'localhost'
+
+    url = '{}://{}{}{}'.format(
+        scope.get('scheme', 'http'), host,
+        scope.get('root_path', ''), scope['path'],
+    )
+    query_string = scope.get('query_string')
+    if query_string:
+        url += '?' + query_string.decode('latin-1')
+    return url
+
+
+class IntracingASGIMiddleware(TracingHelper):
+    """ASGI middleware tracing HTTP requests
+
+    The current request context is kept in a context variable,
+    so the span is available across `await` points and in asyncio tasks.
+    Spans are handed over to the reporter's own IOLoop thread,
+    thus reporting never blocks the event loop.
+    """
+
+    COMPONENT = 'ASGI'
+
+    def __init__(self, app):
+        self.app = app
+        use_contextvars()
+        self.configure_tracing()
+
+    @classmethod
+    def get_http_body_prefix(cls, span):
+        if cls.should_store_http_body(span):
+            limit = cls.http_body_size_limit
+            return BodyPrefix(None if limit is None else limit + 1)
+
+    @timed('start_request_span')
+    def start_request_span(self, scope, headers):
+        tracer = opentracing.tracer
+        try:
+            span_context = tracer.extract(
+                opentracing.Format.HTTP_HEADERS, headers
+            )
+        except (opentracing.InvalidCarrierException,
+                opentracing.SpanContextCorruptedException):
+            span_context = None
+
+        span = tracer.start_span(
+            operation_name=scope['method'], child_of=span_context
+        )
+        self.set_request_tags(
+            span,
+            scope['method'],
+            get_url(scope, headers),
+            headers.get('user-agent'),
+            headers.get('content-type'),
+            None,
+            headers=headers.items(),
+        )
+        return span
+
+    @timed('finish_request_span')
+    def finish_request_span(self, span, scope, request_body, response,
+                            response_body):
+        # frameworks like Starlette put the matched endpoint into the scope
+        endpoint = scope.get('endpoint')
+        if endpoint is not None:
+            span.set_operation_name(endpoint.__name__)
+
+        if span.is_sampled():
+            self.set_route_tag(span, getattr(scope.get('route'), 'path', None))
+            if request_body is not None:
+                self.set_http_body_tag(span, 'request', request_body.value,
+                                       request_body.total)
+
+        self.set_response_tags(
+            span,
+            response.get('status_code', 500),
+            response.get('content_type'),
+            None if response_body is None else response_body.value,
+            None if response_body is None else response_body.total,
+            response.get('headers', {}).items(),
+        )
+        span.finish()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.tracing_configured or (
+                self.is_excluded_path(scope['path'])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        span = self.start_request_span(
+            scope, get_headers(scope.get('headers', ()))
+        )
+        request_body = self.get_http_body_prefix(span)
+        response_body = self.get_http_body_prefix(span)
+        response = {}
+
+        async def receive_message():
+            message = await receive()
+            if request_body is not None and message['type'] == 'http.request':
+                request_body.append(message.get('body', b''))
+            return message
+
+        async def send_message(message):
+            if message['type'] == 'http.response.start':
+                response['status_code'] = message['status']
+                response['headers'] = get_headers(message.get('headers', ()))
+                response['content_type'] = response['headers'].get(
+                    'content-type'
+                )
+            elif response_body is not None and (
+                    message['type'] == 'http.response.body'
+            ):
+                response_body.append(message.get('body', b''))
+            await send(message)
+
+        try:
+            with RequestContextManager(span):
+                await self.app(scope, receive_message, send_message)
+        finally:
+            self.finish_request_span(span, scope, request_body, response,
+                                     response_body)
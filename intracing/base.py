@@ -1,19 +1,83 @@
 import logging
 import os
+import threading
+import time
+import weakref
 
 import opentracing
-import six
-from jaeger_client.thrift_gen.jaeger.ttypes import Tag, TagType
-from jaeger_client.config import (
-    Config, DEFAULT_REPORTING_HOST, DEFAULT_REPORTING_PORT
-)
 from opentracing.ext import tags
-from opentracing_instrumentation.client_hooks import install_all_patches
 
 import intracing
+from intracing.body import BodyTee, peek_stream
+from intracing.capture import DeferredCapture, format_headers
+from intracing.profiling import (
+    DEFAULT_STACK_SAMPLING_INTERVAL,
+    PROFILE_STACK_SAMPLES,
+    PROFILE_STACKS,
+    RequestProfile,
+    StackSampler,
+    gc_monitor,
+    memory_profiles,
+)
+from intracing.routes import (
+    HTTP_ROUTE, RouteNames, compile_path_patterns, normalize_url
+)
+from intracing.stats import TracingStats
+
+CREATED_TAGS = 'intracing:created_tags'
+CACHED_TAGS = 'intracing:cached_tags'
+CACHE_HIT = (('result', 'hit'),)
+CACHE_MISS = (('result', 'miss'),)
+
+HTTP_BODY_BYTES = 'intracing:http_body_bytes'
+CAPTURED = (('result', 'captured'),)
+SKIPPED = (('result', 'skipped'),)
+DEFERRED_CAPTURES = 'intracing:deferred_captures'
+
+
+# attributes of jaeger tracers available through the wrapper
+TRACER_ATTRIBUTES = frozenset([
+    'close',
+    'codecs',
+    'max_tag_value_length',
+    'metrics',
+    'reporter',
+    'sampler',
+    'service_name',
+    'tags',
+])
 
 
 class IntracingTracerMixin(object):
+    """Tracer wrapper creating the actual tracer on demand
+
+    The actual tracer owns a reporter thread and a socket,
+    which don't survive forking, so it's dropped in forked processes
+    and created again once it's needed.
+    Attributes of `TRACER_ATTRIBUTES`, e.g. `close` or `reporter`,
+    are those of the actual tracer. Other ones aren't delegated,
+    so probing them doesn't create the tracer, e.g. before forking.
+    """
+
+    _tracer_getter = None
+    _tracer_instance = None
+    _tracer_lock = threading.Lock()
+
+    @property
+    def _tracer(self):
+        if self._tracer_instance is None:
+            with self._tracer_lock:
+                if self._tracer_instance is None:
+                    self._tracer_instance = self._tracer_getter()
+        return self._tracer_instance
+
+    def __getattr__(self, name):
+        if name not in TRACER_ATTRIBUTES:
+            raise AttributeError(name)
+        return getattr(self._tracer, name)
+
+    def reset_tracer(self):
+        self._tracer_instance = None
 
     def inject(self, *args, **kwargs):
         return self._tracer.inject(*args, **kwargs)
@@ -24,31 +88,90 @@ class IntracingTracerMixin(object):
     def start_span(self, *args, **kwargs):
         return self._tracer.start_span(*args, **kwargs)
 
+    def pop_span(self, request):
+        return self._current_spans.pop(request, None)
 
-class TracingHelperMetaclass(type):
 
-    def __new__(mcs, name, bases, class_dict):
-        component = class_dict.get('COMPONENT')
-        if component:
-            class_dict['TAG_COMPONENT'] = Tag(
-                key=tags.COMPONENT, vType=TagType.STRING, vStr=component
-            )
+class IntracingTracer(IntracingTracerMixin, opentracing.Tracer):
 
-        return super(TracingHelperMetaclass, mcs).__new__(
-            mcs, name, bases, class_dict
-        )
+    def __init__(self, tracer_getter):
+        super(IntracingTracer, self).__init__()
+        self._tracer_getter = tracer_getter
+
+
+def reset_tracer_after_fork():
+    # locks might have been held by other threads while forking
+    IntracingTracerMixin._tracer_lock = threading.Lock()
+    TracingHelper.reset_after_fork()
+    memory_profiles.reset_after_fork()
+    reset_tracer = getattr(opentracing.tracer, 'reset_tracer', None)
+    if reset_tracer is not None:
+        reset_tracer()
+
+
+class ConstantTag(object):
+    """Tag of a helper class, created on first access
+
+    Thrift tags are only created once they are needed,
+    so jaeger client isn't imported while tracing is disabled.
+    The value is given as it is or as a name of the helper's `attribute`.
+    """
+
+    def __init__(self, key, value=None, attribute=None):
+        self.key = key
+        self.value = value
+        self.attribute = attribute
+        # helper class -> its tag
+        self._tags = weakref.WeakKeyDictionary()
+
+    def __get__(self, instance, owner):
+        tag = self._tags.get(owner)
+        if tag is None:
+            from intracing.cache import make_tag
+
+            value = self.value
+            if self.attribute is not None:
+                value = getattr(owner, self.attribute)
+            if value is None:
+                return None
+            tag = self._tags[owner] = make_tag(self.key, value)
+        return tag
 
 
-@six.add_metaclass(TracingHelperMetaclass)
 class TracingHelper(object):
+    """Base tracing helper
+
+    Jaeger client and instrumentation libraries are only imported
+    once tracing is enabled, so disabled tracing costs nearly nothing.
+    """
+
+    COMPONENT = None
 
-    TAG_SPAN_KIND = Tag(key=tags.SPAN_KIND, vType=TagType.STRING,
-                        vStr=tags.SPAN_KIND_RPC_SERVER)
-    TAG_ERROR = Tag(key=tags.ERROR, vType=TagType.BOOL, vBool=True)
+    TAG_SPAN_KIND = ConstantTag(tags.SPAN_KIND, tags.SPAN_KIND_RPC_SERVER)
+    TAG_ERROR = ConstantTag(tags.ERROR, True)
+    # it's `None` unless the helper's component is set
+    TAG_COMPONENT = ConstantTag(tags.COMPONENT, attribute='COMPONENT')
+
+    stats = TracingStats()
+    tag_cache = None
+    route_names = RouteNames()
 
     tracing_configured = False
+    fork_hook_registered = False
     store_http_body = None
     http_body_size_limit = None
+    deferred_capture_threshold = None
+    # span -> bodies and headers waiting for the response
+    deferred_captures = weakref.WeakKeyDictionary()
+    profile_requests = None
+    profile_memory = None
+    # span -> resources used by its request so far
+    profiles = weakref.WeakKeyDictionary()
+    stack_sampler = None
+    route_operation_name = None
+    url_normalization = None
+    excluded_paths = None
+    context_backend = None
     config = None
 
     @classmethod
@@ -59,6 +182,10 @@ class TracingHelper(object):
 
     @classmethod
     def apply_patches(cls):
+        from opentracing_instrumentation.client_hooks import (
+            install_all_patches
+        )
+
         install_all_patches(
             requests_response_handler_hook=cls.requests_response_handler_hook
         )
@@ -66,57 +193,191 @@ class TracingHelper(object):
     @classmethod
     def set_content_type_tag(cls, span, origin, content_type):
         if content_type:
-            span.tags.append(Tag(
-                key='http.{}.content_type'.format(origin),
-                vType=TagType.STRING,
-                vStr=content_type
+            span.tags.append(cls.tag_cache.get(
+                'http.{}.content_type'.format(origin), content_type
             ))
 
     @classmethod
-    def set_http_body_tag(cls, span, origin, body):
-        if body and cls.store_http_body and (
-                cls.http_body_size_limit is None
-                or len(body) <= cls.http_body_size_limit
+    def should_store_http_body(cls, span):
+        return (
+            cls.store_http_body or cls.deferred_capture_threshold is not None
+        ) and span.is_sampled()
+
+    @classmethod
+    def peek_http_body(cls, stream):
+        limit = cls.http_body_size_limit
+        # one extra byte tells whether the body has to be truncated
+        return peek_stream(stream, None if limit is None else limit + 1)
+
+    @classmethod
+    def tee_http_body(cls, span, iterable, status_code, content_type,
+                      headers=None):
+        """Defer response tags and span finishing until the body is sent"""
+
+        def finish(body, body_size):
+            cls.set_response_tags(span, status_code, content_type, body,
+                                  body_size, headers)
+            span.finish()
+
+        limit = cls.http_body_size_limit
+        return BodyTee(iterable, None if limit is None else limit + 1, finish)
+
+    @classmethod
+    def set_http_body_tag(cls, span, origin, body, body_size=None):
+        """`body_size` is the full body size if `body` is just its prefix"""
+
+        if not body or not cls.store_http_body and (
+                cls.deferred_capture_threshold is None
         ):
-            span.tags.append(Tag(
-                key='http.{}.body'.format(origin),
-                vType=TagType.STRING,
-                vStr=body
+            return
+
+        if cls.deferred_capture_threshold is None:
+            cls.add_http_body_tag(span, origin, body, body_size)
+        else:
+            cls.get_deferred_capture(span).bodies[origin] = (body, body_size)
+
+    @classmethod
+    def add_http_body_tag(cls, span, origin, body, body_size):
+        body_size = max(body_size or 0, len(body))
+        limit = cls.http_body_size_limit
+        truncated = limit is not None and body_size > limit
+        if truncated:
+            body = body[:limit]
+
+        span.tags.append(cls.tag_cache.create(
+            'http.{}.body'.format(origin), body
+        ))
+        cls.stats.increment(CREATED_TAGS)
+        cls.stats.increment(HTTP_BODY_BYTES, len(body), CAPTURED)
+        if truncated:
+            span.tags.append(cls.tag_cache.get(
+                'http.{}.body.truncated'.format(origin), True
             ))
+            cls.stats.increment(HTTP_BODY_BYTES, body_size - limit, SKIPPED)
+
+    @classmethod
+    def set_http_headers(cls, span, origin, headers):
+        """Keep `(name, value)` pairs of headers in the deferred mode"""
+
+        if headers is not None and cls.deferred_capture_threshold is not None:
+            cls.get_deferred_capture(span).headers[origin] = headers
+
+    @classmethod
+    def get_deferred_capture(cls, span):
+        capture = cls.deferred_captures.get(span)
+        if capture is None:
+            capture = cls.deferred_captures[span] = DeferredCapture()
+        return capture
+
+    @classmethod
+    def finish_deferred_capture(cls, span, failed):
+        """Tag kept bodies and headers of slow or failed requests"""
+
+        capture = cls.deferred_captures.pop(span, None)
+        if capture is None:
+            return
+
+        if not failed and (
+                time.time() - span.start_time < cls.deferred_capture_threshold
+        ):
+            cls.stats.increment(DEFERRED_CAPTURES, 1, SKIPPED)
+            return
+
+        for origin, (body, body_size) in capture.bodies.items():
+            cls.add_http_body_tag(span, origin, body, body_size)
+        for origin, headers in capture.headers.items():
+            span.tags.append(cls.tag_cache.create(
+                'http.{}.headers'.format(origin), format_headers(headers)
+            ))
+            cls.stats.increment(CREATED_TAGS)
+        cls.stats.increment(DEFERRED_CAPTURES, 1, CAPTURED)
+
+    @classmethod
+    def start_profile(cls, span):
+        """Start measuring resources used by the request of `span`"""
+
+        if not span.is_sampled():
+            return
+
+        if cls.profile_requests:
+            cls.profiles[span] = RequestProfile(cls.profile_memory)
+        if cls.stack_sampler is not None:
+            cls.stack_sampler.track(span)
+
+    @classmethod
+    def finish_profile(cls, span):
+        values = []
+        profile = cls.profiles.pop(span, None)
+        if profile is not None:
+            values.extend(profile.finish())
+
+        samples = cls.stack_sampler and cls.stack_sampler.untrack(span)
+        if samples and samples.count:
+            values.append((PROFILE_STACK_SAMPLES, samples.count))
+            values.append((PROFILE_STACKS, samples.format()))
+
+        if values:
+            span.tags.extend(cls.tag_cache.create(key, value)
+                             for key, value in values)
+            cls.stats.increment(CREATED_TAGS, len(values))
 
     @classmethod
     def set_user_agent_tag(cls, span, user_agent):
         if user_agent:
-            span.tags.append(Tag(
-                key='http.user_agent',
-                vType=TagType.STRING,
-                vStr=user_agent
-            ))
+            span.tags.append(cls.tag_cache.get('http.user_agent', user_agent))
+
+    @classmethod
+    def set_route_tag(cls, span, route):
+        if route:
+            route_name = cls.route_names[route]
+            span.tags.append(cls.tag_cache.get(HTTP_ROUTE, route_name))
+            if cls.route_operation_name:
+                span.set_operation_name(route_name)
 
     @classmethod
     def set_request_tags(cls, span, method, url, user_agent,
-                         content_type, body):
+                         content_type, body, route=None, body_size=None,
+                         headers=None):
+        if not span.is_sampled():
+            return
+
+        if cls.url_normalization:
+            url = normalize_url(url)
+
         span.tags.append(cls.TAG_SPAN_KIND)
-        span.tags.append(cls.TAG_COMPONENT)
-        span.tags.append(Tag(
-            key=tags.HTTP_METHOD, vType=TagType.STRING, vStr=method
-        ))
-        span.tags.append(Tag(
-            key=tags.HTTP_URL, vType=TagType.STRING, vStr=url
-        ))
+        if cls.TAG_COMPONENT is not None:
+            span.tags.append(cls.TAG_COMPONENT)
+        span.tags.append(cls.tag_cache.get(tags.HTTP_METHOD, method))
+        span.tags.append(cls.tag_cache.create(tags.HTTP_URL, url))
+        cls.stats.increment(CREATED_TAGS)
+        cls.set_route_tag(span, route)
         cls.set_user_agent_tag(span, user_agent)
         cls.set_content_type_tag(span, 'request', content_type)
-        cls.set_http_body_tag(span, 'request', body)
+        cls.set_http_body_tag(span, 'request', body, body_size)
+        cls.set_http_headers(span, 'request', headers)
 
     @classmethod
-    def set_response_tags(cls, span, status_code, content_type, body):
+    def set_response_tags(cls, span, status_code, content_type, body,
+                          body_size=None, headers=None):
+        if not span.is_sampled():
+            return
+
         cls.set_content_type_tag(span, 'response', content_type)
-        cls.set_http_body_tag(span, 'response', body)
-        span.tags.append(Tag(
-            key=tags.HTTP_STATUS_CODE, vType=TagType.LONG, vLong=status_code
-        ))
-        if not 200 <= status_code < 300:
+        cls.set_http_body_tag(span, 'response', body, body_size)
+        cls.set_http_headers(span, 'response', headers)
+        span.tags.append(cls.tag_cache.get(tags.HTTP_STATUS_CODE, status_code))
+        failed = not 200 <= status_code < 300
+        if failed:
             span.tags.append(cls.TAG_ERROR)
+        cls.finish_deferred_capture(span, failed)
+        if cls.profile_requests or cls.stack_sampler is not None:
+            cls.finish_profile(span)
+
+    @classmethod
+    def is_excluded_path(cls, path):
+        return cls.excluded_paths is not None and bool(
+            cls.excluded_paths.match(path)
+        )
 
     @staticmethod
     def is_enabled(key):
@@ -132,12 +393,91 @@ class TracingHelper(object):
         if not cls.tracing_configured:
             cls._configure_tracing(*args, **kwargs)
 
+    @staticmethod
+    def get_int_env(key):
+        value = os.getenv(key)
+        if value:
+            return int(value)
+
+    @staticmethod
+    def get_sampler_config():
+        from jaeger_client.constants import SAMPLER_TYPE_CONST
+
+        sampler_config = {
+            'type': os.getenv('TRACING_SAMPLER_TYPE', SAMPLER_TYPE_CONST),
+            'param': os.getenv('TRACING_SAMPLER_PARAM', 1),
+        }
+        lower_bound = os.getenv('TRACING_SAMPLER_LOWER_BOUND')
+        if lower_bound:
+            sampler_config['lower_bound'] = lower_bound
+        return sampler_config
+
     @classmethod
     def init_config(cls):
+        from jaeger_client.config import (
+            DEFAULT_REPORTING_HOST,
+            DEFAULT_REPORTING_PORT,
+            DEFAULT_SAMPLING_PORT,
+        )
+        from jaeger_client.constants import (
+            DEFAULT_FLUSH_INTERVAL,
+            DEFAULT_SAMPLING_INTERVAL,
+        )
+
+        from intracing.cache import DEFAULT_TAG_CACHE_SIZE, TagCache
+        from intracing.config import IntracingConfig, StatsMetricsFactory
+        from intracing.reporter import (
+            DEFAULT_BATCH_SIZE,
+            DEFAULT_COLLECTOR_RETRIES,
+            DEFAULT_COLLECTOR_TIMEOUT,
+            DEFAULT_MAX_PACKET_SIZE,
+            DEFAULT_QUEUE_SIZE,
+            DEFAULT_SPOOL_SIZE,
+            DROP_NEWEST,
+        )
+
         cls.store_http_body = cls.is_enabled('TRACING_STORE_HTTP_BODY')
         http_body_size_limit = os.getenv('TRACING_HTTP_BODY_SIZE_LIMIT')
         if http_body_size_limit:
             cls.http_body_size_limit = int(http_body_size_limit)
+        deferred_capture_threshold = os.getenv(
+            'TRACING_DEFERRED_CAPTURE_THRESHOLD'
+        )
+        cls.deferred_capture_threshold = (
+            float(deferred_capture_threshold)
+            if deferred_capture_threshold else None
+        )
+
+        cls.profile_memory = cls.is_enabled('TRACING_PROFILE_MEMORY')
+        cls.profile_requests = cls.profile_memory or cls.is_enabled(
+            'TRACING_PROFILE_REQUESTS'
+        )
+        if cls.profile_requests:
+            gc_monitor.install()
+
+        if cls.stack_sampler is not None:
+            cls.stack_sampler.stop()
+        stack_sampling_threshold = os.getenv(
+            'TRACING_STACK_SAMPLING_THRESHOLD'
+        )
+        cls.stack_sampler = StackSampler(
+            float(stack_sampling_threshold),
+            float(os.getenv('TRACING_STACK_SAMPLING_INTERVAL',
+                            DEFAULT_STACK_SAMPLING_INTERVAL)),
+        ) if stack_sampling_threshold else None
+
+        cls.route_operation_name = cls.is_enabled(
+            'TRACING_ROUTE_OPERATION_NAME'
+        )
+        cls.url_normalization = cls.is_enabled('TRACING_NORMALIZE_URL')
+        cls.context_backend = os.getenv('TRACING_CONTEXT_BACKEND', 'auto')
+        cls.excluded_paths = compile_path_patterns(
+            os.getenv('TRACING_EXCLUDE_PATHS', '')
+        )
+
+        cls.tag_cache = TagCache(int(os.getenv(
+            'TRACING_TAG_CACHE_SIZE', DEFAULT_TAG_CACHE_SIZE
+        )))
 
         service_name = os.environ['TRACING_SERVICE_NAME']
         reporting_host = os.getenv('TRACING_AGENT_HOST',
@@ -145,24 +485,86 @@ class TracingHelper(object):
         reporting_port = os.getenv('TRACING_AGENT_PORT',
                                    DEFAULT_REPORTING_PORT)
 
-        cls.config = Config(
+        sampling_port = os.getenv('TRACING_SAMPLING_PORT',
+                                  DEFAULT_SAMPLING_PORT)
+
+        cls.config = IntracingConfig(
             config={
-                'sampler': {
-                    'type': 'const',
-                    'param': 1,
+                'sampler': cls.get_sampler_config(),
+                'sampling_refresh_interval': int(os.getenv(
+                    'TRACING_SAMPLING_REFRESH_INTERVAL',
+                    DEFAULT_SAMPLING_INTERVAL
+                )),
+                'max_operations': cls.get_int_env(
+                    'TRACING_SAMPLER_MAX_OPERATIONS'
+                ),
+                'reporter_queue_size': int(os.getenv(
+                    'TRACING_REPORTER_QUEUE_SIZE', DEFAULT_QUEUE_SIZE
+                )),
+                'reporter_batch_size': int(os.getenv(
+                    'TRACING_REPORTER_BATCH_SIZE', DEFAULT_BATCH_SIZE
+                )),
+                'reporter_flush_interval': float(os.getenv(
+                    'TRACING_REPORTER_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL
+                )),
+                'reporter_drop_policy': os.getenv(
+                    'TRACING_REPORTER_DROP_POLICY', DROP_NEWEST
+                ),
+                'reporter_max_packet_size': int(os.getenv(
+                    'TRACING_REPORTER_MAX_PACKET_SIZE', DEFAULT_MAX_PACKET_SIZE
+                )),
+                'collector': {
+                    'endpoint': os.getenv('TRACING_COLLECTOR_ENDPOINT'),
+                    'gzip': cls.is_enabled('TRACING_COLLECTOR_GZIP'),
+                    'retries': int(os.getenv(
+                        'TRACING_COLLECTOR_RETRIES', DEFAULT_COLLECTOR_RETRIES
+                    )),
+                    'timeout': float(os.getenv(
+                        'TRACING_COLLECTOR_TIMEOUT', DEFAULT_COLLECTOR_TIMEOUT
+                    )),
+                },
+                'spool': {
+                    'path': os.getenv('TRACING_SPOOL_PATH'),
+                    'size': int(os.getenv(
+                        'TRACING_SPOOL_SIZE', DEFAULT_SPOOL_SIZE
+                    )),
                 },
                 'local_agent': {
                     'reporting_host': reporting_host,
                     'reporting_port': reporting_port,
+                    'sampling_port': sampling_port,
                 },
+                'span_aggregation': cls.is_enabled(
+                    'TRACING_AGGREGATE_SPANS'
+                ),
+                'max_spans_per_trace': cls.get_int_env(
+                    'TRACING_MAX_SPANS_PER_TRACE'
+                ),
                 'logging': cls.is_enabled('TRACING_LOGGING'),
                 'tags': {
                     'intracing.version': intracing.__version__,
                 },
             },
             service_name=service_name,
+            metrics_factory=StatsMetricsFactory(cls.stats),
         )
 
+    @classmethod
+    def collect_stats(cls):
+        if cls.tag_cache is not None:
+            cls.stats.set_counter(CACHED_TAGS, cls.tag_cache.hits, CACHE_HIT)
+            cls.stats.set_counter(CACHED_TAGS, cls.tag_cache.misses,
+                                  CACHE_MISS)
+        return cls.stats
+
+    @classmethod
+    def get_stats(cls):
+        return cls.collect_stats().as_dict()
+
+    @classmethod
+    def get_stats_prometheus(cls):
+        return cls.collect_stats().as_prometheus()
+
     @classmethod
     def init_jaeger_tracer(cls):
         logging.debug('Initializing Jaeger tracer')
@@ -172,9 +574,13 @@ class TracingHelper(object):
 
     @classmethod
     def _configure_tracing(cls, *args, **kwargs):
+        from intracing.context import use_context_backend
+
         cls.init_config()
+        use_context_backend(cls.context_backend)
         opentracing.tracer = cls.get_tracer(*args, **kwargs)
         cls.configure_component(*args, **kwargs)
+        cls.register_fork_hook()
 
         try:
             from celery.signals import worker_init
@@ -185,11 +591,42 @@ class TracingHelper(object):
             def apply_patches(**kwargs):
                 cls.apply_patches()
 
+            cls.configure_celery()
+
         cls.tracing_configured = True
 
+    @classmethod
+    def configure_celery(cls):
+        from intracing.celery import CeleryTracing
+
+        CeleryTracing(cls).connect()
+
+    @classmethod
+    def reset_after_fork(cls):
+        """Reset locks and threads' state of `cls` and its subclasses"""
+
+        helpers = [cls]
+        for helper in helpers:
+            helpers.extend(helper.__subclasses__())
+            for name in ('stats', 'tag_cache', 'stack_sampler'):
+                value = vars(helper).get(name)
+                if value is not None:
+                    value.reset_after_fork()
+
+    @staticmethod
+    def register_fork_hook():
+        # preforking servers may configure tracing before forking workers
+        if TracingHelper.fork_hook_registered or not hasattr(
+                os, 'register_at_fork'
+        ):
+            return
+
+        os.register_at_fork(after_in_child=reset_tracer_after_fork)
+        TracingHelper.fork_hook_registered = True
+
     @classmethod
     def get_tracer(cls, *args, **kwargs):
-        return cls.init_jaeger_tracer()
+        return IntracingTracer(cls.init_jaeger_tracer)
 
     @classmethod
     def configure_component(cls, *args, **kwargs):
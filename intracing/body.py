@@ -0,0 +1,127 @@
+import six
+
+
+class PrefixedStream(object):
+    """File-like object that replays an already read prefix of a stream
+
+    It allows to look at the beginning of an HTTP body
+    without consuming the stream an application still needs.
+    """
+
+    def __init__(self, prefix, stream):
+        self._prefix = prefix
+        self._stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def _read_prefix(self, size):
+        chunk, self._prefix = self._prefix[:size], self._prefix[size:]
+        return chunk
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            return self._read_prefix(len(self._prefix)) + self._stream.read()
+
+        chunk = self._read_prefix(size)
+        if len(chunk) < size:
+            chunk += self._stream.read(size - len(chunk))
+        return chunk
+
+    def readline(self, size=None):
+        if size is None or size < 0:
+            size = None
+        line_end = self._prefix.find(b'\n') + 1
+        if line_end and (size is None or line_end <= size):
+            return self._read_prefix(line_end)
+        if size is not None and size <= len(self._prefix):
+            return self._read_prefix(size)
+
+        line = self._read_prefix(len(self._prefix))
+        if size is None:
+            return line + self._stream.readline()
+        return line + self._stream.readline(size - len(line))
+
+
+def peek_stream(stream, size=None):
+    """Read at most `size` bytes from `stream` (everything if `size` is None)
+
+    Returns the read bytes along with a stream
+    that should be used instead of the original one.
+    """
+    if size is None:
+        prefix = stream.read()
+    else:
+        prefix = b''
+        while len(prefix) < size:
+            chunk = stream.read(size - len(prefix))
+            if not chunk:
+                break
+            prefix += chunk
+
+    return prefix, PrefixedStream(prefix, stream)
+
+
+class BodyPrefix(object):
+    """Beginning of an HTTP body received in chunks
+
+    Only the first `size` bytes are kept (everything if `size` is None),
+    while the total body size is counted.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._chunks = []
+        self._kept = 0
+        self.total = 0
+
+    @property
+    def value(self):
+        return b''.join(self._chunks)
+
+    def append(self, chunk):
+        self.total += len(chunk)
+        if self._size is not None:
+            if self._kept >= self._size:
+                return
+            chunk = chunk[:self._size - self._kept]
+        if isinstance(chunk, six.text_type):
+            chunk = chunk.encode('utf-8')
+        self._chunks.append(chunk)
+        self._kept += len(chunk)
+
+
+class BodyTee(object):
+    """Iterable wrapper keeping the beginning of a streamed HTTP body
+
+    Chunks are passed through untouched as soon as they are produced,
+    only the first `size` bytes are kept (everything if `size` is None).
+    The kept bytes are passed to `callback` along with the total body size
+    once the iterable is closed.
+    """
+
+    def __init__(self, iterable, size, callback):
+        self._iterable = iterable
+        self._prefix = BodyPrefix(size)
+        self._callback = callback
+        self._closed = False
+
+    def __iter__(self):
+        for chunk in self._iterable:
+            self._prefix.append(chunk)
+            yield chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+
+        try:
+            close = getattr(self._iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._callback(self._prefix.value, self._prefix.total)
@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+
+import six
+from jaeger_client.thrift_gen.jaeger.ttypes import Tag, TagType
+
+DEFAULT_TAG_CACHE_SIZE = 1024
+
+
+def make_tag(key, value):
+    if isinstance(value, bool):
+        return Tag(key=key, vType=TagType.BOOL, vBool=value)
+    if isinstance(value, six.integer_types):
+        return Tag(key=key, vType=TagType.LONG, vLong=value)
+    if isinstance(value, float):
+        return Tag(key=key, vType=TagType.DOUBLE, vDouble=value)
+    return Tag(key=key, vType=TagType.STRING, vStr=value)
+
+
+class TagCache(object):
+    """Bounded LRU cache of tags with low-cardinality values
+
+    Cached tags are shared between spans, so they must not be modified.
+    """
+
+    def __init__(self, size=DEFAULT_TAG_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._tags = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tags)
+
+    def reset_after_fork(self):
+        # the lock might have been held by another thread while forking
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def create(key, value):
+        """Create a tag bypassing the cache, e.g. for unique values"""
+
+        return make_tag(key, value)
+
+    def get(self, key, value):
+        # value type distinguishes e.g. True from 1
+        cache_key = (key, type(value), value)
+        with self._lock:
+            tag = self._tags.pop(cache_key, None)
+            if tag is not None:
+                self.hits += 1
+                self._tags[cache_key] = tag
+                return tag
+            self.misses += 1
+
+        tag = make_tag(key, value)
+        if self.size:
+            with self._lock:
+                self._tags[cache_key] = tag
+                if len(self._tags) > self.size:
+                    self._tags.popitem(last=False)
+        return tag
+
+    def clear(self):
+        with self._lock:
+            self._tags.clear()
+            self.hits = self.misses = 0
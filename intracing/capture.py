@@ -0,0 +1,32 @@
+# headers carrying credentials are never stored
+REDACTED_HEADERS = frozenset([
+    'authorization',
+    'cookie',
+    'proxy-authorization',
+    'set-cookie',
+])
+
+
+def format_headers(headers):
+    """`Name: value` lines of `(name, value)` pairs"""
+
+    return u'\n'.join(
+        u'{}: {}'.format(name, value) for name, value in headers
+        if name.lower() not in REDACTED_HEADERS
+    )
+
+
+class DeferredCapture(object):
+    """HTTP bodies and headers kept until the request is finished
+
+    They are only referenced, so nothing is copied or encoded
+    unless the request turns out to be slow or failed.
+    """
+
+    __slots__ = ('bodies', 'headers')
+
+    def __init__(self):
+        # origin -> (body, full body size)
+        self.bodies = {}
+        # origin -> iterable of (name, value) pairs
+        self.headers = {}
@@ -0,0 +1,180 @@
+from __future__ import absolute_import
+
+import threading
+from timeit import default_timer
+
+import opentracing
+from celery import signals
+from opentracing.ext import tags
+from opentracing_instrumentation.request_context import (
+    RequestContextManager,
+    get_current_span,
+)
+
+from intracing.stats import timed
+
+COMPONENT = 'Celery'
+# message header carrying the span context
+TRACING_HEADER = 'intracing'
+
+SPAN_KIND_PRODUCER = 'producer'
+SPAN_KIND_CONSUMER = 'consumer'
+
+TASK_NAME = 'celery.task_name'
+TASK_ID = 'celery.task_id'
+QUEUE = 'celery.queue'
+RETRIES = 'celery.retries'
+STATE = 'celery.state'
+RUNTIME = 'celery.runtime'
+
+SIGNALS = (
+    'before_task_publish',
+    'after_task_publish',
+    'task_prerun',
+    'task_failure',
+    'task_postrun',
+)
+
+
+def get_carrier(request):
+    carrier = request.get(TRACING_HEADER)
+    if carrier is None:
+        # custom headers are nested in some versions of Celery
+        carrier = (request.get('headers') or {}).get(TRACING_HEADER)
+    return carrier
+
+
+class CeleryTracing(object):
+    """Celery signal handlers tracing publishing and execution of tasks
+
+    The span context is passed to workers in the message headers.
+    Tags are created by the tracing helper the handlers are bound to.
+    """
+
+    def __init__(self, helper):
+        self.helper = helper
+        self.stats = helper.stats
+        self._publishing = threading.local()
+
+    def connect(self):
+        # the last configured helper replaces the previous handlers
+        for name in SIGNALS:
+            signal = getattr(signals, name)
+            dispatch_uid = 'intracing.' + name
+            signal.disconnect(dispatch_uid=dispatch_uid)
+            signal.connect(getattr(self, name), weak=False,
+                           dispatch_uid=dispatch_uid)
+
+    def set_tags(self, span, span_kind, task_name, task_id, queue):
+        tag_cache = self.helper.tag_cache
+        span.tags.append(tag_cache.get(tags.SPAN_KIND, span_kind))
+        span.tags.append(tag_cache.get(tags.COMPONENT, COMPONENT))
+        span.tags.append(tag_cache.get(TASK_NAME, task_name))
+        span.tags.append(tag_cache.create(TASK_ID, task_id))
+        if queue:
+            span.tags.append(tag_cache.get(QUEUE, queue))
+            span.tags.append(tag_cache.get(
+                tags.MESSAGE_BUS_DESTINATION, queue
+            ))
+
+    def finish_failed_publish(self):
+        """Finish the span of the previous publish if it's still kept
+
+        `after_task_publish` isn't sent when publishing fails,
+        e.g. the broker is unavailable, so the span is marked as failed.
+        """
+
+        _, span = getattr(self._publishing, 'task', (None, None))
+        if span is None:
+            return
+
+        del self._publishing.task
+        if span.is_sampled():
+            span.tags.append(self.helper.TAG_ERROR)
+            span.log_kv({'event': tags.ERROR,
+                         'message': 'Task was not published'})
+        span.finish()
+
+    @timed('before_task_publish')
+    def before_task_publish(self, sender=None, headers=None,
+                            routing_key=None, **kwargs):
+        self.finish_failed_publish()
+        if headers is None:
+            return
+
+        task_id = headers.get('id')
+        span = opentracing.tracer.start_span(
+            operation_name='apply_async:{}'.format(sender),
+            child_of=get_current_span(),
+        )
+        if span.is_sampled():
+            self.set_tags(span, SPAN_KIND_PRODUCER, sender, task_id,
+                          routing_key)
+
+        carrier = {}
+        opentracing.tracer.inject(
+            span.context, opentracing.Format.TEXT_MAP, carrier
+        )
+        headers[TRACING_HEADER] = carrier
+        # publishing is synchronous, so only the last span is kept
+        self._publishing.task = task_id, span
+
+    @timed('after_task_publish')
+    def after_task_publish(self, headers=None, **kwargs):
+        task_id, span = getattr(self._publishing, 'task', (None, None))
+        if span is not None and task_id == (headers or {}).get('id'):
+            del self._publishing.task
+            span.finish()
+
+    @timed('task_prerun')
+    def task_prerun(self, task_id=None, task=None, **kwargs):
+        request = task.request
+        try:
+            span_context = opentracing.tracer.extract(
+                opentracing.Format.TEXT_MAP, get_carrier(request) or {}
+            )
+        except (opentracing.InvalidCarrierException,
+                opentracing.SpanContextCorruptedException):
+            span_context = None
+
+        span = opentracing.tracer.start_span(
+            operation_name=task.name, child_of=span_context
+        )
+        if span.is_sampled():
+            delivery_info = request.delivery_info or {}
+            self.set_tags(span, SPAN_KIND_CONSUMER, task.name, task_id,
+                          delivery_info.get('routing_key'))
+            span.tags.append(self.helper.tag_cache.get(
+                RETRIES, request.retries or 0
+            ))
+
+        request.tracing_span = span
+        request.tracing_started = default_timer()
+        request.tracing_context = RequestContextManager(span)
+        request.tracing_context.__enter__()
+
+    @timed('task_failure')
+    def task_failure(self, exception=None, sender=None, **kwargs):
+        span = getattr(sender.request, 'tracing_span', None)
+        if span is not None and span.is_sampled():
+            span.tags.append(self.helper.TAG_ERROR)
+            span.log_kv({'event': tags.ERROR, 'error.object': exception})
+
+    @timed('task_postrun')
+    def task_postrun(self, task=None, state=None, **kwargs):
+        request = task.request
+        span = getattr(request, 'tracing_span', None)
+        if span is None:
+            return
+
+        request.tracing_context.__exit__()
+        if span.is_sampled():
+            tag_cache = self.helper.tag_cache
+            if state:
+                span.tags.append(tag_cache.get(STATE, state))
+            span.tags.append(tag_cache.create(
+                RUNTIME, default_timer() - request.tracing_started
+            ))
+
+        del request.tracing_span
+        span.finish()
@@ -0,0 +1,225 @@
+from jaeger_client.config import Config, logger
+from jaeger_client.constants import SAMPLER_TYPE_REMOTE
+from jaeger_client.metrics import MetricsFactory
+from jaeger_client.reporter import CompositeReporter, LoggingReporter
+from jaeger_client.sampler import (
+    AdaptiveSampler,
+    RemoteControlledSampler,
+    DEFAULT_LOWER_BOUND,
+    DEFAULT_LOWER_BOUND_STR,
+    DEFAULT_MAX_OPERATIONS,
+    DEFAULT_SAMPLING_PROBABILITY_STR,
+)
+from jaeger_client.throttler import RemoteThrottler
+
+from intracing.aggregation import AggregatingTracer
+from intracing.reporter import (
+    DEFAULT_COLLECTOR_RETRIES,
+    DEFAULT_COLLECTOR_TIMEOUT,
+    DEFAULT_MAX_PACKET_SIZE,
+    DEFAULT_SPOOL_SIZE,
+    DROP_NEWEST,
+    IntracingAgentSender,
+    IntracingHTTPReporter,
+    IntracingReporter,
+)
+from intracing.stats import get_labels
+
+SAMPLER_TYPE_ADAPTIVE = 'adaptive'
+
+
+class IntracingConfig(Config):
+
+    @property
+    def sampler(self):
+        sampler_config = self.config.get('sampler', {})
+        sampler_type = sampler_config.get('type')
+
+        if sampler_type == SAMPLER_TYPE_REMOTE:
+            # jaeger-client falls back to RemoteControlledSampler
+            # when no sampler is provided
+            return None
+
+        if sampler_type == SAMPLER_TYPE_ADAPTIVE:
+            return AdaptiveSampler(
+                strategies={
+                    DEFAULT_SAMPLING_PROBABILITY_STR: float(
+                        sampler_config.get('param')
+                    ),
+                    DEFAULT_LOWER_BOUND_STR: float(
+                        sampler_config.get('lower_bound', DEFAULT_LOWER_BOUND)
+                    ),
+                },
+                max_operations=self.max_operations or DEFAULT_MAX_OPERATIONS,
+            )
+
+        return super(IntracingConfig, self).sampler
+
+    @property
+    def reporter_drop_policy(self):
+        return self.config.get('reporter_drop_policy', DROP_NEWEST)
+
+    @property
+    def reporter_max_packet_size(self):
+        return self.config.get('reporter_max_packet_size',
+                               DEFAULT_MAX_PACKET_SIZE)
+
+    @property
+    def collector_endpoint(self):
+        return self.config.get('collector', {}).get('endpoint')
+
+    @property
+    def spool_path(self):
+        return self.config.get('spool', {}).get('path')
+
+    @property
+    def spool_size(self):
+        return self.config['spool'].get('size', DEFAULT_SPOOL_SIZE)
+
+    def create_spool(self):
+        if self.spool_path:
+            # the spool relies on fcntl, so it's only imported when used
+            from intracing.spool import open_spool
+
+            # every process needs a spool of its own
+            return open_spool(self.spool_path, self.spool_size)
+
+    def _create_local_agent_channel(self, io_loop):
+        if not self.spool_path:
+            return super(IntracingConfig, self)._create_local_agent_channel(
+                io_loop
+            )
+
+        # failed sends are only noticed with the connected UDP transport
+        logger.info('Initializing Jaeger Tracer with UDP reporter')
+        return IntracingAgentSender(
+            host=self.local_agent_reporting_host,
+            sampling_port=self.local_agent_sampling_port,
+            reporting_port=self.local_agent_reporting_port,
+            throttling_port=self.throttler_port,
+            io_loop=io_loop,
+        )
+
+    def create_reporter(self, channel):
+        kwargs = {
+            'channel': channel,
+            'queue_capacity': self.reporter_queue_size,
+            'batch_size': self.reporter_batch_size,
+            'flush_interval': self.reporter_flush_interval,
+            'drop_policy': self.reporter_drop_policy,
+            'logger': logger,
+            'metrics_factory': self._metrics_factory,
+            'error_reporter': self.error_reporter,
+            'spool': self.create_spool(),
+        }
+        if self.collector_endpoint:
+            collector_config = self.config['collector']
+            return IntracingHTTPReporter(
+                endpoint=self.collector_endpoint,
+                gzip=collector_config.get('gzip', False),
+                retries=collector_config.get(
+                    'retries', DEFAULT_COLLECTOR_RETRIES
+                ),
+                timeout=collector_config.get(
+                    'timeout', DEFAULT_COLLECTOR_TIMEOUT
+                ),
+                **kwargs
+            )
+
+        return IntracingReporter(
+            max_packet_size=self.reporter_max_packet_size,
+            **kwargs
+        )
+
+    @property
+    def span_aggregation(self):
+        return self.config.get('span_aggregation', False)
+
+    @property
+    def max_spans_per_trace(self):
+        return self.config.get('max_spans_per_trace')
+
+    def create_tracer(self, reporter, sampler, throttler=None):
+        if not self.span_aggregation and not self.max_spans_per_trace:
+            return super(IntracingConfig, self).create_tracer(
+                reporter, sampler, throttler
+            )
+
+        return AggregatingTracer(
+            service_name=self.service_name,
+            reporter=reporter,
+            sampler=sampler,
+            metrics_factory=self._metrics_factory,
+            trace_id_header=self.trace_id_header,
+            baggage_header_prefix=self.baggage_header_prefix,
+            debug_id_header=self.debug_id_header,
+            tags=self.tags,
+            max_tag_value_length=self.max_tag_value_length,
+            extra_codecs=self.propagation,
+            throttler=throttler,
+            span_aggregation=self.span_aggregation,
+            max_spans_per_trace=self.max_spans_per_trace,
+        )
+
+    def new_tracer(self, io_loop=None):
+        # it follows the original implementation,
+        # but the reporter is created by `create_reporter`
+        channel = self._create_local_agent_channel(io_loop=io_loop)
+        sampler = self.sampler
+        if not sampler:
+            sampler = RemoteControlledSampler(
+                channel=channel,
+                service_name=self.service_name,
+                logger=logger,
+                metrics_factory=self._metrics_factory,
+                error_reporter=self.error_reporter,
+                sampling_refresh_interval=self.sampling_refresh_interval,
+                max_operations=self.max_operations,
+            )
+        logger.info('Using sampler %s', sampler)
+
+        reporter = self.create_reporter(channel)
+        if self.logging:
+            reporter = CompositeReporter(reporter, LoggingReporter(logger))
+
+        if self.throttler_group() is not None:
+            throttler = RemoteThrottler(
+                channel,
+                self.service_name,
+                refresh_interval=self.throttler_refresh_interval,
+                logger=logger,
+                metrics_factory=self._metrics_factory,
+                error_reporter=self.error_reporter,
+            )
+        else:
+            throttler = None
+
+        return self.create_tracer(
+            reporter=reporter,
+            sampler=sampler,
+            throttler=throttler,
+        )
+
+
+class StatsMetricsFactory(MetricsFactory):
+    """Collects jaeger-client metrics into TracingStats"""
+
+    def __init__(self, stats):
+        super(StatsMetricsFactory, self).__init__()
+        self.stats = stats
+
+    def create_counter(self, name, tags=None):
+        labels = get_labels(tags)
+
+        def increment(value):
+            self.stats.increment(name, value, labels)
+
+        return increment
+
+    def create_gauge(self, name, tags=None):
+        labels = get_labels(tags)
+
+        def update(value):
+            self.stats.set_gauge(name, value, labels)
+
+        return update
@@ -0,0 +1,89 @@
+import sys
+import threading
+
+from opentracing_instrumentation.request_context import RequestContextManager
+
+try:
+    from contextvars import ContextVar
+except ImportError:  # Python < 3.7
+    ContextVar = None
+
+AUTO = 'auto'
+THREAD = 'thread'
+CONTEXTVARS = 'contextvars'
+GEVENT = 'gevent'
+EVENTLET = 'eventlet'
+# greenlet libraries in order of detection
+GREENLET_BACKENDS = (GEVENT, EVENTLET)
+
+
+class ContextVarState(object):
+    """Request context storage based on a context variable
+
+    It replaces the thread-local state of `RequestContextManager`,
+    so the current span follows across `await` points and asyncio tasks,
+    while every thread still has its own context.
+    """
+
+    def __init__(self, name):
+        self._context = ContextVar(name, default=None)
+
+    @property
+    def context(self):
+        return self._context.get()
+
+    @context.setter
+    def context(self, value):
+        self._context.set(value)
+
+
+def use_contextvars():
+    if ContextVar is None:
+        raise RuntimeError('contextvars are not available')
+
+    if not isinstance(RequestContextManager._state, ContextVarState):
+        RequestContextManager._state = ContextVarState(
+            'intracing_request_context'
+        )
+
+
+def get_greenlet_local(backend):
+    if backend == GEVENT:
+        from gevent.local import local
+    else:
+        from eventlet.corolocal import local
+    return local
+
+
+def use_context_backend(backend=AUTO):
+    """Store the request context according to the concurrency model
+
+    `thread` keeps it in a thread-local, `contextvars` in a context variable,
+    `gevent` and `eventlet` in a greenlet-local, so concurrent greenlets
+    of a thread don't overwrite each other's span.
+    `auto` switches to a greenlet-local once gevent or eventlet is imported,
+    unless the thread-local has already been replaced, e.g. by ASGI apps.
+    """
+    if backend == AUTO:
+        if type(RequestContextManager._state) is not threading.local:
+            return
+        backend = next((
+            name for name in GREENLET_BACKENDS
+            if sys.modules.get(name) is not None
+        ), None)
+        if backend is None:
+            return
+
+    if backend == CONTEXTVARS:
+        use_contextvars()
+        return
+
+    if backend == THREAD:
+        local = threading.local
+    elif backend in GREENLET_BACKENDS:
+        local = get_greenlet_local(backend)
+    else:
+        raise ValueError('Unknown context backend: {}'.format(backend))
+
+    if type(RequestContextManager._state) is not local:
+        RequestContextManager._state = local()
@@ -1,14 +1,37 @@
 from __future__ import absolute_import
 
+import weakref
+
 import opentracing
+import six
 from django.apps import AppConfig
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 
 from django_opentracing import DjangoTracer, OpenTracingMiddleware
+from opentracing.ext import tags
 from opentracing_instrumentation.request_context import RequestContextManager
 
 from intracing.base import IntracingTracerMixin, TracingHelper
+from intracing.routes import compile_path_patterns
+from intracing.stats import timed
+
+if six.PY2:
+    class AsyncMiddlewareMixin(object):
+
+        def _async_check(self):
+            pass
+else:
+    from intracing.django_async import AsyncMiddlewareMixin
+
+
+def get_request_headers(request):
+    # `request.headers` isn't available before Django 2.2
+    return (
+        (key[5:].replace('_', '-').title(), value)
+        for key, value in six.iteritems(request.META)
+        if key.startswith('HTTP_')
+    )
 
 
 class IntracingAppConfig(AppConfig):
@@ -21,19 +44,15 @@ class IntracingAppConfig(AppConfig):
 class IntracingDjangoTracer(IntracingTracerMixin, DjangoTracer):
 
     def __init__(self, tracer_getter):
-        self.__tracer = None
-        self.__tracer_getter = tracer_getter
-        self._current_spans = {}
+        self._tracer_getter = tracer_getter
+        # requests which never reach `process_response`
+        # shouldn't keep their spans in memory
+        self._current_spans = weakref.WeakKeyDictionary()
         self._trace_all = True
 
-    @property
-    def _tracer(self):
-        if not self.__tracer:
-            self.__tracer = self.__tracer_getter()
-        return self.__tracer
-
 
-class IntracingDjangoMiddleware(OpenTracingMiddleware, TracingHelper):
+class IntracingDjangoMiddleware(AsyncMiddlewareMixin, OpenTracingMiddleware,
+                                TracingHelper):
 
     COMPONENT = 'Django'
 
@@ -49,55 +68,105 @@ class IntracingDjangoMiddleware(OpenTracingMiddleware, TracingHelper):
             settings.MIDDLEWARE = []
         if middleware_path not in settings.MIDDLEWARE:
             settings.MIDDLEWARE.insert(0, middleware_path)
+        excluded_paths = getattr(settings, 'TRACING_EXCLUDE_PATHS', None)
+        if excluded_paths is not None:
+            cls.excluded_paths = compile_path_patterns(excluded_paths)
 
     def __init__(self, get_response):
         self.get_response = get_response
         self._tracer = opentracing.tracer
+        self._async_check()
 
-    def _get_request_body(self, request):
+    def _get_request_body(self, request, span):
         # we should avoid getting of the body
         # in case it would cause an exception
-        if self.store_http_body and (
-                settings.DATA_UPLOAD_MAX_MEMORY_SIZE is None or
+        if not self.should_store_http_body(span) or (
+                settings.DATA_UPLOAD_MAX_MEMORY_SIZE is not None and
                 int(
                     request.META.get('CONTENT_LENGTH') or 0
-                ) <= settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+                ) > settings.DATA_UPLOAD_MAX_MEMORY_SIZE
         ):
-            return request.body
+            return None
+
+        if hasattr(request, '_body'):
+            return request._body
+
+        # the body has already been partially consumed, e.g. by a parser
+        if request._read_started:
+            return None
 
-    def _get_response_body(self, response):
+        body, request._stream = self.peek_http_body(request._stream)
+        return body
+
+    def _get_response_body(self, response, span):
         # not every response has some content, e.g.
         # StreamingHttpResponse has no content due to its nature
-        if self.store_http_body and isinstance(response, HttpResponse):
+        if self.should_store_http_body(span) and isinstance(
+                response, HttpResponse
+        ):
             return response.content
 
+    @timed('process_view')
     def process_view(self, request, view_func, view_args, view_kwargs):
+        if self.is_excluded_path(request.path):
+            return
+
         super(IntracingDjangoMiddleware, self).process_view(
             request, view_func, view_args, view_kwargs
         )
         span = opentracing.tracer.get_span(request)
+        self.start_profile(span)
         self.set_request_tags(
             span,
             request.method,
             request.get_raw_uri(),
             request.META.get('HTTP_USER_AGENT'),
             request.content_type,
-            self._get_request_body(request),
+            self._get_request_body(request, span),
+            getattr(request.resolver_match, 'route', None),
+            int(request.META.get('CONTENT_LENGTH') or 0) or None,
+            get_request_headers(request),
         )
         request.tracing_context = RequestContextManager(span)
         request.tracing_context.__enter__()
 
+    def process_exception(self, request, exception):
+        # the span is finished later by `process_response`
+        # along with the response status code
+        span = opentracing.tracer.get_span(request)
+        if span is not None:
+            span.log_kv({'event': tags.ERROR, 'error.object': exception})
+
+    @staticmethod
+    def _is_streamed(response):
+        # files might be sent by the server bypassing response iteration
+        return isinstance(response, StreamingHttpResponse) and not isinstance(
+            response, FileResponse
+        )
+
+    @timed('process_response')
     def process_response(self, request, response):
         span = opentracing.tracer.get_span(request)
         if span is None:
             return response
 
-        self.set_response_tags(
-            span,
-            response.status_code,
-            response.get('Content-Type'),
-            self._get_response_body(response),
-        )
+        if self._is_streamed(response) and self.should_store_http_body(span):
+            opentracing.tracer.pop_span(request)
+            response.streaming_content = self.tee_http_body(
+                span,
+                response.streaming_content,
+                response.status_code,
+                response.get('Content-Type'),
+                response.items(),
+            )
+        else:
+            self.set_response_tags(
+                span,
+                response.status_code,
+                response.get('Content-Type'),
+                self._get_response_body(response, span),
+                headers=response.items(),
+            )
         response = super(IntracingDjangoMiddleware, self).process_response(
             request, response
         )
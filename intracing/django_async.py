@@ -0,0 +1,33 @@
+import asyncio
+
+from .context import use_contextvars
+
+
+class AsyncMiddlewareMixin(object):
+    """Lets the tracing middleware run natively under ASGI
+
+    The hooks only deal with in-memory data and the reporter never blocks,
+    so in async mode they are called right from the event loop
+    instead of being sent to a thread with `sync_to_async`.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def _async_check(self):
+        if asyncio.iscoroutinefunction(self.get_response):
+            use_contextvars()
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            # Django adapts sync hooks with `sync_to_async`,
+            # so the hook is replaced with a coroutine function
+            self.process_view = self._process_view_async
+
+    async def _process_view_async(self, request, view_func, view_args,
+                                  view_kwargs):
+        return type(self).process_view(
+            self, request, view_func, view_args, view_kwargs
+        )
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        return self.process_response(request, response)
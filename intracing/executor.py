@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from opentracing_instrumentation.request_context import RequestContextManager
+
+
+def wrap_context(func):
+    """Run `func` in the request context which is active now
+
+    The current span follows the function to another thread,
+    so spans started there become children of the request span.
+    Functions are returned as they are outside of request contexts.
+    """
+    context = RequestContextManager.current_context()
+    if context is None:
+        return func
+
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        # the state is a thread-local or a context variable
+        state = RequestContextManager._state
+        previous_context = getattr(state, 'context', None)
+        state.context = context
+        try:
+            return func(*args, **kwargs)
+        finally:
+            state.context = previous_context
+
+    return wrapped
+
+
+def propagate_context(submit):
+    """Decorate `submit` method of an executor to propagate request context
+
+    E.g. `executor.submit = propagate_context(executor.submit)`
+    """
+
+    @wraps(submit)
+    def wrapped(fn, *args, **kwargs):
+        return submit(wrap_context(fn), *args, **kwargs)
+
+    return wrapped
+
+
+class TracingThreadPoolExecutor(ThreadPoolExecutor):
+    """Thread pool running tasks in the request context of their submitter
+
+    It works for `map` too, as well as for asyncio's `run_in_executor`
+    once it's set as the default executor of the event loop.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        return super(TracingThreadPoolExecutor, self).submit(
+            wrap_context(fn), *args, **kwargs
+        )
@@ -1,15 +1,35 @@
 from __future__ import absolute_import
 
 import opentracing
-from flask import request
+from flask import _request_ctx_stack as stack, request
 from flask_opentracing import FlaskTracer
 from opentracing_instrumentation.request_context import RequestContextManager
 
 from .base import IntracingTracerMixin, TracingHelper
+from .routes import compile_path_patterns
+from .stats import timed
 
 
 class IntracingFlaskTracer(IntracingTracerMixin, FlaskTracer):
-    pass
+
+    def __init__(self, tracer_getter, *args, **kwargs):
+        self._tracer_getter = tracer_getter
+        self._is_excluded_path = kwargs.pop('is_excluded_path', None)
+        super(IntracingFlaskTracer, self).__init__(
+            tracer_getter, *args, **kwargs
+        )
+
+    def _before_request_fn(self, attributes):
+        if self._is_excluded_path is None or not self._is_excluded_path(
+                stack.top.request.path
+        ):
+            super(IntracingFlaskTracer, self)._before_request_fn(attributes)
+
+    def _after_request_fn(self):
+        # the span of a streamed response is finished once it is sent
+        span = self.pop_span(stack.top.request)
+        if span is not None:
+            span.finish()
 
 
 class FlaskTracingHelper(TracingHelper):
@@ -19,7 +39,8 @@ class FlaskTracingHelper(TracingHelper):
     @classmethod
     def get_tracer(cls, app):
         return IntracingFlaskTracer(
-            cls.init_jaeger_tracer, trace_all_requests=True, app=app
+            cls.init_jaeger_tracer, trace_all_requests=True, app=app,
+            is_excluded_path=cls.is_excluded_path,
         )
 
     @classmethod
@@ -27,31 +48,69 @@ class FlaskTracingHelper(TracingHelper):
         app.before_first_request(cls.apply_patches)
         app.before_request(cls.enter_request_context)
         app.after_request(cls.exit_request_context)
+        excluded_paths = app.config.get('TRACING_EXCLUDE_PATHS')
+        if excluded_paths is not None:
+            cls.excluded_paths = compile_path_patterns(excluded_paths)
+
+    @classmethod
+    def _get_request_body(cls, span):
+        if cls.should_store_http_body(span):
+            body, request.stream = cls.peek_http_body(request.stream)
+            return body
 
     @classmethod
+    def _get_response_body(cls, span, response):
+        if cls.should_store_http_body(span) and not response.direct_passthrough:
+            return response.get_data()
+
+    @classmethod
+    @timed('enter_request_context')
     def enter_request_context(cls):
         span = opentracing.tracer.get_span()
+        if span is None:
+            return
+
+        cls.start_profile(span)
         cls.set_request_tags(
             span,
             request.method,
             request.url,
             request.user_agent.string,
             request.content_type,
-            request.data,
+            cls._get_request_body(span),
+            request.url_rule.rule if request.url_rule else None,
+            request.content_length,
+            request.headers,
         )
         request.tracing_context = RequestContextManager(span)
         request.tracing_context.__enter__()
 
     @classmethod
+    @timed('exit_request_context')
     def exit_request_context(cls, response):
         span = opentracing.tracer.get_span()
-        body = response.data if not response.direct_passthrough else None
-        cls.set_response_tags(
-            span,
-            response.status_code,
-            response.content_type,
-            body,
-        )
+        if span is None:
+            return response
+
+        if response.is_streamed and not response.direct_passthrough and (
+                cls.should_store_http_body(span)
+        ):
+            opentracing.tracer.pop_span(stack.top.request)
+            response.response = cls.tee_http_body(
+                span,
+                response.response,
+                response.status_code,
+                response.content_type,
+                response.headers,
+            )
+        else:
+            cls.set_response_tags(
+                span,
+                response.status_code,
+                response.content_type,
+                cls._get_response_body(span, response),
+                headers=response.headers,
+            )
         request.tracing_context.__exit__()
         return response
 
@@ -0,0 +1,263 @@
+import gc
+import sys
+import threading
+import time
+import weakref
+from timeit import default_timer
+
+from six.moves import _thread
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+PROFILE_WALL_TIME = 'profile.wall_time'
+PROFILE_CPU_TIME = 'profile.cpu_time'
+PROFILE_GC_COLLECTIONS = 'profile.gc.collections'
+PROFILE_GC_PAUSE_TIME = 'profile.gc.pause_time'
+PROFILE_MEMORY_DELTA = 'profile.memory.delta'
+PROFILE_MEMORY_PEAK = 'profile.memory.peak'
+PROFILE_STACKS = 'profile.stacks'
+PROFILE_STACK_SAMPLES = 'profile.stack_samples'
+
+DEFAULT_STACK_SAMPLING_INTERVAL = 0.01
+# innermost frames of a stack which are kept
+MAX_STACK_DEPTH = 64
+# the most frequent stacks which are stored in a span
+MAX_STACKS = 20
+
+# CPU time of the current thread isn't available before Python 3.7
+thread_time = getattr(time, 'thread_time', None)
+
+
+class GCMonitor(object):
+    """Number and total duration of garbage collections in the process
+
+    Collections hold the GIL, so the callback is never run concurrently.
+    """
+
+    def __init__(self):
+        self.collections = 0
+        self.pause_time = 0.0
+        self.installed = False
+        self._started = None
+
+    def install(self):
+        # GC callbacks aren't available on Python 2
+        if not self.installed and hasattr(gc, 'callbacks'):
+            gc.callbacks.append(self.callback)
+            self.installed = True
+
+    def callback(self, phase, info):
+        if phase == 'start':
+            self._started = default_timer()
+        elif self._started is not None:
+            self.collections += 1
+            self.pause_time += default_timer() - self._started
+            self._started = None
+
+
+gc_monitor = GCMonitor()
+
+
+def start_memory_tracing():
+    if tracemalloc is not None and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+class MemoryProfiles(object):
+    """Requests whose traced memory is measured
+
+    The peak of traced memory is process-wide and resetting it
+    affects every request, so it's only reset and reported for requests
+    which don't overlap any other measured one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = weakref.WeakSet()
+
+    def reset_after_fork(self):
+        # the lock might have been held by another thread while forking
+        self._lock = threading.Lock()
+
+    def start(self, profile):
+        """Traced memory when `profile` starts"""
+
+        with self._lock:
+            for other in self._profiles:
+                other.exclusive = False
+            profile.exclusive = not self._profiles and hasattr(
+                tracemalloc, 'reset_peak'
+            )
+            self._profiles.add(profile)
+            if profile.exclusive:
+                tracemalloc.reset_peak()
+            return tracemalloc.get_traced_memory()[0]
+
+    def finish(self, profile):
+        """Traced memory and its peak, `None` if it's unknown"""
+
+        with self._lock:
+            self._profiles.discard(profile)
+            current, peak = tracemalloc.get_traced_memory()
+        return current, peak if profile.exclusive else None
+
+
+memory_profiles = MemoryProfiles()
+
+
+class RequestProfile(object):
+    """Resources used by the current thread while a request is processed
+
+    Garbage collections and traced memory are process-wide,
+    so they include concurrent requests of other threads.
+    The memory peak is only known since Python 3.9
+    and only for requests which don't overlap other ones.
+    """
+
+    __slots__ = ('wall_time', 'cpu_time', 'gc_collections',
+                 'gc_pause_time', 'memory', 'exclusive', '__weakref__')
+
+    def __init__(self, memory=False):
+        self.wall_time = default_timer()
+        self.cpu_time = thread_time() if thread_time is not None else None
+        self.gc_collections = gc_monitor.collections
+        self.gc_pause_time = gc_monitor.pause_time
+        self.memory = None
+        self.exclusive = False
+        if memory and tracemalloc is not None and tracemalloc.is_tracing():
+            self.memory = memory_profiles.start(self)
+
+    def finish(self):
+        """`(key, value)` pairs of the used resources"""
+
+        values = [(PROFILE_WALL_TIME, default_timer() - self.wall_time)]
+        if self.cpu_time is not None:
+            values.append((PROFILE_CPU_TIME, thread_time() - self.cpu_time))
+        if gc_monitor.installed:
+            values.append((PROFILE_GC_COLLECTIONS,
+                           gc_monitor.collections - self.gc_collections))
+            values.append((PROFILE_GC_PAUSE_TIME,
+                           gc_monitor.pause_time - self.gc_pause_time))
+        if self.memory is not None:
+            current, peak = memory_profiles.finish(self)
+            values.append((PROFILE_MEMORY_DELTA, current - self.memory))
+            if peak is not None:
+                values.append((PROFILE_MEMORY_PEAK,
+                               max(peak - self.memory, 0)))
+        return values
+
+
+def collapse_stack(frame, depth=MAX_STACK_DEPTH):
+    """`module:function` names of the stack frames, outermost first"""
+
+    names = []
+    while frame is not None and len(names) < depth:
+        names.append('{}:{}'.format(frame.f_globals.get('__name__', '?'),
+                                    frame.f_code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSamples(object):
+    """Collapsed stacks sampled from the thread of a request"""
+
+    __slots__ = ('span', 'started', 'stacks', 'count')
+
+    def __init__(self, span):
+        self.span = span
+        self.started = default_timer()
+        self.stacks = {}
+        self.count = 0
+
+    def add(self, stack):
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.count += 1
+
+    def format(self, limit=MAX_STACKS):
+        """Lines of stacks followed by their counts, most frequent first"""
+
+        stacks = sorted(self.stacks.items(), key=lambda item: -item[1])
+        return '\n'.join('{} {}'.format(stack, count)
+                         for stack, count in stacks[:limit])
+
+
+class StackSampler(object):
+    """Background thread sampling stacks of slow requests
+
+    Stacks of threads whose requests last longer than `threshold`
+    seconds are sampled every `interval` seconds.
+    The thread is started once a request is tracked,
+    so it's started again in forked processes.
+    """
+
+    def __init__(self, threshold, interval=DEFAULT_STACK_SAMPLING_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        # thread ID -> samples of its current request
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def reset_after_fork(self):
+        """Drop the state of the parent process in a forked one
+
+        Its locks might have been held by the sampling thread while forking,
+        and IDs of the parent's threads mean nothing in the child.
+        """
+
+        stopped = self._stopped.is_set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        if stopped:
+            self._stopped.set()
+        self._samples = {}
+        self._thread = None
+
+    def track(self, span):
+        """Sample the current thread while the request of `span` is slow"""
+
+        with self._lock:
+            self._samples[_thread.get_ident()] = StackSamples(span)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='intracing-stack-sampler'
+                )
+                self._thread.daemon = True
+                self._thread.start()
+
+    def untrack(self, span):
+        """Stop sampling the request of `span`, returns its samples"""
+
+        with self._lock:
+            thread_id = _thread.get_ident()
+            samples = self._samples.get(thread_id)
+            if samples is None or samples.span is not span:
+                # e.g. a streamed response is sent by another thread
+                thread_id = next((
+                    other_id for other_id, other in self._samples.items()
+                    if other.span is span
+                ), None)
+            return self._samples.pop(thread_id, None)
+
+    def sample(self):
+        now = default_timer()
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id, samples in list(self._samples.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    # the thread is gone along with its request
+                    del self._samples[thread_id]
+                elif now - samples.started >= self.threshold:
+                    samples.add(collapse_stack(frame))
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stopped.set()
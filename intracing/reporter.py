@@ -0,0 +1,635 @@
+import os
+import socket
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import six
+import tornado.gen
+import tornado.ioloop
+from jaeger_client import thrift
+from jaeger_client.local_agent_net import LocalAgentHTTP, LocalAgentSender
+from jaeger_client.reporter import Reporter
+from jaeger_client.TUDPTransport import TUDPTransport
+from jaeger_client.thrift_gen.jaeger.ttypes import Batch, Tag, TagType
+from six.moves import http_client
+from six.moves.urllib.parse import urlsplit
+from thrift.compat import str_to_binary
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.protocol.TCompactProtocol import TCompactProtocol
+from thrift.transport.TTransport import TBufferedTransport, TMemoryBuffer
+
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_BATCH_SIZE = 10
+# the agent's default UDP packet size limit
+DEFAULT_MAX_PACKET_SIZE = 65000
+# `emitBatch` message header and the batch's spans list header
+EMIT_BATCH_OVERHEAD = 30
+TRUNCATED_SUFFIX = '.truncated'
+
+DEFAULT_SPOOL_SIZE = 16 * 1024 * 1024
+DEFAULT_SPOOL_DRAIN_INTERVAL = 5
+# time for the agent's host to reject a datagram
+DELIVERY_CHECK_DELAY = 0.01
+
+DEFAULT_COLLECTOR_RETRIES = 3
+DEFAULT_COLLECTOR_TIMEOUT = 5
+# the first delay between retries, it's doubled after every attempt
+COLLECTOR_BACKOFF = 0.1
+# responses to be retried besides server errors
+RETRIED_STATUSES = frozenset([408, 429])
+
+DROP_NEWEST = 'newest'
+DROP_OLDEST = 'oldest'
+DROP_POLICIES = (DROP_NEWEST, DROP_OLDEST)
+
+
+# tag keys and low-cardinality values are encoded over and over again,
+# so short strings are cached along with their length prefix;
+# the least recently written ones are evicted, so unique values
+# can't push the frequent ones out
+ENCODED_STRINGS_CACHE_SIZE = 4096
+ENCODED_STRING_MAX_LENGTH = 256
+_encoded_strings = OrderedDict()
+
+
+def encode_varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_string(value):
+    """Compact protocol encoding of a string, including its length"""
+
+    if not isinstance(value, six.binary_type):
+        value = str_to_binary(value)
+    return encode_varint(len(value)) + value
+
+
+def write_string(proto, value):
+    encoded = _encoded_strings.pop(value, None)
+    if encoded is None:
+        if len(value) > ENCODED_STRING_MAX_LENGTH:
+            if not isinstance(value, six.binary_type):
+                value = str_to_binary(value)
+            proto.writeBinary(value)
+            return
+
+        encoded = encode_string(value)
+        if len(_encoded_strings) >= ENCODED_STRINGS_CACHE_SIZE:
+            _encoded_strings.popitem(last=False)
+    _encoded_strings[value] = encoded
+    proto.trans.write(encoded)
+
+
+# monkey patching in purpose to avoid Python 3 compatibility issue
+# and to speed up encoding of repeated strings
+TCompactProtocol.writeString = write_string
+
+
+def encode(thrift_object):
+    buffer = TMemoryBuffer()
+    thrift_object.write(TCompactProtocol(buffer))
+    return buffer.getvalue()
+
+
+def decode(thrift_object, data):
+    thrift_object.read(TCompactProtocol(TMemoryBuffer(data)))
+    return thrift_object
+
+
+def get_size(thrift_object):
+    return len(encode(thrift_object))
+
+
+def get_string_size(value):
+    if isinstance(value, six.text_type):
+        return len(value.encode('utf-8'))
+    return len(value)
+
+
+# upper bounds of compact protocol encodings, a field header takes a byte
+# as IDs of consecutive fields of jaeger structs differ by less than 16
+MAX_I32_SIZE = 1 + 5
+MAX_I64_SIZE = 1 + 10
+MAX_STRING_HEADER_SIZE = 1 + 5
+MAX_LIST_HEADER_SIZE = 1 + 1 + 5
+# trace and span IDs, flags, start time, duration and the stop byte
+SPAN_FIELDS_SIZE = 6 * MAX_I64_SIZE + MAX_I32_SIZE + 1
+SPAN_REFERENCE_SIZE = MAX_I32_SIZE + 3 * MAX_I64_SIZE + 1
+
+
+def estimate_tag_size(tag):
+    size = (MAX_STRING_HEADER_SIZE + get_string_size(tag.key) +
+            MAX_I32_SIZE + 1)
+    if tag.vStr is not None:
+        size += MAX_STRING_HEADER_SIZE + get_string_size(tag.vStr)
+    if tag.vDouble is not None:
+        size += 1 + 8
+    if tag.vBool is not None:
+        size += 1
+    if tag.vLong is not None:
+        size += MAX_I64_SIZE
+    if tag.vBinary is not None:
+        size += MAX_STRING_HEADER_SIZE + len(tag.vBinary)
+    return size
+
+
+def estimate_size(span):
+    """Upper bound of the encoded size of the thrift span
+
+    It's much cheaper than encoding, so spans are only measured
+    exactly when the estimate doesn't fit into a packet.
+    """
+
+    size = (SPAN_FIELDS_SIZE + MAX_STRING_HEADER_SIZE +
+            get_string_size(span.operationName))
+    if span.references is not None:
+        size += (MAX_LIST_HEADER_SIZE +
+                 SPAN_REFERENCE_SIZE * len(span.references))
+    if span.tags is not None:
+        size += MAX_LIST_HEADER_SIZE + sum(
+            estimate_tag_size(tag) for tag in span.tags
+        )
+    if span.logs is not None:
+        size += MAX_LIST_HEADER_SIZE
+        for log in span.logs:
+            size += MAX_I64_SIZE + MAX_LIST_HEADER_SIZE + 1 + sum(
+                estimate_tag_size(tag) for tag in log.fields
+            )
+    return size
+
+
+def trim_string(value, size):
+    if isinstance(value, six.text_type):
+        # a split character is dropped as a whole
+        return value.encode('utf-8')[:size].decode('utf-8', 'ignore')
+    return value[:size]
+
+
+def trim_tags(tags, excess):
+    """Trim string tags by `excess` bytes, largest body tags first
+
+    Trimmed tags are replaced and marked with `.truncated` tags,
+    so the tags shared with other spans are never changed.
+    Returns the new tags and number of trimmed bytes.
+    """
+
+    tags = list(tags)
+    keys = {tag.key for tag in tags}
+    candidates = sorted(
+        (not tag.key.endswith('.body'), -get_string_size(tag.vStr), index)
+        for index, tag in enumerate(tags)
+        if tag.vType == TagType.STRING and tag.vStr
+    )
+
+    trimmed = 0
+    for _, negative_size, index in candidates:
+        if trimmed >= excess:
+            break
+
+        tag = tags[index]
+        size = -negative_size
+        value = trim_string(tag.vStr, max(size - excess + trimmed, 0))
+        trimmed += size - get_string_size(value)
+        tags[index] = Tag(key=tag.key, vType=TagType.STRING, vStr=value)
+        truncated_key = tag.key + TRUNCATED_SUFFIX
+        if truncated_key not in keys:
+            keys.add(truncated_key)
+            tags.append(Tag(key=truncated_key, vType=TagType.BOOL,
+                            vBool=True))
+
+    return tags, trimmed
+
+
+class CountingTransport(object):
+    """Transport wrapper counting written bytes"""
+
+    def __init__(self, transport, counter):
+        self._transport = transport
+        self._counter = counter
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+    def write(self, buf):
+        self._counter(len(buf))
+        return self._transport.write(buf)
+
+
+class ConnectedUDPTransport(TUDPTransport):
+    """UDP transport reporting unavailable agent as errors
+
+    Errors are only reported for connected UDP sockets,
+    and only for datagrams sent after the one which wasn't delivered.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ConnectedUDPTransport, self).__init__(*args, **kwargs)
+        self.connected = False
+
+    def write(self, buf):
+        if not self.connected:
+            self.transport_sock.connect(
+                (self.transport_host, self.transport_port)
+            )
+            self.connected = True
+        return self.transport_sock.send(buf)
+
+    def check_error(self):
+        """Raise the error of the datagrams sent so far, if any"""
+
+        error = self.transport_sock.getsockopt(socket.SOL_SOCKET,
+                                               socket.SO_ERROR)
+        if error:
+            raise socket.error(error, os.strerror(error))
+
+
+class IntracingAgentSender(LocalAgentSender):
+    """Agent channel with the connected UDP transport"""
+
+    def __init__(self, host, sampling_port, reporting_port, io_loop=None,
+                 throttling_port=None):
+        # it follows the original implementation,
+        # but the UDP transport is connected
+        self._thread_loop = None
+        self.io_loop = io_loop or self._create_new_thread_loop()
+        self.local_agent_http = LocalAgentHTTP(host, sampling_port)
+        if throttling_port:
+            self.throttling_http = LocalAgentHTTP(host, throttling_port)
+        self.udp = ConnectedUDPTransport(host, reporting_port)
+        TBufferedTransport.__init__(self, self.udp)
+
+
+class IntracingReporter(Reporter):
+    """Reporter with a configurable drop policy and bounded memory usage
+
+    Spans reported from other threads are handed over to the IOLoop
+    with callbacks. Number of such pending spans is limited by the queue
+    capacity as well, so a stalled IOLoop can't make memory grow endlessly.
+    Pending spans above the limit are always dropped as the newest ones.
+
+    Batches are split to fit into UDP packets of `max_packet_size`.
+    Sizes of spans are estimated, they are only encoded to be measured
+    once a batch gets near the limit. Spans which don't fit into a packet
+    alone get their string tags trimmed, the spans are dropped
+    if that's not enough.
+
+    Batches which failed to be sent are kept in the optional `spool`.
+    It's drained once a batch is sent again,
+    and every `spool_drain_interval` seconds.
+    """
+
+    def __init__(self, *args, **kwargs):
+        drop_policy = kwargs.pop('drop_policy', DROP_NEWEST)
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError('Unknown drop policy %s' % drop_policy)
+        self.drop_policy = drop_policy
+        self.max_packet_size = kwargs.pop('max_packet_size',
+                                          DEFAULT_MAX_PACKET_SIZE)
+        self.spool = kwargs.pop('spool', None)
+        self.spool_drain_interval = kwargs.pop('spool_drain_interval',
+                                               DEFAULT_SPOOL_DRAIN_INTERVAL)
+        self._draining = False
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+        super(IntracingReporter, self).__init__(*args, **kwargs)
+        self.bytes_counter = self.metrics_factory.create_counter(
+            name='intracing:reporter_bytes'
+        )
+        self.pending_gauge = self.metrics_factory.create_gauge(
+            name='intracing:reporter_pending_spans'
+        )
+        self.trimmed_bytes_counter = self.metrics_factory.create_counter(
+            name='intracing:reporter_trimmed_bytes'
+        )
+        self.trimmed_spans_counter = self.metrics_factory.create_counter(
+            name='intracing:reporter_trimmed_spans'
+        )
+        self.spooled_counter = self.metrics_factory.create_counter(
+            name='intracing:spooled_spans'
+        )
+        self.drained_counter = self.metrics_factory.create_counter(
+            name='intracing:drained_spans'
+        )
+        self.spool_dropped_counter = self.metrics_factory.create_counter(
+            name='intracing:spool_dropped_batches'
+        )
+        self.spool_gauge = self.metrics_factory.create_gauge(
+            name='intracing:spooled_batches'
+        )
+        if self.spool is not None:
+            self.io_loop.add_callback(self._schedule_drain)
+
+    def getProtocol(self, transport):
+        return super(IntracingReporter, self).getProtocol(
+            CountingTransport(transport, self.bytes_counter)
+        )
+
+    def report_span(self, span):
+        if tornado.ioloop.IOLoop.current(instance=False) == self.io_loop:
+            self._report_span_from_ioloop(span)
+            return
+
+        with self._pending_lock:
+            dropped = self.pending >= self.queue_capacity
+            if not dropped:
+                self.pending += 1
+            self.pending_gauge(self.pending)
+
+        if dropped:
+            self.metrics.reporter_dropped(1)
+        else:
+            self.io_loop.add_callback(self._report_pending_span, span)
+
+    def _report_pending_span(self, span):
+        with self._pending_lock:
+            self.pending -= 1
+            self.pending_gauge(self.pending)
+        self._report_span_from_ioloop(span)
+
+    def _report_span_from_ioloop(self, span):
+        if self.drop_policy == DROP_OLDEST and self.queue.full():
+            with self.stop_lock:
+                stopped = self.stopped
+            if not stopped:
+                self._drop_oldest_span()
+
+        super(IntracingReporter, self)._report_span_from_ioloop(span)
+
+    def _drop_oldest_span(self):
+        # the queue is only consumed from the IOLoop, so it's still full
+        self.queue.get_nowait()
+        self.queue.task_done()
+        self.metrics.reporter_dropped(1)
+
+    def fit_span(self, span, budget):
+        """Trim tags of the thrift span to fit it into the budget
+
+        Returns the span's size, or `None` if it doesn't fit anyway.
+        """
+
+        size = get_size(span)
+        if size <= budget:
+            return size
+
+        trimmed = 0
+        while size > budget:
+            # markers of trimmed tags may take a few more bytes
+            span.tags, trimmed_now = trim_tags(span.tags, size - budget)
+            if not trimmed_now:
+                break
+            trimmed += trimmed_now
+            size = get_size(span)
+
+        if trimmed:
+            self.trimmed_bytes_counter(trimmed)
+            self.trimmed_spans_counter(1)
+        if size <= budget:
+            return size
+
+    def make_batches(self, spans, process):
+        batch = thrift.make_jaeger_batch(spans=spans, process=process)
+        budget = self.max_packet_size - EMIT_BATCH_OVERHEAD - get_size(
+            Batch(process=process, spans=[])
+        )
+
+        batches = []
+        batch_spans = []
+        batch_size = 0
+        for span in batch.spans:
+            size = estimate_size(span)
+            if batch_size + size > budget:
+                # the span might fit after all, or it has to be trimmed
+                size = self.fit_span(span, budget)
+                if size is None:
+                    self.metrics.reporter_dropped(1)
+                    continue
+
+            if batch_spans and batch_size + size > budget:
+                batches.append(Batch(process=process, spans=batch_spans))
+                batch_spans = []
+                batch_size = 0
+            batch_spans.append(span)
+            batch_size += size
+
+        if batch_spans:
+            batches.append(Batch(process=process, spans=batch_spans))
+        return batches
+
+    @tornado.gen.coroutine
+    def _submit(self, spans):
+        # it follows the original implementation, but batches are split
+        # and trimmed by `make_batches` and unsent ones are spooled
+        if not spans:
+            return
+        with self._process_lock:
+            process = self._process
+            if not process:
+                return
+
+        batches = []
+        sent = 0
+        try:
+            batches = self.make_batches(spans, process)
+            for batch in batches:
+                yield self._send(batch)
+                sent += 1
+            self.metrics.reporter_success(
+                sum(len(batch.spans) for batch in batches)
+            )
+        except socket.error as e:
+            self.metrics.reporter_failure(len(spans))
+            self.error_reporter.error(
+                'Failed to submit traces to jaeger-agent socket: %s', e)
+            self.spool_batches(batches[sent:])
+        except Exception as e:
+            self.metrics.reporter_failure(len(spans))
+            self.error_reporter.error(
+                'Failed to submit traces to jaeger-agent: %s', e)
+            self.spool_batches(batches[sent:])
+        else:
+            if self.spool:
+                # the agent is available again
+                self.io_loop.spawn_callback(self.drain_spool)
+
+    def spool_batches(self, batches):
+        if self.spool is None:
+            return
+
+        for batch in batches:
+            dropped = self.spool.dropped
+            if self.spool.push(encode(batch)):
+                self.spooled_counter(len(batch.spans))
+            dropped = self.spool.dropped - dropped
+            if dropped:
+                self.spool_dropped_counter(dropped)
+        self.spool_gauge(len(self.spool))
+
+    @tornado.gen.coroutine
+    def drain_spool(self):
+        """Send spooled batches until the spool is empty or sending fails"""
+
+        if self._draining:
+            return
+
+        self._draining = True
+        try:
+            while self.spool:
+                batch = decode(Batch(), self.spool.peek())
+                try:
+                    yield self._send(batch)
+                    yield self._check_delivery()
+                except Exception:
+                    break
+                self.spool.remove()
+                self.drained_counter(len(batch.spans))
+                # let the IOLoop queue new spans meanwhile
+                yield tornado.gen.moment
+        finally:
+            self._draining = False
+            self.spool_gauge(len(self.spool))
+
+    @tornado.gen.coroutine
+    def _check_delivery(self):
+        # the agent rejects UDP datagrams asynchronously,
+        # so spooled batches are kept until no error follows
+        udp = getattr(self._channel, 'udp', None)
+        if udp is not None:
+            yield tornado.gen.sleep(DELIVERY_CHECK_DELAY)
+            udp.check_error()
+
+    def _schedule_drain(self):
+        self.io_loop.call_later(self.spool_drain_interval,
+                                self._drain_periodically)
+
+    @tornado.gen.coroutine
+    def _drain_periodically(self):
+        yield self.drain_spool()
+        with self.stop_lock:
+            stopped = self.stopped
+        if not stopped:
+            self._schedule_drain()
+
+
+class CollectorError(Exception):
+
+    def __init__(self, status, reason):
+        super(CollectorError, self).__init__(
+            'Collector responded with {} {}'.format(status, reason)
+        )
+        self.status = status
+
+    @property
+    def retried(self):
+        return self.status >= 500 or self.status in RETRIED_STATUSES
+
+
+def gzip_compress(data):
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+    )
+    return compressor.compress(data) + compressor.flush()
+
+
+class IntracingHTTPReporter(IntracingReporter):
+    """Reporter sending batches to the collector's HTTP endpoint
+
+    Batches are encoded with the binary protocol expected by the collector
+    and POSTed over a single keep-alive connection, optionally gzipped.
+    Requests are made by a dedicated thread, so the IOLoop keeps queueing
+    spans while waiting for the collector. Failed requests are retried
+    with exponential backoff, the queue stays bounded meanwhile.
+    Batches are never split, since there is no packet size limit.
+    """
+
+    def __init__(self, *args, **kwargs):
+        endpoint = kwargs.pop('endpoint')
+        self.gzip = kwargs.pop('gzip', False)
+        self.retries = kwargs.pop('retries', DEFAULT_COLLECTOR_RETRIES)
+        self.timeout = kwargs.pop('timeout', DEFAULT_COLLECTOR_TIMEOUT)
+        url = urlsplit(endpoint)
+        self.scheme = url.scheme
+        self.netloc = url.netloc
+        self.path = url.path or '/'
+        if url.query:
+            self.path += '?' + url.query
+        self._connection = None
+        self._executor = ThreadPoolExecutor(1)
+        super(IntracingHTTPReporter, self).__init__(*args, **kwargs)
+
+    def make_batches(self, spans, process):
+        return [thrift.make_jaeger_batch(spans=spans, process=process)]
+
+    def encode_batch(self, batch):
+        buffer = TMemoryBuffer()
+        batch.write(TBinaryProtocol(buffer))
+        body = buffer.getvalue()
+        return gzip_compress(body) if self.gzip else body
+
+    def get_connection(self):
+        if self._connection is None:
+            connection_class = (
+                http_client.HTTPSConnection if self.scheme == 'https'
+                else http_client.HTTPConnection
+            )
+            self._connection = connection_class(self.netloc,
+                                                timeout=self.timeout)
+        return self._connection
+
+    def close_connection(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def post(self, body):
+        headers = {'Content-Type': 'application/x-thrift'}
+        if self.gzip:
+            headers['Content-Encoding'] = 'gzip'
+
+        connection = self.get_connection()
+        try:
+            connection.request('POST', self.path, body, headers)
+            response = connection.getresponse()
+            # the response has to be read to reuse the connection
+            response.read()
+        except Exception:
+            self.close_connection()
+            raise
+
+        if response.will_close:
+            self.close_connection()
+        if response.status >= 300:
+            raise CollectorError(response.status, response.reason)
+        self.bytes_counter(len(body))
+
+    @tornado.gen.coroutine
+    def _send(self, batch):
+        body = self.encode_batch(batch)
+        attempt = 0
+        while True:
+            try:
+                yield self._executor.submit(self.post, body)
+                return
+            except (socket.error, http_client.HTTPException,
+                    CollectorError) as e:
+                if attempt >= self.retries or not getattr(
+                        e, 'retried', True
+                ):
+                    raise
+            yield tornado.gen.sleep(COLLECTOR_BACKOFF * 2 ** attempt)
+            attempt += 1
+
+    def close(self):
+        future = super(IntracingHTTPReporter, self).close()
+        future.add_done_callback(self._shutdown)
+        return future
+
+    def _shutdown(self, future):
+        self._executor.submit(self.close_connection)
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,75 @@
+import fnmatch
+import re
+
+import six
+from six.moves.urllib.parse import urlsplit, urlunsplit
+
+HTTP_ROUTE = 'http.route'
+
+ID_SEGMENT_PATTERN = re.compile(
+    r'/(?:(?P<id>\d+)|(?P<uuid>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}'
+    r'-[0-9a-f]{4}-[0-9a-f]{12}))(?=/|$)',
+    re.IGNORECASE,
+)
+
+
+def _replace_id_segment(match):
+    return '/{id}' if match.group('id') else '/{uuid}'
+
+
+def normalize_url(url):
+    """Replace numeric and UUID path segments with placeholders
+
+    The query string and fragment are kept as they are.
+    """
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(
+        path=ID_SEGMENT_PATTERN.sub(_replace_id_segment, parts.path)
+    ))
+
+
+def get_route_name(route):
+    # regular expression based routes, e.g. Django's `re_path`, have anchors
+    name = route.lstrip('^').rstrip('$')
+    if not name.startswith('/'):
+        name = '/' + name
+    return name
+
+
+class RouteNames(dict):
+    """Route template to operation name mapping
+
+    Every name is computed only once, since the set of routes is finite.
+    """
+
+    def __missing__(self, route):
+        name = self[route] = get_route_name(route)
+        return name
+
+
+def compile_path_patterns(patterns):
+    """Compile path patterns into a single regex
+
+    Patterns are given as a list or as a whitespace-separated string,
+    so they may contain commas, e.g. `^/v\\d{1,3}/`.
+    Patterns starting with `^` are regular expressions,
+    ones containing `*`, `?` or `[` are globs, others are prefixes.
+    """
+    if isinstance(patterns, six.string_types):
+        patterns = patterns.split()
+    expressions = []
+    for pattern in patterns:
+        pattern = pattern.strip()
+        if not pattern:
+            continue
+        if pattern.startswith('^'):
+            expressions.append(pattern)
+        elif any(char in pattern for char in '*?['):
+            expressions.append(fnmatch.translate(pattern))
+        else:
+            expressions.append(re.escape(pattern))
+
+    if expressions:
+        return re.compile('|'.join(
+            '(?:{})'.format(expression) for expression in expressions
+        ))
@@ -0,0 +1,211 @@
+import errno
+import fcntl
+import mmap
+import os
+import struct
+
+MAGIC = b'ISP1'
+# magic, capacity, offset of the oldest record, used bytes, records count
+HEADER = struct.Struct('<4sQQQQ')
+LENGTH = struct.Struct('<I')
+
+
+class SpoolLocked(Exception):
+    """The spool file is used by another process"""
+
+
+def _lock(fd, path):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError) as e:
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            raise SpoolLocked(path)
+        raise
+
+
+def _is_linked(fd, path):
+    try:
+        return os.stat(path).st_ino == os.fstat(fd).st_ino
+    except OSError:
+        return False
+
+
+class Spool(object):
+    """Fixed-size ring buffer of records in a memory-mapped file
+
+    Records are prefixed with their length and may wrap around
+    the end of the buffer. The oldest records are overwritten
+    when there is no room for a new one, so disk and memory usage
+    never exceed the file size. The records survive restarts,
+    unless the file is recreated with a different size.
+
+    The file is exclusively locked while it's open, so `SpoolLocked`
+    is raised if another process uses it.
+    It isn't thread-safe, the reporter only uses it from its IOLoop.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.capacity = size
+        self.dropped = 0
+
+        file_size = HEADER.size + size
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                _lock(fd, path)
+            except Exception:
+                os.close(fd)
+                raise
+            if _is_linked(fd, path):
+                break
+            # the file was deleted by the process which locked it before
+            os.close(fd)
+
+        try:
+            if os.fstat(fd).st_size != file_size:
+                os.ftruncate(fd, file_size)
+            self._mmap = mmap.mmap(fd, file_size)
+        except Exception:
+            os.close(fd)
+            raise
+        # the lock is held until the descriptor is closed
+        self._fd = fd
+
+        magic, capacity, head, used, count = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or capacity != size or head >= size or used > size:
+            head = used = count = 0
+        self.head = head
+        self.used = used
+        self.count = count
+        self._write_header()
+
+    def __len__(self):
+        return self.count
+
+    def _write_header(self):
+        HEADER.pack_into(self._mmap, 0, MAGIC, self.capacity, self.head,
+                         self.used, self.count)
+
+    def _write(self, offset, data):
+        start = HEADER.size + offset
+        first = min(len(data), self.capacity - offset)
+        self._mmap[start:start + first] = data[:first]
+        if first < len(data):
+            self._mmap[HEADER.size:HEADER.size + len(data) - first] = (
+                data[first:]
+            )
+
+    def _read(self, offset, size):
+        start = HEADER.size + offset
+        first = min(size, self.capacity - offset)
+        data = self._mmap[start:start + first]
+        if first < size:
+            data += self._mmap[HEADER.size:HEADER.size + size - first]
+        return data
+
+    def _record_size(self):
+        return LENGTH.size + LENGTH.unpack(
+            self._read(self.head, LENGTH.size)
+        )[0]
+
+    def push(self, data):
+        """Append a record, returns `False` if it's larger than the spool"""
+
+        size = LENGTH.size + len(data)
+        if size > self.capacity:
+            self.dropped += 1
+            return False
+
+        while self.capacity - self.used < size:
+            self.remove()
+            self.dropped += 1
+
+        tail = (self.head + self.used) % self.capacity
+        self._write(tail, LENGTH.pack(len(data)) + data)
+        self.used += size
+        self.count += 1
+        # the header is updated last, so a crash never exposes partial data
+        self._write_header()
+        return True
+
+    def peek(self):
+        """The oldest record or `None` if the spool is empty"""
+
+        if not self.count:
+            return None
+        return self._read((self.head + LENGTH.size) % self.capacity,
+                          self._record_size() - LENGTH.size)
+
+    def remove(self):
+        """Remove the oldest record"""
+
+        if not self.count:
+            return
+        size = self._record_size()
+        self.head = (self.head + size) % self.capacity
+        self.used -= size
+        self.count -= 1
+        self._write_header()
+
+    def adopt(self, other):
+        """Move records of the other spool into this one and delete it"""
+
+        while other:
+            self.push(other.peek())
+            other.remove()
+        other.delete()
+
+    def close(self):
+        self._mmap.close()
+        os.close(self._fd)
+
+    def delete(self):
+        # the file is deleted while it's still locked
+        os.unlink(self.path)
+        self.close()
+
+
+def get_slot_path(path, slot):
+    return '{}.{}'.format(path, slot)
+
+
+def get_slot_paths(path):
+    """Paths of the existing spool slots of `path`"""
+
+    directory, name = os.path.split(path)
+    prefix = name + '.'
+    slots = sorted(
+        int(file_name[len(prefix):])
+        for file_name in os.listdir(directory or os.curdir)
+        if file_name.startswith(prefix) and file_name[len(prefix):].isdigit()
+    )
+    return [get_slot_path(path, slot) for slot in slots]
+
+
+def open_spool(path, size):
+    """Open the first spool slot `<path>.<N>` unused by other processes
+
+    Slots are locked by their processes, so a restarted process
+    opens a slot left by an exited one along with its records.
+    Records of other unused slots, e.g. ones of processes
+    which aren't started again, are moved into the opened spool.
+    """
+
+    spool = None
+    slot = 0
+    while spool is None:
+        try:
+            spool = Spool(get_slot_path(path, slot), size)
+        except SpoolLocked:
+            slot += 1
+
+    for slot_path in get_slot_paths(path):
+        if slot_path == spool.path:
+            continue
+        try:
+            orphan = Spool(slot_path, size)
+        except SpoolLocked:
+            continue
+        spool.adopt(orphan)
+    return spool
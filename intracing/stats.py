@@ -0,0 +1,169 @@
+import bisect
+import threading
+from functools import wraps
+from timeit import default_timer
+
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+)
+
+REQUEST_HOOK_SECONDS = 'intracing:request_hook_seconds'
+
+
+def get_labels(tags):
+    return tuple(sorted(tags.items())) if tags else ()
+
+
+def format_series(name, labels=()):
+    name = name.replace(':', '_')
+    if not labels:
+        return name
+    return '{}{{{}}}'.format(name, ','.join(
+        '{}="{}"'.format(key, value) for key, value in labels
+    ))
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_cumulative_counts(self):
+        cumulative_counts = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            cumulative_counts.append((str(bound), total))
+        return cumulative_counts
+
+    def as_dict(self):
+        return {
+            'buckets': dict(self.get_cumulative_counts()),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class TracingStats(object):
+    """Counters, gauges and histograms describing the tracing overhead"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset_after_fork(self):
+        # the lock might have been held by another thread while forking
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+
+    def increment(self, name, value=1, labels=()):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_counter(self, name, value, labels=()):
+        with self._lock:
+            self.counters[(name, labels)] = value
+
+    def set_gauge(self, name, value, labels=()):
+        with self._lock:
+            self.gauges[(name, labels)] = value
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'counters': {
+                    format_series(*key): value
+                    for key, value in self.counters.items()
+                },
+                'gauges': {
+                    format_series(*key): value
+                    for key, value in self.gauges.items()
+                },
+                'histograms': {
+                    format_series(*key): histogram.as_dict()
+                    for key, histogram in self.histograms.items()
+                },
+            }
+
+    def as_prometheus(self):
+        """Render stats in Prometheus text exposition format"""
+
+        lines = []
+        with self._lock:
+            for metric_type, values in (('counter', self.counters),
+                                        ('gauge', self.gauges)):
+                for name, labels, value in self._sorted(values):
+                    self._add_type(lines, name, metric_type)
+                    lines.append('{} {}'.format(
+                        format_series(name, labels), value
+                    ))
+
+            for name, labels, histogram in self._sorted(self.histograms):
+                self._add_type(lines, name, 'histogram')
+                for bound, count in histogram.get_cumulative_counts():
+                    lines.append('{} {}'.format(format_series(
+                        name + '_bucket', labels + (('le', bound),)
+                    ), count))
+                lines.append('{} {}'.format(
+                    format_series(name + '_sum', labels), histogram.sum
+                ))
+                lines.append('{} {}'.format(
+                    format_series(name + '_count', labels), histogram.count
+                ))
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _sorted(values):
+        return sorted(
+            (name, labels, value) for (name, labels), value in values.items()
+        )
+
+    @staticmethod
+    def _add_type(lines, name, metric_type):
+        type_line = '# TYPE {} {}'.format(format_series(name), metric_type)
+        if type_line not in lines:
+            lines.append(type_line)
+
+
+def timed(hook):
+    """Observe duration of a request hook
+
+    The stats are taken from the first argument,
+    i.e. from the tracing helper class or instance.
+    """
+    labels = (('hook', hook),)
+
+    def decorator(func):
+        @wraps(func)
+        def wrapped(helper, *args, **kwargs):
+            start = default_timer()
+            try:
+                return func(helper, *args, **kwargs)
+            finally:
+                helper.stats.observe(REQUEST_HOOK_SECONDS,
+                                     default_timer() - start, labels)
+        return wrapped
+    return decorator
@@ -57,7 +57,7 @@ setup(
         'flask': ['flask-opentracing==0.2.0'],
     },
     packages=find_packages(
-        exclude=['tests']
+        exclude=['benchmarks', 'tests']
     ),
     classifiers=[
         'Development Status :: 5 - Production/Stable',
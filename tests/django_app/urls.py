@@ -1,5 +1,6 @@
 from django.conf.urls import url
-from django.http import HttpResponse, StreamingHttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from six import BytesIO
 
 
 RESPONSE_CONTENT_TYPE = 'application/json'
@@ -10,6 +11,23 @@ def home(request):
     return HttpResponse(RESPONSE_DATA, content_type=RESPONSE_CONTENT_TYPE)
 
 
+async def async_home(request):
+    return HttpResponse(RESPONSE_DATA, content_type=RESPONSE_CONTENT_TYPE)
+
+
+def error(request):
+    raise ValueError('Something went wrong')
+
+
+def echo(request):
+    return HttpResponse(request.body, content_type=request.content_type)
+
+
+def file(request):
+    return FileResponse(BytesIO(RESPONSE_DATA),
+                        content_type=RESPONSE_CONTENT_TYPE)
+
+
 def stream(request):
     return StreamingHttpResponse((RESPONSE_DATA[:7], RESPONSE_DATA[7:]),
                                  content_type=RESPONSE_CONTENT_TYPE)
@@ -17,5 +35,9 @@ def stream(request):
 
 urlpatterns = [
     url(r'^$', home),
+    url(r'^async$', async_home),
+    url(r'^echo$', echo),
+    url(r'^error$', error),
+    url(r'^file$', file),
     url(r'^stream$', stream),
 ]
@@ -0,0 +1,183 @@
+import pytest
+from jaeger_client.constants import SAMPLED_FLAG
+from jaeger_client.reporter import InMemoryReporter
+from jaeger_client.sampler import ConstSampler
+from jaeger_client.thrift_gen.jaeger.ttypes import TagType
+from opentracing import Format
+from opentracing.ext import tags
+
+from intracing.aggregation import (
+    AGGREGATED_COUNT,
+    AGGREGATED_MAX,
+    AGGREGATED_MIN,
+    AGGREGATED_TOTAL,
+    SPANS_DROPPED,
+    AggregatingTracer,
+    get_statement,
+)
+from intracing.config import StatsMetricsFactory
+from intracing.stats import TracingStats
+
+
+@pytest.fixture
+def stats():
+    return TracingStats()
+
+
+def get_tracer(stats, **kwargs):
+    return AggregatingTracer(
+        service_name='test-service',
+        reporter=InMemoryReporter(),
+        sampler=ConstSampler(True),
+        metrics_factory=StatsMetricsFactory(stats),
+        **kwargs
+    )
+
+
+def query(tracer, parent, statement, duration=0.01, **tags):
+    span = tracer.start_span('query', child_of=parent,
+                             tags=dict(tags, sql=statement), start_time=1.0)
+    span.finish(finish_time=1.0 + duration)
+    return span
+
+
+def get_tags(span):
+    return {tag.key: tag for tag in span.tags}
+
+
+class TestAggregatingTracer(object):
+
+    def test_aggregation(self, stats):
+        tracer = get_tracer(stats, span_aggregation=True)
+        root = tracer.start_span('root')
+        for duration in (0.01, 0.03, 0.02):
+            query(tracer, root, 'SELECT 1', duration)
+        other = query(tracer, root, 'SELECT 2')
+        last = query(tracer, root, 'SELECT 1')
+
+        reported = tracer.reporter.get_spans()
+        assert len(reported) == 2
+        aggregated = reported[0]
+        assert reported[1] is other
+
+        span_tags = get_tags(aggregated)
+        assert span_tags[AGGREGATED_COUNT].vType == TagType.LONG
+        assert span_tags[AGGREGATED_COUNT].vLong == 3
+        assert span_tags[AGGREGATED_TOTAL].vType == TagType.DOUBLE
+        assert span_tags[AGGREGATED_TOTAL].vDouble == pytest.approx(0.06)
+        assert span_tags[AGGREGATED_MIN].vDouble == pytest.approx(0.01)
+        assert span_tags[AGGREGATED_MAX].vDouble == pytest.approx(0.03)
+        assert aggregated.end_time == pytest.approx(1.03)
+
+        root.finish()
+        reported = tracer.reporter.get_spans()
+        assert reported[2:] == [last, root]
+        assert AGGREGATED_COUNT not in get_tags(last)
+        assert SPANS_DROPPED not in get_tags(root)
+        assert stats.as_dict()['counters']['intracing_aggregated_spans'] == 2
+        assert not tracer._traces
+
+    def test_nested_spans(self, stats):
+        tracer = get_tracer(stats, span_aggregation=True)
+        root = tracer.start_span('root')
+        child = tracer.start_span('child', child_of=root)
+        queries = [query(tracer, child, 'SELECT 1') for _ in range(2)]
+        assert tracer.reporter.get_spans() == []
+
+        child.finish()
+        assert tracer.reporter.get_spans() == [queries[0], child]
+        root.finish()
+        assert tracer.reporter.get_spans() == [queries[0], child, root]
+
+    @pytest.mark.parametrize('span_tags', (
+            {},
+            {tags.ERROR: True},
+    ))
+    def test_not_aggregated(self, stats, span_tags):
+        tracer = get_tracer(stats, span_aggregation=True)
+        root = tracer.start_span('root')
+        spans = [tracer.start_span('child', child_of=root, tags=span_tags)
+                 for _ in range(2)]
+        for span in spans:
+            span.finish()
+        assert tracer.reporter.get_spans() == spans
+
+    def test_aggregation_disabled(self, stats):
+        tracer = get_tracer(stats, max_spans_per_trace=10)
+        root = tracer.start_span('root')
+        spans = [query(tracer, root, 'SELECT 1') for _ in range(2)]
+        assert tracer.reporter.get_spans() == spans
+
+    def test_http_statement(self, stats):
+        tracer = get_tracer(stats)
+        span = tracer.start_span('requests', tags={
+            tags.HTTP_METHOD: 'GET',
+            tags.HTTP_URL: 'http://localhost/',
+            tags.SPAN_KIND: tags.SPAN_KIND_RPC_CLIENT,
+        })
+        assert get_statement(span) == (None, 'requests', (
+            (tags.HTTP_METHOD, 'GET'),
+            (tags.HTTP_URL, 'http://localhost/'),
+        ))
+
+    def test_max_spans_per_trace(self, stats):
+        tracer = get_tracer(stats, max_spans_per_trace=3)
+        root = tracer.start_span('root')
+        spans = [query(tracer, root, 'SELECT {}'.format(i)) for i in range(4)]
+        assert all(span.is_sampled() for span in spans)
+
+        root.finish()
+        assert tracer.reporter.get_spans() == spans[:2] + [root]
+        span_tags = get_tags(root)
+        assert span_tags[SPANS_DROPPED].vType == TagType.LONG
+        assert span_tags[SPANS_DROPPED].vLong == 2
+        assert stats.as_dict()['counters']['intracing_dropped_spans'] == 2
+
+        # a new trace starts from scratch
+        root = tracer.start_span('root')
+        assert query(tracer, root, 'SELECT 1').is_sampled()
+
+    def test_dropped_descendants(self, stats):
+        tracer = get_tracer(stats, max_spans_per_trace=2)
+        root = tracer.start_span('root')
+        child = tracer.start_span('child', child_of=root)
+        dropped = tracer.start_span('dropped', child_of=child)
+        grandchild = tracer.start_span('grandchild', child_of=dropped)
+        for span in (grandchild, dropped, child, root):
+            span.finish()
+
+        assert tracer.reporter.get_spans() == [child, root]
+        assert get_tags(root)[SPANS_DROPPED].vLong == 2
+        assert stats.as_dict()['counters']['intracing_dropped_spans'] == 2
+
+    def test_dropped_span_propagation(self, stats):
+        tracer = get_tracer(stats, max_spans_per_trace=1)
+        root = tracer.start_span('root')
+        dropped = tracer.start_span('dropped', child_of=root)
+
+        headers = {}
+        tracer.inject(dropped.context, Format.HTTP_HEADERS, headers)
+        context = tracer.extract(Format.HTTP_HEADERS, headers)
+        assert context.span_id == dropped.span_id
+        assert context.flags & SAMPLED_FLAG
+
+    def test_not_sampled(self, stats):
+        tracer = get_tracer(stats, span_aggregation=True)
+        tracer.sampler = ConstSampler(False)
+        root = tracer.start_span('root')
+        query(tracer, root, 'SELECT 1')
+        assert not tracer._traces
+
+    def test_max_traces(self, stats):
+        tracer = get_tracer(stats, span_aggregation=True, max_traces=1)
+        root = tracer.start_span('root')
+        span = query(tracer, root, 'SELECT 1')
+        assert tracer.reporter.get_spans() == []
+
+        other = tracer.start_span('other')
+        assert tracer.reporter.get_spans() == [span]
+        assert list(tracer._traces) == [other.trace_id]
+
+        # spans of forgotten traces are reported as they are
+        root.finish()
+        assert tracer.reporter.get_spans() == [span, root]
@@ -0,0 +1,297 @@
+import asyncio
+import os
+
+import mock
+import opentracing
+import pytest
+from jaeger_client.constants import TRACE_ID_HEADER
+from jaeger_client.reporter import InMemoryReporter
+from jaeger_client.thrift_gen.jaeger.ttypes import TagType
+from opentracing.ext import tags
+from opentracing_instrumentation.request_context import get_current_span
+
+from intracing.asgi import IntracingASGIMiddleware, get_url
+
+from .utils import assert_not_contain_tag, assert_tag, disable_tracing
+
+
+RESPONSE_DATA = b'{"foo": "bar"}'
+
+
+@pytest.fixture(autouse=True)
+def reporter():
+    reporter = InMemoryReporter()
+    with mock.patch('intracing.config.IntracingReporter', return_value=reporter):
+        yield reporter
+
+
+def get_middleware(app):
+    IntracingASGIMiddleware.tracing_configured = False
+    return IntracingASGIMiddleware(app)
+
+
+async def echo(scope, receive, send):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+    scope['endpoint'] = echo
+    scope['route'] = mock.Mock(path='/echo')
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'Content-Type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': body[:7],
+                'more_body': True})
+    await send({'type': 'http.response.body', 'body': body[7:]})
+
+
+def request(middleware, path='/echo', body=RESPONSE_DATA, headers=(),
+            query_string=b''):
+    chunks = [body[:5], body[5:]]
+    sent = []
+
+    async def receive():
+        chunk = chunks.pop(0)
+        return {'type': 'http.request', 'body': chunk, 'more_body': chunks}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http',
+        'method': 'POST',
+        'scheme': 'http',
+        'server': ('testserver', 80),
+        'path': path,
+        'query_string': query_string,
+        'headers': [(b'user-agent', b'test-agent')] + list(headers),
+    }
+    run(middleware(scope, receive, send))
+    return sent
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def get_tags(span):
+    return {tag.key: tag for tag in span.tags}
+
+
+class TestIntracingASGIMiddleware(object):
+
+    def test_middleware(self, reporter):
+        sent = request(get_middleware(echo), query_string=b'foo=bar')
+        assert b''.join(message.get('body', b'') for message in sent) == (
+            RESPONSE_DATA
+        )
+
+        span, = reporter.spans
+        assert span.operation_name == 'echo'
+        assert span.end_time
+
+        span_tags = get_tags(span)
+        for key, value in (
+                (tags.SPAN_KIND, tags.SPAN_KIND_RPC_SERVER),
+                (tags.COMPONENT, 'ASGI'),
+                (tags.HTTP_METHOD, 'POST'),
+                (tags.HTTP_URL, 'http://testserver:80/echo?foo=bar'),
+                ('http.route', '/echo'),
+                ('http.user_agent', 'test-agent'),
+                ('http.request.body', RESPONSE_DATA),
+                ('http.response.content_type', 'application/json'),
+                ('http.response.body', RESPONSE_DATA),
+        ):
+            assert_tag(span_tags[key], vType=TagType.STRING, vStr=value)
+        assert_tag(span_tags[tags.HTTP_STATUS_CODE],
+                   vType=TagType.LONG, vLong=200)
+        assert_not_contain_tag(span.tags, tags.ERROR)
+
+    def test_body_size_limit(self, reporter):
+        with mock.patch.dict(os.environ, TRACING_HTTP_BODY_SIZE_LIMIT='10'):
+            middleware = get_middleware(echo)
+        request(middleware)
+
+        span_tags = get_tags(reporter.spans[0])
+        for origin in ('request', 'response'):
+            key = 'http.{}.body'.format(origin)
+            assert span_tags[key].vStr == RESPONSE_DATA[:10]
+            assert span_tags[key + '.truncated'].vBool is True
+
+    def test_not_stored_body(self, reporter):
+        with mock.patch.dict(os.environ, TRACING_STORE_HTTP_BODY='0'):
+            middleware = get_middleware(echo)
+        request(middleware)
+
+        span = reporter.spans[0]
+        assert_not_contain_tag(span.tags, 'http.request.body')
+        assert_not_contain_tag(span.tags, 'http.response.body')
+
+    @pytest.mark.parametrize('threshold,captured', (('0', True),
+                                                    ('3600', False)))
+    def test_deferred_capture(self, reporter, threshold, captured):
+        with mock.patch.dict(os.environ, TRACING_STORE_HTTP_BODY='0',
+                             TRACING_HTTP_BODY_SIZE_LIMIT='1024',
+                             TRACING_DEFERRED_CAPTURE_THRESHOLD=threshold):
+            middleware = get_middleware(echo)
+        request(middleware, headers=[(b'cookie', b'id=42')])
+
+        span_tags = get_tags(reporter.spans[0])
+        if not captured:
+            assert_not_contain_tag(reporter.spans[0].tags, 'http.request.body')
+            assert_not_contain_tag(reporter.spans[0].tags,
+                                   'http.response.headers')
+            return
+
+        assert span_tags['http.request.body'].vStr == RESPONSE_DATA
+        assert span_tags['http.response.body'].vStr == RESPONSE_DATA
+        assert span_tags['http.request.headers'].vStr == (
+            'user-agent: test-agent'
+        )
+        assert span_tags['http.response.headers'].vStr == (
+            'content-type: application/json'
+        )
+
+    def test_not_profiled(self, reporter):
+        # the thread's CPU time is shared by concurrent requests
+        with mock.patch.dict(os.environ, TRACING_PROFILE_REQUESTS='1'):
+            middleware = get_middleware(echo)
+        request(middleware)
+        assert_not_contain_tag(reporter.spans[0].tags, 'profile.wall_time')
+
+    def test_parent_span(self, reporter):
+        middleware = get_middleware(echo)
+        request(middleware, headers=[
+            (TRACE_ID_HEADER.encode('latin-1'), b'1234:5678:0:1'),
+        ])
+
+        span = reporter.spans[0]
+        assert span.trace_id == 0x1234
+        assert span.parent_id == 0x5678
+
+    def test_corrupted_parent_span(self, reporter):
+        middleware = get_middleware(echo)
+        request(middleware, headers=[
+            (TRACE_ID_HEADER.encode('latin-1'), b'foo'),
+        ])
+
+        span = reporter.spans[0]
+        assert span.parent_id is None
+
+    def test_context_propagation(self, reporter):
+        seen_spans = []
+
+        async def get_span():
+            await asyncio.sleep(0)
+            return get_current_span()
+
+        async def app(scope, receive, send):
+            await asyncio.sleep(0)
+            seen_spans.append(get_current_span())
+            seen_spans.append(await asyncio.ensure_future(get_span()))
+            await send({'type': 'http.response.start', 'status': 204})
+            await send({'type': 'http.response.body'})
+
+        middleware = get_middleware(app)
+
+        async def handle_concurrently():
+            await asyncio.gather(
+                middleware(*get_scope_and_channels()),
+                middleware(*get_scope_and_channels()),
+            )
+
+        run(handle_concurrently())
+        assert get_current_span() is None
+
+        first_span, second_span = reporter.spans
+        assert first_span is not second_span
+        assert sorted(seen_spans, key=id) == sorted(
+            [first_span, first_span, second_span, second_span], key=id
+        )
+        assert seen_spans[0] is seen_spans[2] or seen_spans[0] is seen_spans[1]
+
+    def test_exception(self, reporter):
+
+        async def app(scope, receive, send):
+            raise ValueError
+
+        with pytest.raises(ValueError):
+            request(get_middleware(app))
+
+        span = reporter.spans[0]
+        assert span.operation_name == 'POST'
+        span_tags = get_tags(span)
+        assert span_tags[tags.HTTP_STATUS_CODE].vLong == 500
+        assert span_tags[tags.ERROR].vBool is True
+
+    def test_not_sampled(self, reporter):
+        with mock.patch.dict(os.environ, TRACING_SAMPLER_PARAM='0'):
+            middleware = get_middleware(echo)
+        sent = request(middleware)
+
+        assert sent[0]['status'] == 200
+        assert b''.join(message.get('body', b'') for message in sent) == (
+            RESPONSE_DATA
+        )
+        # not sampled spans are not reported
+        assert reporter.spans == []
+
+    def test_excluded_path(self, reporter):
+        with mock.patch.dict(os.environ, TRACING_EXCLUDE_PATHS='/health'):
+            middleware = get_middleware(echo)
+        sent = request(middleware, path='/health')
+
+        assert sent[0]['status'] == 200
+        assert reporter.spans == []
+
+    def test_lifespan(self, reporter):
+        calls = []
+
+        async def app(*args):
+            calls.append(args)
+
+        scope = {'type': 'lifespan'}
+        run(get_middleware(app)(scope, mock.sentinel.receive,
+                                mock.sentinel.send))
+
+        assert calls == [(scope, mock.sentinel.receive, mock.sentinel.send)]
+        assert reporter.spans == []
+
+    @disable_tracing
+    def test_tracing_disabled(self, reporter):
+        middleware = get_middleware(echo)
+        assert opentracing.tracer is not None
+        request(middleware)
+        assert reporter.spans == []
+
+    @pytest.mark.parametrize('scope,headers,expected', (
+            ({'path': '/'}, {}, 'http://localhost/'),
+            ({'path': '/foo', 'scheme': 'https', 'root_path': '/api',
+              'server': ('example.com', 443)}, {},
+             'https://example.com:443/api/foo'),
+            ({'path': '/', 'query_string': b'foo=bar'},
+             {'host': 'example.com'}, 'http://example.com/?foo=bar'),
+    ))
+    def test_get_url(self, scope, headers, expected):
+        assert get_url(scope, headers) == expected
+
+
+def get_scope_and_channels():
+
+    async def receive():
+        return {'type': 'http.request'}
+
+    async def send(message):
+        pass
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/', 'headers': []}
+    return scope, receive, send
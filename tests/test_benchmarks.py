@@ -0,0 +1,64 @@
+import json
+import subprocess
+import sys
+
+from benchmarks.overhead import percentile, print_table
+
+
+def run_benchmark(name, *args):
+    # benchmarks configure tracing, frameworks and the global tracer,
+    # so they are run in processes of their own
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.' + name, '--json'] + list(args)
+    )
+    return json.loads(output.decode('utf-8'))
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([1], 99) == 1
+
+
+def test_print_table(capsys):
+    print_table([{'framework': 'flask', 'spans_per_sec': 1.5}])
+    assert capsys.readouterr().out.split() == [
+        'framework', 'spans_per_sec', 'flask', '1.500',
+    ]
+
+
+def test_overhead_benchmark():
+    results = run_benchmark('overhead', '--requests', '5', '--warmup', '1',
+                            '--allocation-requests', '1',
+                            '--flush-timeout', '1')
+
+    assert [(result['framework'], result['mode'], result['reporter'])
+            for result in results] == [
+        (framework, mode, reporter)
+        for framework in ('flask', 'django')
+        for mode, reporter in (('off', '-'),
+                               ('on', 'memory'), ('on', 'udp'),
+                               ('body', 'memory'), ('body', 'udp'))
+    ]
+    for result in results:
+        assert result['p50_ms'] <= result['p99_ms']
+        if result['mode'] == 'off':
+            assert result['spans_per_sec'] == 0
+        else:
+            assert result['spans_per_sec'] == result['requests_per_sec']
+
+
+def test_serialization_benchmark():
+    results = run_benchmark('serialization', '--spans', '20', '--rounds', '1',
+                            '--body-size', '100')
+
+    assert [(result['framework'], result['mode']) for result in results] == [
+        (framework, mode)
+        for framework in ('flask', 'django')
+        for mode in ('cached', 'uncached', 'reporter', 'reporter-exact')
+    ]
+    for result in results:
+        assert result['spans'] == 20
+        assert result['spans_per_sec'] > 0
+        assert result['bytes_per_span'] > 200
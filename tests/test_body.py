@@ -0,0 +1,83 @@
+import mock
+import pytest
+from six import BytesIO
+
+from intracing.body import BodyTee, PrefixedStream, peek_stream
+
+DATA = b'foo\nbar\nbaz\n'
+
+
+class TestPrefixedStream(object):
+
+    @pytest.mark.parametrize('size', (None, 0, 2, 5, 100))
+    def test_peek_stream(self, size):
+        prefix, stream = peek_stream(BytesIO(DATA), size)
+        assert prefix == DATA[:size]
+        assert stream.read() == DATA
+
+    def test_peek_stream_short_reads(self):
+        class ShortStream(BytesIO):
+            def read(self, size=-1):
+                return super(ShortStream, self).read(min(size, 1))
+
+        prefix, stream = peek_stream(ShortStream(DATA), 5)
+        assert prefix == DATA[:5]
+
+    @pytest.mark.parametrize('size', (None, -1, 3, 6, 100))
+    def test_read(self, size):
+        stream = PrefixedStream(DATA[:5], BytesIO(DATA[5:]))
+        chunk = stream.read(size)
+        assert chunk == DATA[:size if size and size > 0 else None]
+        assert chunk + stream.read() == DATA
+
+    @pytest.mark.parametrize('prefix_size,size,expected', (
+            (2, None, b'foo\n'),
+            (5, None, b'foo\n'),
+            (5, -1, b'foo\n'),
+            (5, 2, b'fo'),
+            (2, 3, b'foo'),
+            (0, 2, b'fo'),
+    ))
+    def test_readline(self, prefix_size, size, expected):
+        stream = PrefixedStream(DATA[:prefix_size],
+                                BytesIO(DATA[prefix_size:]))
+        line = stream.readline(size)
+        assert line == expected
+        assert line + stream.read() == DATA
+
+    def test_iteration(self):
+        stream = PrefixedStream(DATA[:6], BytesIO(DATA[6:]))
+        assert list(stream) == [b'foo\n', b'bar\n', b'baz\n']
+
+    def test_attribute_proxying(self):
+        original = BytesIO(DATA)
+        stream = PrefixedStream(b'', original)
+        assert stream.getvalue() == DATA
+
+
+class TestBodyTee(object):
+
+    @pytest.mark.parametrize('size,expected', (
+            (None, b'foobar'),
+            (2, b'fo'),
+            (4, b'foob'),
+    ))
+    def test_body_tee(self, size, expected):
+        callback = mock.Mock()
+        tee = BodyTee([b'foo', u'bar'], size, callback)
+        assert list(tee) == [b'foo', u'bar']
+        callback.assert_not_called()
+
+        tee.close()
+        tee.close()
+        callback.assert_called_once_with(expected, 6)
+
+    def test_iterable_closing(self):
+        callback = mock.Mock()
+        iterable = mock.MagicMock()
+        iterable.close.side_effect = ValueError
+
+        tee = BodyTee(iterable, None, callback)
+        with pytest.raises(ValueError):
+            tee.close()
+        callback.assert_called_once_with(b'', 0)
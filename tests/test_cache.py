@@ -0,0 +1,73 @@
+import os
+
+import mock
+import pytest
+from jaeger_client.thrift_gen.jaeger.ttypes import TagType
+
+from intracing.base import TracingHelper
+from intracing.cache import TagCache, make_tag
+
+from .utils import assert_tag
+
+
+class TestTagCache(object):
+
+    def test_reset_after_fork(self):
+        cache = TagCache()
+        tag = cache.get('foo', 'bar')
+        lock = cache._lock
+        cache.reset_after_fork()
+        assert cache._lock is not lock
+        assert cache.get('foo', 'bar') is tag
+
+    @pytest.mark.parametrize('value,attrs', (
+            (u'foo', {'vType': TagType.STRING, 'vStr': u'foo'}),
+            (b'foo', {'vType': TagType.STRING, 'vStr': b'foo'}),
+            (200, {'vType': TagType.LONG, 'vLong': 200}),
+            (True, {'vType': TagType.BOOL, 'vBool': True}),
+            (0.5, {'vType': TagType.DOUBLE, 'vDouble': 0.5}),
+    ))
+    def test_make_tag(self, value, attrs):
+        assert_tag(make_tag('key', value), key='key', **attrs)
+
+    def test_hits_and_misses(self):
+        cache = TagCache()
+        tag = cache.get('http.method', 'GET')
+        assert (cache.hits, cache.misses) == (0, 1)
+
+        assert cache.get('http.method', 'GET') is tag
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        assert cache.get('http.method', 'POST') is not tag
+        assert (cache.hits, cache.misses) == (1, 2)
+
+        cache.clear()
+        assert not len(cache)
+        assert (cache.hits, cache.misses) == (0, 0)
+
+    def test_value_types(self):
+        cache = TagCache()
+        assert cache.get('key', 1).vType == TagType.LONG
+        assert cache.get('key', True).vType == TagType.BOOL
+
+    def test_eviction(self):
+        cache = TagCache(size=2)
+        foo_tag = cache.get('key', 'foo')
+        bar_tag = cache.get('key', 'bar')
+        assert cache.get('key', 'foo') is foo_tag  # bar is the oldest now
+
+        cache.get('key', 'baz')
+        assert len(cache) == 2
+        assert cache.get('key', 'foo') is foo_tag
+        assert cache.get('key', 'bar') is not bar_tag
+
+    def test_disabled(self):
+        cache = TagCache(size=0)
+        assert cache.get('key', 'foo') is not cache.get('key', 'foo')
+        assert not len(cache)
+        assert cache.misses == 2
+
+    @mock.patch.dict(os.environ, TRACING_TAG_CACHE_SIZE='10')
+    def test_configuration(self):
+        TracingHelper.init_config()
+        assert TracingHelper.tag_cache.size == 10
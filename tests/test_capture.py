@@ -0,0 +1,11 @@
+from intracing.capture import format_headers
+
+
+def test_format_headers():
+    assert format_headers([
+        ('Content-Type', 'text/plain'),
+        ('Authorization', 'Bearer secret'),
+        ('X-Request-Id', '42'),
+        ('cookie', 'id=42'),
+    ]) == 'Content-Type: text/plain\nX-Request-Id: 42'
+    assert format_headers([]) == ''
@@ -1,7 +1,27 @@
+import os
+import time
+
 import mock
+import opentracing
+import pytest
+from celery import Celery
+from celery.app.task import Context
+from celery.contrib.testing.worker import start_worker
 from celery.signals import worker_init
+from jaeger_client.constants import TRACE_ID_HEADER
+from jaeger_client.reporter import InMemoryReporter
+from jaeger_client.thrift_gen.jaeger.ttypes import TagType
+from kombu import Producer
+from opentracing.ext import tags
+from opentracing_instrumentation.request_context import (
+    RequestContextManager,
+    get_current_span,
+)
+
+from intracing.base import TracingHelper
+from intracing.celery import CeleryTracing, get_carrier
 
-from .utils import get_flask_app
+from .utils import assert_not_contain_tag, assert_tag, get_flask_app
 
 
 class TestFlaskTracingHelper(object):
@@ -18,3 +38,199 @@ class TestFlaskTracingHelper(object):
         get_flask_app()
         worker_init.send(None)
         apply_patches_mock.assert_called_once_with()
+
+
+@pytest.fixture
+def reporter():
+    reporter = InMemoryReporter()
+    with mock.patch('intracing.config.IntracingReporter',
+                    return_value=reporter):
+        TracingHelper.tracing_configured = False
+        TracingHelper.configure_tracing()
+        yield reporter
+
+
+@pytest.fixture(scope='module')
+def celery_app():
+    app = Celery('tests', broker='memory://', backend='cache+memory://')
+    app.conf.task_default_queue = 'tests'
+    app.conf.broker_transport_options = {'polling_interval': 0.01}
+
+    @app.task(name='tests.add')
+    def add(x, y):
+        return x + y
+
+    @app.task(name='tests.fail')
+    def fail():
+        raise ValueError('Something went wrong')
+
+    @app.task(name='tests.retry', bind=True, max_retries=1)
+    def retry(task):
+        if not task.request.retries:
+            raise task.retry(countdown=0)
+        return task.request.retries
+
+    @app.task(name='tests.current_span')
+    def current_span():
+        return get_current_span().operation_name
+
+    with start_worker(app, pool='solo', perform_ping_check=False):
+        yield app
+
+
+def get_tags(span):
+    return {tag.key: tag for tag in span.tags}
+
+
+def find_spans(reporter, operation_name, count=1):
+    # results are stored before task spans are finished by the worker
+    deadline = time.time() + 10
+    while True:
+        spans = [span for span in reporter.spans
+                 if span.operation_name == operation_name]
+        if len(spans) >= count or time.time() > deadline:
+            return spans
+        time.sleep(0.01)
+
+
+class TestCeleryTracing(object):
+
+    def test_task(self, celery_app, reporter):
+        parent_span = opentracing.tracer.start_span('parent')
+        with RequestContextManager(parent_span):
+            result = celery_app.tasks['tests.add'].delay(1, 2)
+        assert result.get(timeout=10, interval=0.01) == 3
+
+        publish_span, = find_spans(reporter, 'apply_async:tests.add')
+        task_span, = find_spans(reporter, 'tests.add')
+        assert publish_span.parent_id == parent_span.span_id
+        assert task_span.parent_id == publish_span.span_id
+        assert task_span.trace_id == parent_span.trace_id
+
+        for span, span_kind in ((publish_span, 'producer'),
+                                (task_span, 'consumer')):
+            span_tags = get_tags(span)
+            for key, value in (
+                    (tags.SPAN_KIND, span_kind),
+                    (tags.COMPONENT, 'Celery'),
+                    ('celery.task_name', 'tests.add'),
+                    ('celery.task_id', result.id),
+                    ('celery.queue', 'tests'),
+                    (tags.MESSAGE_BUS_DESTINATION, 'tests'),
+            ):
+                assert_tag(span_tags[key], vType=TagType.STRING, vStr=value)
+            assert_not_contain_tag(span.tags, tags.ERROR)
+
+        span_tags = get_tags(task_span)
+        assert_tag(span_tags['celery.retries'], vType=TagType.LONG, vLong=0)
+        assert_tag(span_tags['celery.state'], vType=TagType.STRING,
+                   vStr='SUCCESS')
+        assert span_tags['celery.runtime'].vType == TagType.DOUBLE
+        assert span_tags['celery.runtime'].vDouble > 0
+
+    def test_task_failure(self, celery_app, reporter):
+        result = celery_app.tasks['tests.fail'].delay()
+        with pytest.raises(ValueError):
+            result.get(timeout=10, interval=0.01)
+
+        task_span, = find_spans(reporter, 'tests.fail')
+        span_tags = get_tags(task_span)
+        assert_tag(span_tags[tags.ERROR], vType=TagType.BOOL, vBool=True)
+        assert span_tags['celery.state'].vStr == 'FAILURE'
+
+        log, = task_span.logs
+        assert {field.key: field.vStr for field in log.fields} == {
+            'event': tags.ERROR,
+            'error.object': 'Something went wrong',
+        }
+
+    def test_task_retry(self, celery_app, reporter):
+        result = celery_app.tasks['tests.retry'].delay()
+        assert result.get(timeout=10, interval=0.01) == 1
+
+        first_span, second_span = find_spans(reporter, 'tests.retry', 2)
+        assert get_tags(first_span)['celery.retries'].vLong == 0
+        assert get_tags(first_span)['celery.state'].vStr == 'RETRY'
+        assert get_tags(second_span)['celery.retries'].vLong == 1
+        # the retry is published by the first execution
+        retry_publish_span = find_spans(
+            reporter, 'apply_async:tests.retry', 2
+        )[1]
+        assert retry_publish_span.parent_id == first_span.span_id
+        assert second_span.parent_id == retry_publish_span.span_id
+
+    def test_current_span(self, celery_app, reporter):
+        result = celery_app.tasks['tests.current_span'].delay()
+        assert result.get(timeout=10, interval=0.01) == 'tests.current_span'
+        assert get_current_span() is None
+
+    def test_not_sampled(self, celery_app, reporter):
+        with mock.patch.dict(os.environ, TRACING_SAMPLER_PARAM='0'):
+            TracingHelper.tracing_configured = False
+            TracingHelper.configure_tracing()
+
+        result = celery_app.tasks['tests.add'].delay(1, 2)
+        assert result.get(timeout=10, interval=0.01) == 3
+        assert reporter.spans == []
+
+    def test_corrupted_span_context(self, reporter):
+        task = mock.Mock()
+        task.name = 'tests.add'
+        task.request = Context(intracing={TRACE_ID_HEADER: 'foo'},
+                               delivery_info=None, retries=None)
+        tracing = CeleryTracing(TracingHelper)
+        tracing.task_prerun(task_id='foo', task=task)
+        tracing.task_postrun(task=task)
+
+        task_span, = reporter.spans
+        assert task_span.parent_id is None
+        span_tags = get_tags(task_span)
+        assert_not_contain_tag(task_span.tags, 'celery.queue')
+        assert_not_contain_tag(task_span.tags, 'celery.state')
+        assert span_tags['celery.retries'].vLong == 0
+
+    @pytest.mark.parametrize('request_attrs', (
+            {'intracing': {'foo': 'bar'}},
+            {'headers': {'intracing': {'foo': 'bar'}}},
+    ))
+    def test_get_carrier(self, request_attrs):
+        assert get_carrier(Context(**request_attrs)) == {'foo': 'bar'}
+
+    def test_failed_publish(self, celery_app, reporter):
+        task = celery_app.tasks['tests.add']
+
+        def publish(*args, **kwargs):
+            raise ValueError('Broker is unavailable')
+
+        with mock.patch.object(Producer, '_publish', publish):
+            with pytest.raises(ValueError):
+                task.delay(1, 2)
+        assert not reporter.spans
+
+        # the span is finished once the next task is published
+        assert task.delay(1, 2).get(timeout=10) == 3
+        failed_span, span = find_spans(reporter, 'apply_async:tests.add',
+                                       count=2)
+        assert failed_span.span_id != span.span_id
+        assert_tag(get_tags(failed_span)[tags.ERROR], vBool=True)
+        assert failed_span.logs[0].fields[-1].vStr == (
+            'Task was not published'
+        )
+        assert tags.ERROR not in get_tags(span)
+
+    def test_failed_unsampled_publish(self, reporter):
+        tracing = CeleryTracing(TracingHelper)
+        span = mock.Mock(tags=[])
+        span.is_sampled.return_value = False
+        tracing._publishing.task = 'foo', span
+        tracing.before_task_publish(sender='tests.add')
+        span.finish.assert_called_once_with()
+        assert span.tags == []
+
+    def test_unknown_messages(self, reporter):
+        tracing = CeleryTracing(TracingHelper)
+        tracing.before_task_publish(sender='tests.add')
+        tracing.after_task_publish(headers={'id': 'foo'})
+        tracing.task_failure(sender=mock.Mock(request=Context()))
+        tracing.task_postrun(task=mock.Mock(request=Context()))
+        assert reporter.spans == []
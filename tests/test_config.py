@@ -0,0 +1,115 @@
+import os
+
+import mock
+import pytest
+from jaeger_client.reporter import CompositeReporter
+from jaeger_client.sampler import (
+    AdaptiveSampler,
+    ConstSampler,
+    ProbabilisticSampler,
+    RateLimitingSampler,
+    RemoteControlledSampler,
+)
+from jaeger_client.throttler import RemoteThrottler
+
+from intracing.aggregation import AggregatingTracer
+from intracing.base import TracingHelper
+from intracing.config import IntracingConfig
+from intracing.reporter import IntracingReporter
+
+
+def get_sampler(**env):
+    with mock.patch.dict(os.environ, env):
+        TracingHelper.init_config()
+    return TracingHelper.config.sampler
+
+
+class TestIntracingConfig(object):
+
+    def test_default_sampler(self):
+        sampler = get_sampler()
+        assert isinstance(sampler, ConstSampler)
+        assert sampler.decision
+
+    @pytest.mark.parametrize('sampler_type,param,sampler_class', (
+            ('const', '0', ConstSampler),
+            ('probabilistic', '0.1', ProbabilisticSampler),
+            ('ratelimiting', '5', RateLimitingSampler),
+    ))
+    def test_sampler_type(self, sampler_type, param, sampler_class):
+        sampler = get_sampler(TRACING_SAMPLER_TYPE=sampler_type,
+                              TRACING_SAMPLER_PARAM=param)
+        assert isinstance(sampler, sampler_class)
+
+    def test_remote_sampler(self):
+        assert get_sampler(TRACING_SAMPLER_TYPE='remote') is None
+        config = TracingHelper.config
+        assert config.local_agent_sampling_port == 5778
+
+        with mock.patch.dict(os.environ, TRACING_SAMPLER_TYPE='remote',
+                             TRACING_SAMPLING_PORT='15778',
+                             TRACING_SAMPLING_REFRESH_INTERVAL='10'):
+            TracingHelper.init_config()
+        config = TracingHelper.config
+        assert config.local_agent_sampling_port == 15778
+        assert config.sampling_refresh_interval == 10
+
+        with mock.patch('intracing.config.IntracingReporter'):
+            tracer = config.new_tracer()
+        assert isinstance(tracer.sampler, RemoteControlledSampler)
+        assert tracer.sampler.sampling_refresh_interval == 10
+        tracer.sampler.close()
+
+    def test_adaptive_sampler(self):
+        sampler = get_sampler(TRACING_SAMPLER_TYPE='adaptive',
+                              TRACING_SAMPLER_PARAM='0.5',
+                              TRACING_SAMPLER_LOWER_BOUND='2',
+                              TRACING_SAMPLER_MAX_OPERATIONS='10')
+        assert isinstance(sampler, AdaptiveSampler)
+        assert sampler.default_sampling_probability == 0.5
+        assert sampler.lower_bound == 2.0
+        assert sampler.max_operations == 10
+
+    def test_adaptive_sampler_defaults(self):
+        config = IntracingConfig(
+            config={'sampler': {'type': 'adaptive', 'param': 1}},
+            service_name='test-service',
+        )
+        sampler = config.sampler
+        assert isinstance(sampler, AdaptiveSampler)
+        assert sampler.max_operations == 2000
+
+    def test_new_tracer(self):
+        config = IntracingConfig(
+            config={'logging': True, 'throttler': {'port': 5778}},
+            service_name='test-service',
+        )
+        tracer = config.new_tracer()
+        assert isinstance(tracer.reporter, CompositeReporter)
+        assert isinstance(tracer.reporter.reporters[0], IntracingReporter)
+        assert isinstance(tracer.throttler, RemoteThrottler)
+        tracer.close()
+
+    def test_aggregating_tracer(self):
+        with mock.patch.dict(os.environ, TRACING_AGGREGATE_SPANS='1',
+                             TRACING_MAX_SPANS_PER_TRACE='100'):
+            TracingHelper.init_config()
+        config = TracingHelper.config
+        assert config.span_aggregation
+        assert config.max_spans_per_trace == 100
+
+        tracer = config.create_tracer(reporter=mock.Mock(),
+                                      sampler=config.sampler)
+        assert isinstance(tracer, AggregatingTracer)
+        assert tracer.span_aggregation
+        assert tracer.max_spans_per_trace == 100
+
+    def test_default_tracer(self):
+        TracingHelper.init_config()
+        config = TracingHelper.config
+        assert not config.span_aggregation
+        assert config.max_spans_per_trace is None
+
+        tracer = config.create_tracer(reporter=mock.Mock(),
+                                      sampler=config.sampler)
+        assert not isinstance(tracer, AggregatingTracer)
@@ -0,0 +1,88 @@
+import asyncio
+import sys
+import threading
+
+import mock
+import pytest
+from six.moves import builtins
+from opentracing_instrumentation.request_context import (
+    RequestContextManager,
+    get_current_span,
+)
+
+from intracing.context import ContextVarState, use_contextvars
+
+original_import = __import__
+
+
+@pytest.fixture(autouse=True)
+def state():
+    use_contextvars()
+    return RequestContextManager._state
+
+
+def test_use_contextvars(state):
+    assert isinstance(state, ContextVarState)
+    use_contextvars()
+    assert RequestContextManager._state is state
+
+
+@mock.patch.dict(sys.modules)
+def test_contextvars_not_available():
+
+    def custom_import(name, *args):
+        if name == 'contextvars':
+            raise ImportError
+        return original_import(name, *args)
+
+    with mock.patch.object(builtins, '__import__', custom_import):
+        del sys.modules['intracing.context']
+        from intracing.context import use_contextvars
+
+    with pytest.raises(RuntimeError):
+        use_contextvars()
+
+
+def test_threads():
+    spans = []
+
+    def get_span():
+        spans.append(get_current_span())
+
+    with RequestContextManager(span=mock.sentinel.span):
+        thread = threading.Thread(target=get_span)
+        thread.start()
+        thread.join()
+        assert get_current_span() is mock.sentinel.span
+
+    assert spans == [None]
+    assert get_current_span() is None
+
+
+def test_asyncio_tasks():
+
+    async def get_span():
+        await asyncio.sleep(0)
+        return get_current_span()
+
+    async def handle(span):
+        with RequestContextManager(span=span):
+            await asyncio.sleep(0)
+            task_span = await asyncio.ensure_future(get_span())
+            return get_current_span(), task_span
+
+    async def handle_concurrently():
+        return await asyncio.gather(
+            handle(mock.sentinel.foo), handle(mock.sentinel.bar)
+        )
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(handle_concurrently())
+    finally:
+        loop.close()
+
+    assert results == [
+        (mock.sentinel.foo, mock.sentinel.foo),
+        (mock.sentinel.bar, mock.sentinel.bar),
+    ]
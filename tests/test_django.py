@@ -1,18 +1,32 @@
+import asyncio
+import gc
 import sys
+import threading
+import tracemalloc
 
 import mock
 import opentracing
 import pytest
 from django.conf import settings
-from django.test.client import Client
+from django.test.client import AsyncClient, Client
 from faker import Faker
 from jaeger_client.reporter import InMemoryReporter
 from jaeger_client.thrift_gen.jaeger.ttypes import TagType
+from opentracing.ext import tags
 
 from intracing.django import IntracingDjangoMiddleware
+from intracing.routes import compile_path_patterns
 
 from .utils import assert_http_view_span, assert_not_contain_tag, assert_tag
-from .django_app.urls import RESPONSE_CONTENT_TYPE, RESPONSE_DATA
+from .django_app.urls import RESPONSE_CONTENT_TYPE, RESPONSE_DATA, home
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
 
 
 @pytest.fixture(scope='module', autouse=True)
@@ -59,6 +73,7 @@ class TestIntracingDjangoMiddleware(object):
                               component='Django',
                               method='POST',
                               url='http://testserver/',
+                              route='/',
                               user_agent=user_agent,
                               status_code=200,
                               request_content_type=request_content_type,
@@ -92,9 +107,248 @@ class TestIntracingDjangoMiddleware(object):
         assert not reporter.spans
 
     def test_django_streaming_response(self, client, reporter):
-        view_span = self._test_django(client, reporter, streaming=True)
+        response = client.get('/stream')
+        assert response.status_code == 200
+        assert not reporter.spans
+
+        assert next(response.streaming_content) == RESPONSE_DATA[:7]
+        assert not reporter.spans
+
+        assert b''.join(response.streaming_content) == RESPONSE_DATA[7:]
+        assert_tag(reporter.spans[0].tags[-2], key='http.response.body',
+                   vType=TagType.STRING, vStr=RESPONSE_DATA)
+
+    @mock.patch.object(IntracingDjangoMiddleware, 'store_http_body', False)
+    def test_django_streaming_response_not_stored(self, client, reporter):
+        response = client.get('/stream')
+        assert reporter.spans
+        assert response.getvalue() == RESPONSE_DATA
+        assert_not_contain_tag(reporter.spans[0].tags, 'http.response.body')
+
+    def test_django_file_response(self, client, reporter):
+        response = client.get('/file')
+        assert response.getvalue() == RESPONSE_DATA
+        assert_not_contain_tag(reporter.spans[0].tags, 'http.response.body')
+
+    @mock.patch.object(IntracingDjangoMiddleware, 'http_body_size_limit', 10)
+    def test_django_body_size_limit(self, client, reporter):
+        request_data = Faker().text(100).encode('utf-8')
+        response = client.post('/echo', data=request_data,
+                               content_type='text/plain')
+        assert response.status_code == 200
+        assert response.content == request_data
+
+        span_tags = reporter.spans[0].tags
+        for origin in ('request', 'response'):
+            body_tag_key = 'http.{}.body'.format(origin)
+            body_tag = next(tag for tag in span_tags
+                            if tag.key == body_tag_key)
+            assert body_tag.vStr == request_data[:10]
+            truncated_tag = span_tags[span_tags.index(body_tag) + 1]
+            assert_tag(truncated_tag, key=body_tag_key + '.truncated',
+                       vType=TagType.BOOL, vBool=True)
+
+    def test_django_body_already_read(self, rf, reporter):
+        span = mock.Mock()
+        middleware = IntracingDjangoMiddleware(mock.Mock())
+
+        request = rf.post('/', data=b'foo', content_type='text/plain')
+        assert request.body == b'foo'
+        assert middleware._get_request_body(request, span) == b'foo'
+
+        request = rf.post('/', data=b'foo', content_type='text/plain')
+        assert request.read(1) == b'f'
+        assert middleware._get_request_body(request, span) is None
+
+    @mock.patch.object(IntracingDjangoMiddleware, 'store_http_body', False)
+    def test_django_body_not_stored(self, client, reporter):
+        with mock.patch.object(IntracingDjangoMiddleware,
+                               'peek_http_body') as peek_mock:
+            view_span = self._test_django(client, reporter,
+                                          data=b'foo',
+                                          content_type='text/plain')
+        peek_mock.assert_not_called()
+        assert_not_contain_tag(view_span.tags, 'http.request.body')
         assert_not_contain_tag(view_span.tags, 'http.response.body')
 
+    @mock.patch.object(IntracingDjangoMiddleware, 'route_operation_name',
+                       True)
+    def test_django_route_operation_name(self, client, reporter):
+        response = client.get('/stream')
+        assert response.getvalue() == RESPONSE_DATA
+
+        view_span = reporter.spans[0]
+        assert view_span.operation_name == '/stream'
+        assert_tag(view_span.tags[6], key='http.route', vStr='/stream')
+
+    def test_django_excluded_path(self, client, reporter):
+        pattern = compile_path_patterns('/stream')
+        with mock.patch.object(IntracingDjangoMiddleware, 'excluded_paths',
+                               pattern):
+            response = client.get('/stream')
+        assert response.getvalue() == RESPONSE_DATA
+        assert not reporter.spans
+        assert not opentracing.tracer._current_spans
+
+    @mock.patch.object(IntracingDjangoMiddleware, 'excluded_paths', None)
+    def test_django_excluded_path_setting(self, client, reporter):
+        with mock.patch.object(settings, 'TRACING_EXCLUDE_PATHS',
+                               (r'^/s\w{1,5}m$',), create=True):
+            IntracingDjangoMiddleware.configure_component()
+        response = client.get('/stream')
+        assert response.getvalue() == RESPONSE_DATA
+        assert not reporter.spans
+
+    @pytest.mark.parametrize('path,operation_name', (
+            ('/', 'home'),
+            ('/async', 'async_home'),
+    ))
+    def test_django_async_middleware(self, path, operation_name, reporter):
+        faker = Faker()
+        request_data = faker.text().encode('utf-8')
+        user_agent = faker.user_agent()
+        client = AsyncClient()
+
+        hook_threads = []
+
+        def should_store_http_body(span):
+            hook_threads.append(threading.current_thread())
+            return True
+
+        with mock.patch.object(IntracingDjangoMiddleware,
+                               'should_store_http_body',
+                               side_effect=should_store_http_body), \
+                mock.patch('django.utils.deprecation.sync_to_async') as \
+                sync_to_async_mock:
+            response = run(client.post(path, data=request_data,
+                                       content_type='text/plain',
+                                       **{'user-agent': user_agent}))
+        assert response.status_code == 200
+        assert response.content == RESPONSE_DATA
+
+        # the hooks are called right from the event loop
+        sync_to_async_mock.assert_not_called()
+        assert hook_threads == [threading.current_thread()] * 2
+
+        view_span = reporter.spans[0]
+        assert view_span.operation_name == operation_name
+        assert_http_view_span(view_span,
+                              component='Django',
+                              method='POST',
+                              url='http://testserver' + path,
+                              route=path,
+                              user_agent=user_agent,
+                              status_code=200,
+                              request_content_type='text/plain',
+                              request_body=request_data,
+                              response_content_type=RESPONSE_CONTENT_TYPE,
+                              response_body=RESPONSE_DATA)
+        assert not opentracing.tracer._current_spans
+
+    def test_django_async_streaming_response(self, reporter):
+        response = run(AsyncClient().get('/stream'))
+        assert b''.join(response.streaming_content) == RESPONSE_DATA
+        response.close()
+
+        view_span = reporter.spans[0]
+        assert view_span.operation_name == 'stream'
+        assert_tag(view_span.tags[-2], key='http.response.body',
+                   vStr=RESPONSE_DATA)
+
+    def test_django_exception(self, reporter):
+        client = Client(raise_request_exception=False)
+        response = client.get('/error')
+        assert response.status_code == 500
+
+        view_span = reporter.spans[0]
+        assert view_span.operation_name == 'error'
+        assert view_span.end_time
+        span_tags = {tag.key: tag for tag in view_span.tags}
+        assert span_tags[tags.HTTP_STATUS_CODE].vLong == 500
+        assert span_tags[tags.ERROR].vBool is True
+
+        log, = view_span.logs
+        assert {field.key: field.vStr for field in log.fields} == {
+            'event': tags.ERROR,
+            'error.object': 'Something went wrong',
+        }
+        assert not opentracing.tracer._current_spans
+
+    @pytest.mark.parametrize('path,threshold,captured', (
+            ('/echo', 0, True),
+            ('/error', 3600, True),
+            ('/stream', 3600, False),
+    ))
+    @mock.patch.object(IntracingDjangoMiddleware, 'store_http_body', False)
+    def test_django_deferred_capture(self, path, threshold, captured,
+                                     reporter):
+        client = Client(raise_request_exception=False,
+                        HTTP_X_REQUEST_ID='42', HTTP_AUTHORIZATION='secret')
+        with mock.patch.object(IntracingDjangoMiddleware,
+                               'deferred_capture_threshold', threshold):
+            response = client.post(path, data=b'foo',
+                                   content_type='text/plain')
+            if response.streaming:
+                response.getvalue()
+
+        span_tags = {tag.key: tag for tag in reporter.spans[0].tags}
+        if not captured:
+            assert 'http.request.body' not in span_tags
+            assert 'http.request.headers' not in span_tags
+            return
+
+        assert span_tags['http.request.body'].vStr == b'foo'
+        request_headers = span_tags['http.request.headers'].vStr
+        assert 'X-Request-Id: 42' in request_headers.splitlines()
+        assert 'secret' not in request_headers
+        assert 'Content-Type: ' in span_tags['http.response.headers'].vStr
+
+    @mock.patch.object(IntracingDjangoMiddleware, 'profile_requests', True)
+    def test_django_profiling(self, client, reporter):
+        view_span = self._test_django(client, reporter)
+        span_tags = {tag.key: tag for tag in view_span.tags}
+        assert 'profile.wall_time' in span_tags
+        assert 'profile.cpu_time' in span_tags
+
+    def test_django_exception_not_traced(self, rf):
+        middleware = IntracingDjangoMiddleware(mock.Mock())
+        assert middleware.process_exception(rf.get('/'), ValueError()) is None
+
+    def test_django_abandoned_requests(self, rf):
+        # e.g. requests failed in other middleware never reach
+        # `process_response`, their spans must not be kept forever
+        middleware = IntracingDjangoMiddleware(mock.Mock())
+
+        def abandon_requests(count):
+            for _ in range(count):
+                request = rf.get('/')
+                middleware.process_view(request, home, (), {})
+                assert opentracing.tracer.get_span(request) is not None
+
+        abandon_requests(100)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            memory_before = tracemalloc.get_traced_memory()[0]
+            abandon_requests(1000)
+            gc.collect()
+            memory_after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+        assert not opentracing.tracer._current_spans
+        assert memory_after - memory_before < 64 * 1024
+
+    @mock.patch.dict(sys.modules)
+    @mock.patch('six.PY2', True)
+    def test_django_python2(self):
+        del sys.modules['intracing.django']
+        from intracing.django import IntracingDjangoMiddleware
+
+        assert not hasattr(IntracingDjangoMiddleware, '_process_view_async')
+        middleware = IntracingDjangoMiddleware(mock.Mock())
+        assert 'process_view' not in vars(middleware)
+
     @pytest.mark.parametrize('middleware', (None, []))
     @mock.patch.dict(sys.modules)
     def test_configure_component(self, middleware, client, reporter):
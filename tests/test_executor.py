@@ -0,0 +1,92 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import mock
+import pytest
+from jaeger_client import Tracer
+from jaeger_client.reporter import InMemoryReporter
+from jaeger_client.sampler import ConstSampler
+from opentracing_instrumentation.request_context import (
+    RequestContextManager,
+    get_current_span,
+)
+
+from intracing.executor import (
+    TracingThreadPoolExecutor,
+    propagate_context,
+    wrap_context,
+)
+
+
+@pytest.fixture(autouse=True)
+def request_context():
+    # spans of other tests' requests might be left in the context
+    with RequestContextManager():
+        yield
+
+
+@pytest.fixture
+def executor():
+    executor = TracingThreadPoolExecutor(max_workers=2)
+    yield executor
+    executor.shutdown()
+
+
+def get_span_and_thread(*args):
+    return get_current_span(), threading.current_thread()
+
+
+class TestExecutor(object):
+
+    def test_submit(self, executor):
+        with RequestContextManager(span=mock.sentinel.span):
+            span, thread = executor.submit(get_span_and_thread).result()
+        assert span is mock.sentinel.span
+        assert thread is not threading.current_thread()
+
+        # the worker thread gets back to its own context
+        assert executor.submit(get_current_span).result() is None
+
+    def test_map(self, executor):
+        with RequestContextManager(span=mock.sentinel.span):
+            results = list(executor.map(get_span_and_thread, range(4)))
+        assert [span for span, _ in results] == [mock.sentinel.span] * 4
+
+    def test_child_spans(self, executor):
+        tracer = Tracer(service_name='test-service',
+                        reporter=InMemoryReporter(),
+                        sampler=ConstSampler(True))
+
+        def call(index):
+            span = tracer.start_span('call', child_of=get_current_span())
+            span.finish()
+            return span
+
+        root = tracer.start_span('root')
+        with RequestContextManager(span=root):
+            spans = list(executor.map(call, range(4)))
+        assert {span.parent_id for span in spans} == {root.span_id}
+        assert {span.trace_id for span in spans} == {root.trace_id}
+
+    def test_no_context(self):
+        assert wrap_context(get_current_span) is get_current_span
+
+    def test_exception(self, executor):
+        def fail():
+            raise ValueError(get_current_span())
+
+        with RequestContextManager(span=mock.sentinel.span):
+            future = executor.submit(fail)
+        with pytest.raises(ValueError) as error:
+            future.result()
+        assert error.value.args == (mock.sentinel.span,)
+        assert executor.submit(get_current_span).result() is None
+
+    def test_propagate_context(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        executor.submit = propagate_context(executor.submit)
+        with RequestContextManager(span=mock.sentinel.span):
+            future = executor.submit(get_span_and_thread, 'foo')
+        assert future.result()[0] is mock.sentinel.span
+        assert executor.submit.__name__ == 'submit'
+        executor.shutdown()
@@ -1,9 +1,12 @@
+import os
+
 import mock
+import opentracing
 import pytest
 import requests
 import six
 from faker import Faker
-from flask import Response, send_file
+from flask import Flask, Response, request, send_file
 from jaeger_client.constants import TRACE_ID_HEADER
 from jaeger_client.thrift_gen.jaeger.ttypes import TagType
 from jaeger_client.reporter import InMemoryReporter
@@ -27,7 +30,7 @@ app = pytest.fixture(get_flask_app, name='app')
 @pytest.fixture(autouse=True)
 def reporter():
     reporter = InMemoryReporter()
-    with mock.patch('jaeger_client.config.Reporter', return_value=reporter):
+    with mock.patch('intracing.config.IntracingReporter', return_value=reporter):
         yield reporter
 
 
@@ -45,7 +48,7 @@ class TestFlaskTracingHelper(object):
         assert Helper.enter_request_context in app.before_request_funcs[None]
         assert Helper.exit_request_context in app.after_request_funcs[None]
 
-    @mock.patch('jaeger_client.config.Config.new_tracer')
+    @mock.patch('intracing.config.IntracingConfig.new_tracer')
     def test_tracer_initialization(self, new_tracer_mock, app):
         app.test_client().get('/')  # making request to init tracer
         new_tracer_mock.assert_called_once()
@@ -105,6 +108,7 @@ class TestFlaskTracingHelper(object):
                               component='Flask',
                               method=method,
                               url='http://localhost/',
+                              route='/',
                               user_agent=user_agent,
                               status_code=status_code,
                               request_content_type=request_content_type,
@@ -141,6 +145,62 @@ class TestFlaskTracingHelper(object):
         response = app.test_client().get('/')
         assert response.status_code == 200
 
+        span_tags = reporter.spans[0].tags
+        assert_tag(span_tags[-3], key='http.response.body',
+                   vType=TagType.STRING, vStr=data[:limit])
+        assert_tag(span_tags[-2], key='http.response.body.truncated',
+                   vType=TagType.BOOL, vBool=True)
+
+    @with_http_body_size_limit(limit=50)
+    def test_request_body_peeking(self, limit, reporter):
+        request_data = Faker().text(limit * 4).encode('utf-8')
+        app = get_flask_app()
+
+        @app.route('/', methods=['POST'])
+        def post():
+            return request.get_data(), 200
+
+        response = app.test_client().post('/', data=request_data,
+                                          content_type='text/plain')
+        assert response.status_code == 200
+        assert response.data == request_data
+
+        span_tags = reporter.spans[0].tags
+        assert_tag(span_tags[9], key='http.request.body',
+                   vType=TagType.STRING, vStr=request_data[:limit])
+        assert_tag(span_tags[10], key='http.request.body.truncated',
+                   vType=TagType.BOOL, vBool=True)
+
+    @with_http_body_size_limit(limit=50)
+    def test_request_form_peeking(self, limit, reporter):
+        form = {'foo': 'bar' * limit}
+        app = get_flask_app()
+
+        @app.route('/', methods=['POST'])
+        def post():
+            return request.form['foo'], 200
+
+        response = app.test_client().post('/', data=form)
+        assert response.status_code == 200
+        assert response.data == form['foo'].encode('utf-8')
+
+        assert_tag(reporter.spans[0].tags[9], key='http.request.body',
+                   vType=TagType.STRING, vStr=b'foo=' + b'bar' * 15 + b'b')
+
+    @mock.patch.dict(os.environ, TRACING_STORE_HTTP_BODY='0')
+    def test_http_body_not_stored(self, reporter):
+        app = get_flask_app()
+
+        @app.route('/', methods=['POST'])
+        def post():
+            return 'foo', 200
+
+        with mock.patch.object(Helper, 'peek_http_body') as peek_mock:
+            response = app.test_client().post('/', data=b'bar')
+        assert response.status_code == 200
+
+        peek_mock.assert_not_called()
+        assert_not_contain_tag(reporter.spans[0].tags, 'http.request.body')
         assert_not_contain_tag(reporter.spans[0].tags, 'http.response.body')
 
     def test_stream_handling(self, app, reporter):
@@ -156,3 +216,282 @@ class TestFlaskTracingHelper(object):
         assert response.data == response_data
 
         assert_not_contain_tag(reporter.spans[0].tags, 'http.response.body')
+
+    @mock.patch.dict(os.environ, TRACING_SAMPLER_PARAM='0')
+    @mock.patch.object(Helper, 'set_content_type_tag')
+    def test_not_sampled(self, set_content_type_tag_mock, reporter):
+        app = get_flask_app()
+
+        @app.route('/')
+        def get():
+            return 'foo', 200
+
+        response = app.test_client().get('/')
+        assert response.status_code == 200
+
+        set_content_type_tag_mock.assert_not_called()
+        assert not reporter.spans
+
+    @with_http_body_size_limit(limit=5)
+    def test_streamed_response(self, limit, reporter):
+        chunks = [b'foo', b'bar', b'baz']
+        app = get_flask_app()
+
+        @app.route('/')
+        def get():
+            return Response(iter(chunks), content_type='text/plain')
+
+        response = app.test_client().get('/')
+        assert response.status_code == 200
+        assert not reporter.spans
+
+        app_iter = iter(response.response)
+        assert next(app_iter) == chunks[0]
+        assert not reporter.spans
+
+        assert list(app_iter) == chunks[1:]
+        response.close()
+        span_tags = reporter.spans[0].tags
+        assert_tag(span_tags[-3], key='http.response.body',
+                   vType=TagType.STRING, vStr=b'fooba')
+        assert_tag(span_tags[-2], key='http.response.body.truncated',
+                   vType=TagType.BOOL, vBool=True)
+        assert_tag(span_tags[-1], key=tags.HTTP_STATUS_CODE,
+                   vType=TagType.LONG, vLong=200)
+
+    @mock.patch.dict(os.environ, TRACING_STORE_HTTP_BODY='0')
+    def test_streamed_response_not_stored(self, reporter):
+        app = get_flask_app()
+
+        @app.route('/')
+        def get():
+            return Response(iter([b'foo']), content_type='text/plain')
+
+        response = app.test_client().get('/')
+        assert response.status_code == 200
+        assert reporter.spans
+        assert response.data == b'foo'
+
+    @pytest.mark.parametrize('threshold,status_code,captured', (
+            ('3600', 200, False),
+            ('3600', 500, True),
+            ('0', 200, True),
+    ))
+    def test_deferred_capture(self, threshold, status_code, captured,
+                              reporter):
+        with mock.patch.dict(os.environ, TRACING_STORE_HTTP_BODY='0',
+                             TRACING_DEFERRED_CAPTURE_THRESHOLD=threshold):
+            app = get_flask_app()
+        Helper.stats.reset()
+
+        @app.route('/', methods=['POST'])
+        def post():
+            return Response(b'bar', status=status_code,
+                            headers={'Set-Cookie': 'id=42'})
+
+        response = app.test_client().post('/', data=b'foo', headers={
+            'Authorization': 'Bearer secret',
+            'X-Request-Id': '42',
+        })
+        assert response.status_code == status_code
+
+        span_tags = {tag.key: tag for tag in reporter.spans[0].tags}
+        counters = Helper.get_stats()['counters']
+        assert not Helper.deferred_captures
+        if not captured:
+            assert 'http.request.body' not in span_tags
+            assert 'http.response.headers' not in span_tags
+            assert counters[
+                'intracing_deferred_captures{result="skipped"}'
+            ] == 1
+            return
+
+        assert span_tags['http.request.body'].vStr == b'foo'
+        assert span_tags['http.response.body'].vStr == b'bar'
+        request_headers = span_tags['http.request.headers'].vStr
+        assert 'X-Request-Id: 42' in request_headers.splitlines()
+        assert 'secret' not in request_headers
+        assert span_tags['http.response.headers'].vStr.splitlines() == [
+            'Content-Type: text/html; charset=utf-8',
+            'Content-Length: 3',
+        ]
+        assert counters['intracing_deferred_captures{result="captured"}'] == 1
+
+    @mock.patch.dict(os.environ, TRACING_DEFERRED_CAPTURE_THRESHOLD='0')
+    def test_deferred_capture_streamed_response(self, reporter):
+        app = get_flask_app()
+
+        @app.route('/')
+        def get():
+            return Response(iter([b'foo']), content_type='text/plain')
+
+        response = app.test_client().get('/')
+        assert response.data == b'foo'
+        response.close()
+
+        span_tags = {tag.key: tag for tag in reporter.spans[0].tags}
+        assert span_tags['http.response.body'].vStr == b'foo'
+        assert span_tags['http.response.headers'].vStr == (
+            'Content-Type: text/plain'
+        )
+
+    @mock.patch.dict(os.environ, TRACING_PROFILE_REQUESTS='1')
+    def test_profiling(self, reporter):
+        app = get_flask_app()
+
+        @app.route('/')
+        def get():
+            return 'foo', 200
+
+        response = app.test_client().get('/')
+        assert response.status_code == 200
+
+        span_tags = {tag.key: tag for tag in reporter.spans[0].tags}
+        assert span_tags['profile.wall_time'].vType == TagType.DOUBLE
+        assert 0 < span_tags['profile.cpu_time'].vDouble
+        assert span_tags['profile.gc.collections'].vType == TagType.LONG
+        assert not Helper.profiles
+
+    @mock.patch.dict(os.environ, TRACING_STACK_SAMPLING_THRESHOLD='0',
+                     TRACING_STACK_SAMPLING_INTERVAL='3600')
+    def test_stack_sampling(self, reporter):
+        app = get_flask_app()
+        sampler = Helper.stack_sampler
+        assert sampler.interval == 3600
+
+        @app.route('/')
+        def get():
+            sampler.sample()
+            return 'foo', 200
+
+        client = app.test_client()
+        for _ in range(2):
+            assert client.get('/').status_code == 200
+
+        span_tags = {tag.key: tag for tag in reporter.spans[0].tags}
+        assert span_tags['profile.stack_samples'].vLong == 1
+        assert span_tags['profile.stacks'].vStr.endswith(
+            ';tests.test_flask:get;intracing.profiling:sample 1'
+        )
+        assert 'profile.wall_time' not in span_tags
+
+        # tracing is configured again with a new sampler
+        get_flask_app()
+        assert sampler._stopped.is_set()
+
+    @mock.patch.dict(os.environ, TRACING_PROFILE_MEMORY='1')
+    @mock.patch('tracemalloc.start')
+    def test_memory_profiling(self, start_mock, reporter):
+        get_flask_app()
+        # memory tracing is only started explicitly
+        start_mock.assert_not_called()
+        assert Helper.profile_requests
+
+    def test_tags_caching(self, app, reporter):
+        @app.route('/')
+        def get():
+            return 'foo', 200
+
+        test_client = app.test_client()
+        test_client.get('/')
+        test_client.get('/')
+
+        cached_keys = {
+            tags.SPAN_KIND,
+            tags.COMPONENT,
+            tags.HTTP_METHOD,
+            tags.HTTP_STATUS_CODE,
+            'http.route',
+            'http.user_agent',
+            'http.response.content_type',
+        }
+        first_tags, second_tags = (span.tags for span in reporter.spans)
+        for first_tag, second_tag in zip(first_tags, second_tags):
+            if first_tag.key in cached_keys:
+                assert first_tag is second_tag
+        assert Helper.tag_cache.hits == 5
+
+    @mock.patch.dict(os.environ, TRACING_ROUTE_OPERATION_NAME='1',
+                     TRACING_NORMALIZE_URL='1')
+    def test_route_operation_name(self, reporter):
+        app = get_flask_app()
+
+        @app.route('/users/<int:user_id>')
+        def get_user(user_id):
+            return 'foo', 200
+
+        response = app.test_client().get('/users/42?foo=bar')
+        assert response.status_code == 200
+
+        span = reporter.spans[0]
+        assert span.operation_name == '/users/<int:user_id>'
+        assert_tag(span.tags[5], key=tags.HTTP_URL,
+                   vStr='http://localhost/users/{id}?foo=bar')
+        assert_tag(span.tags[6], key='http.route',
+                   vStr='/users/<int:user_id>')
+
+    @mock.patch.dict(os.environ, TRACING_EXCLUDE_PATHS='/health')
+    def test_excluded_path(self, reporter):
+        app = get_flask_app()
+
+        @app.route('/health')
+        def health():
+            return 'ok', 200
+
+        tracer = opentracing.tracer
+        with mock.patch.object(tracer._tracer, 'start_span') as start_mock:
+            response = app.test_client().get('/health')
+        assert response.status_code == 200
+
+        start_mock.assert_not_called()
+        assert not tracer._current_spans
+
+    @mock.patch.object(Helper, 'excluded_paths', None)
+    def test_excluded_path_setting(self, reporter):
+        app = Flask(__name__)
+        app.config['TRACING_EXCLUDE_PATHS'] = [r'^/v\d{1,3}/health$']
+        Helper.tracing_configured = False
+        Helper.configure_tracing(app)
+
+        @app.route('/v<int:version>/health')
+        def health(version):
+            return 'ok', 200
+
+        with mock.patch.object(opentracing.tracer._tracer,
+                               'start_span') as start_mock:
+            response = app.test_client().get('/v12/health')
+        assert response.status_code == 200
+
+        start_mock.assert_not_called()
+
+    @with_http_body_size_limit(limit=10)
+    def test_stats(self, limit, reporter):
+        app = get_flask_app()
+        Helper.stats.reset()
+
+        @app.route('/', methods=['POST'])
+        def post():
+            return 'foo', 200
+
+        response = app.test_client().post('/', data=b'0' * 100,
+                                          content_type='text/plain')
+        assert response.status_code == 200
+
+        stats = Helper.get_stats()
+        counters = stats['counters']
+        assert counters['intracing_http_body_bytes{result="captured"}'] == 13
+        assert counters['intracing_http_body_bytes{result="skipped"}'] == 90
+        assert counters['intracing_created_tags'] == 3
+        assert counters['intracing_cached_tags{result="miss"}'] == (
+            Helper.tag_cache.misses
+        )
+        assert counters['jaeger_started_spans{sampled="y"}'] == 1
+        assert counters['jaeger_finished_spans'] == 1
+
+        histograms = stats['histograms']
+        for hook in ('enter_request_context', 'exit_request_context'):
+            series = 'intracing_request_hook_seconds{{hook="{}"}}'.format(hook)
+            assert histograms[series]['count'] == 1
+
+        assert ('jaeger_finished_spans 1\n'
+                in Helper.get_stats_prometheus())
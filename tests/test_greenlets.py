@@ -0,0 +1,151 @@
+import sys
+import threading
+
+import mock
+import pytest
+from jaeger_client import Tracer
+from jaeger_client.reporter import InMemoryReporter
+from jaeger_client.sampler import ConstSampler
+from opentracing_instrumentation.request_context import (
+    RequestContextManager,
+    get_current_span,
+)
+
+from intracing.base import TracingHelper
+from intracing.context import ContextVarState, use_context_backend
+
+gevent = pytest.importorskip('gevent')
+eventlet = pytest.importorskip('eventlet')
+
+GREENLETS = 100
+
+
+@pytest.fixture(autouse=True)
+def state():
+    state = RequestContextManager._state
+    RequestContextManager._state = threading.local()
+    yield
+    RequestContextManager._state = state
+
+
+@pytest.fixture
+def tracer():
+    return Tracer(service_name='test-service', reporter=InMemoryReporter(),
+                  sampler=ConstSampler(True))
+
+
+def handle_request(tracer, sleep):
+    root = tracer.start_span('request')
+    with RequestContextManager(span=root):
+        # other greenlets are run meanwhile
+        sleep(0)
+        for _ in range(3):
+            span = tracer.start_span('call', child_of=get_current_span())
+            sleep(0)
+            span.finish()
+        current_span = get_current_span()
+    root.finish()
+    return root, current_span
+
+
+def assert_parented(tracer, results):
+    for root, current_span in results:
+        assert current_span is root
+
+    roots = {root.span_id: root for root, _ in results}
+    calls = [span for span in tracer.reporter.get_spans()
+             if span.operation_name == 'call']
+    assert len(calls) == GREENLETS * 3
+    for span in calls:
+        assert roots[span.parent_id].trace_id == span.trace_id
+
+
+class TestGreenletContext(object):
+
+    def test_gevent(self, tracer):
+        use_context_backend('gevent')
+        greenlets = [gevent.spawn(handle_request, tracer, gevent.sleep)
+                     for _ in range(GREENLETS)]
+        gevent.joinall(greenlets, raise_error=True)
+        assert_parented(tracer, [greenlet.value for greenlet in greenlets])
+
+    def test_eventlet(self, tracer):
+        use_context_backend('eventlet')
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(
+            lambda _: handle_request(tracer, eventlet.sleep),
+            range(GREENLETS),
+        ))
+        assert_parented(tracer, results)
+
+    def test_thread_local(self, tracer):
+        # greenlets of a thread overwrite each other's span
+        use_context_backend('thread')
+        greenlets = [gevent.spawn(handle_request, tracer, gevent.sleep)
+                     for _ in range(GREENLETS)]
+        gevent.joinall(greenlets, raise_error=True)
+        assert any(current_span is not root
+                   for root, current_span in (greenlet.value
+                                              for greenlet in greenlets))
+
+    def test_threads(self, tracer):
+        # greenlet-locals are thread-locals as well
+        use_context_backend('gevent')
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(handle_request(tracer, lambda _: 0))
+        ) for _ in range(GREENLETS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert_parented(tracer, results)
+
+
+class TestContextBackend(object):
+
+    def test_auto(self):
+        use_context_backend()
+        assert isinstance(RequestContextManager._state, gevent.local.local)
+
+        state = RequestContextManager._state
+        use_context_backend('gevent')
+        assert RequestContextManager._state is state
+
+    @mock.patch.dict(sys.modules, gevent=None)
+    def test_auto_eventlet(self):
+        use_context_backend('auto')
+        assert isinstance(RequestContextManager._state,
+                          eventlet.corolocal.local)
+
+    @mock.patch.dict(sys.modules, gevent=None, eventlet=None)
+    def test_auto_threads(self):
+        state = RequestContextManager._state
+        use_context_backend('auto')
+        assert RequestContextManager._state is state
+
+    @pytest.mark.skipif(sys.version_info < (3, 7),
+                        reason='contextvars are not available')
+    def test_auto_contextvars(self):
+        use_context_backend('contextvars')
+        state = RequestContextManager._state
+        assert isinstance(state, ContextVarState)
+        use_context_backend('auto')
+        assert RequestContextManager._state is state
+
+    def test_thread(self):
+        use_context_backend('eventlet')
+        use_context_backend('thread')
+        assert type(RequestContextManager._state) is threading.local
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            use_context_backend('asyncio')
+
+    def test_configuration(self):
+        with mock.patch.dict('os.environ', TRACING_CONTEXT_BACKEND='eventlet'):
+            TracingHelper.tracing_configured = False
+            TracingHelper.configure_tracing()
+        assert TracingHelper.context_backend == 'eventlet'
+        assert isinstance(RequestContextManager._state,
+                          eventlet.corolocal.local)
@@ -1,9 +1,21 @@
+import os
+
 import mock
 import opentracing
 import pytest
+from jaeger_client import Tracer
+from jaeger_client.reporter import InMemoryReporter
+from jaeger_client.sampler import ConstSampler
+from jaeger_client.thrift_gen.jaeger.ttypes import Tag, TagType
+from opentracing.ext import tags
 
 import intracing
-from intracing.base import TracingHelper
+from intracing.base import (
+    IntracingTracerMixin,
+    TracingHelper,
+    reset_tracer_after_fork,
+)
+from intracing.cache import TagCache
 from intracing.django import IntracingDjangoMiddleware
 from intracing.flask import FlaskTracingHelper
 
@@ -13,7 +25,7 @@ class TestHelpers(object):
     @pytest.mark.parametrize('helper,args', (
             (TracingHelper, []),
             (IntracingDjangoMiddleware, []),
-            (FlaskTracingHelper, [mock.Mock()]),
+            (FlaskTracingHelper, [mock.Mock(config={})]),
     ))
     def test_configure_twice(self, helper, args):
         helper.tracing_configured = False
@@ -21,11 +33,94 @@ class TestHelpers(object):
         assert helper.tracing_configured
 
         tracer = opentracing.tracer
-        if helper is not TracingHelper:
-            tracer = tracer._tracer
-
         assert tracer.tags['intracing.version'] == intracing.__version__
 
         with mock.patch.object(helper, '_configure_tracing') as configure_mock:
             helper.configure_tracing(*args)
             configure_mock.assert_not_called()
+
+    @pytest.mark.skipif(not hasattr(os, 'register_at_fork'),
+                        reason='os.register_at_fork is not available')
+    def test_fork(self):
+        TracingHelper.tracing_configured = False
+        TracingHelper.configure_tracing()
+        assert TracingHelper.fork_hook_registered
+        parent_reporter = opentracing.tracer.reporter
+
+        pid = os.fork()
+        if not pid:
+            # the tracer is created again in the child process
+            reset = opentracing.tracer._tracer_instance is None
+            os._exit(int(not reset or opentracing.tracer.reporter is
+                         parent_reporter))
+
+        _, status = os.waitpid(pid, 0)
+        assert os.WIFEXITED(status)
+        assert os.WEXITSTATUS(status) == 0
+        assert opentracing.tracer.reporter is parent_reporter
+
+    @mock.patch.object(TracingHelper, 'fork_hook_registered', False)
+    def test_register_fork_hook(self):
+        with mock.patch('os.register_at_fork', create=True) as register_mock:
+            TracingHelper.register_fork_hook()
+            TracingHelper.register_fork_hook()
+        register_mock.assert_called_once_with(
+            after_in_child=reset_tracer_after_fork
+        )
+
+    @mock.patch.object(TracingHelper, 'fork_hook_registered', False)
+    def test_register_fork_hook_not_available(self):
+        with mock.patch.object(os, 'register_at_fork', create=True):
+            del os.register_at_fork
+            TracingHelper.register_fork_hook()
+        assert not TracingHelper.fork_hook_registered
+
+    def test_reset_tracer_after_fork(self):
+        lock = IntracingTracerMixin._tracer_lock
+        with mock.patch.object(opentracing, 'tracer') as tracer_mock:
+            reset_tracer_after_fork()
+        tracer_mock.reset_tracer.assert_called_once_with()
+        assert IntracingTracerMixin._tracer_lock is not lock
+
+        with mock.patch.object(opentracing, 'tracer', opentracing.Tracer()):
+            reset_tracer_after_fork()
+
+    def test_constant_tags(self):
+        helper = type('Helper', (TracingHelper,), {'COMPONENT': 'Test'})
+        assert helper.TAG_SPAN_KIND == Tag(key=tags.SPAN_KIND,
+                                           vType=TagType.STRING,
+                                           vStr=tags.SPAN_KIND_RPC_SERVER)
+        assert helper.TAG_ERROR == Tag(key=tags.ERROR, vType=TagType.BOOL,
+                                       vBool=True)
+        assert helper.TAG_COMPONENT == Tag(key=tags.COMPONENT,
+                                           vType=TagType.STRING, vStr='Test')
+        assert helper.TAG_COMPONENT is helper.TAG_COMPONENT
+        assert FlaskTracingHelper.TAG_COMPONENT.vStr == 'Flask'
+
+    @mock.patch.object(TracingHelper, 'tag_cache', TagCache())
+    def test_no_component_tag(self):
+        assert TracingHelper.TAG_COMPONENT is None
+        tracer = Tracer(service_name='test-service',
+                        reporter=InMemoryReporter(),
+                        sampler=ConstSampler(True))
+        span = tracer.start_span('test')
+        TracingHelper.set_request_tags(span, 'GET', 'http://localhost/',
+                                       None, None, None)
+        assert tags.COMPONENT not in {tag.key for tag in span.tags}
+        assert None not in span.tags
+
+    def test_reset_after_fork(self):
+        stats = mock.Mock()
+        helper = type('Helper', (FlaskTracingHelper,), {
+            'stats': stats,
+            'tag_cache': mock.Mock(),
+            'stack_sampler': mock.Mock(),
+        })
+        with mock.patch.object(TracingHelper, 'tag_cache', mock.Mock()), \
+                mock.patch.object(TracingHelper, 'stack_sampler', None):
+            reset_tracer_after_fork()
+            TracingHelper.tag_cache.reset_after_fork.assert_called_once_with()
+
+        stats.reset_after_fork.assert_called_once_with()
+        helper.tag_cache.reset_after_fork.assert_called_once_with()
+        helper.stack_sampler.reset_after_fork.assert_called_once_with()
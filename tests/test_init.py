@@ -1,39 +1,107 @@
+import os
+import subprocess
 import sys
 
 import mock
 import pytest
+from thrift.protocol.TCompactProtocol import TCompactProtocol
 
-from six.moves import builtins
 
-from intracing import write_string
+INTEGRATION_MODULES = (
+    'intracing', 'intracing.django', 'intracing.flask', 'intracing.reporter',
+)
 
-original_import = __import__
+
+def block_modules(*packages):
+    """Make packages along with their submodules not importable"""
+
+    modules = dict.fromkeys(packages)
+    modules.update(
+        (module, None) for module in sys.modules
+        if module.split('.')[0] in packages
+    )
+    return mock.patch.dict(sys.modules, modules)
+
+
+def reimport_intracing():
+    for module in INTEGRATION_MODULES:
+        sys.modules.pop(module, None)
+    import intracing
+    return intracing
 
 
 @mock.patch.dict(sys.modules)
 def test_init():
-    import intracing
-    assert hasattr(intracing, 'default_app_config')
-    assert hasattr(intracing, 'configure_tracing')
+    intracing = reimport_intracing()
+    assert 'configure_tracing' not in vars(intracing)
+    assert intracing.default_app_config == intracing.DEFAULT_APP_CONFIG
+    assert intracing.configure_tracing is sys.modules[
+        'intracing.flask'
+    ].configure_tracing
+    assert intracing.IntracingDjangoMiddleware is sys.modules[
+        'intracing.django'
+    ].IntracingDjangoMiddleware
+    assert 'configure_tracing' in vars(intracing)
 
-    def custom_import(name, *args):
-        if name in {'django', 'flask'}:
-            raise ImportError
-        return original_import(name, *args)
+    with pytest.raises(AttributeError):
+        intracing.foo
 
-    with mock.patch.object(builtins, '__import__', custom_import):
-        del sys.modules['intracing']
-        import intracing
+    with block_modules('django', 'flask'):
+        intracing = reimport_intracing()
         assert not hasattr(intracing, 'default_app_config')
         assert not hasattr(intracing, 'configure_tracing')
 
 
-@pytest.mark.parametrize('value,expected', (
-        ('test', b'test'),
-        (b'test', b'test'),
-        (u'test', b'test'),
-))
-def test_write_string(value, expected):
-    proto = mock.Mock()
-    write_string(proto, value)
-    proto.writeBinary.assert_called_once_with(expected)
+@mock.patch.dict(sys.modules)
+@mock.patch.object(sys, 'version_info', (3, 6))
+def test_init_without_module_getattr():
+    with block_modules('flask'):
+        intracing = reimport_intracing()
+    assert vars(intracing)['default_app_config'] == (
+        intracing.DEFAULT_APP_CONFIG
+    )
+    assert 'IntracingDjangoMiddleware' in vars(intracing)
+    assert 'write_string' in vars(intracing)
+    assert 'configure_tracing' not in vars(intracing)
+
+
+@mock.patch.dict(sys.modules)
+@mock.patch.object(TCompactProtocol, 'writeString', None)
+def test_write_string():
+    intracing = reimport_intracing()
+    assert 'write_string' not in vars(intracing)
+
+    from intracing import write_string
+    assert write_string is sys.modules['intracing.reporter'].write_string
+    assert TCompactProtocol.writeString is write_string
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason='lazy attributes require Python 3.7+')
+def test_import_time():
+    # tracing libraries must not be imported while tracing is disabled
+    code = (
+        'import intracing; '
+        'from intracing.base import TracingHelper; '
+        'TracingHelper.configure_tracing()'
+    )
+    env = dict(os.environ, TRACING_ENABLED='0')
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        env=env, stderr=subprocess.STDOUT,
+    ).decode('utf-8')
+
+    imported_modules = {
+        line.rsplit('|', 1)[-1].strip()
+        for line in output.splitlines()
+        if line.startswith('import time:')
+    }
+    assert 'intracing.base' in imported_modules
+    heavy_modules = {
+        module for module in imported_modules
+        if module.split('.')[0] in {
+            'django', 'flask', 'jaeger_client', 'opentracing_instrumentation',
+            'thrift', 'tornado',
+        }
+    }
+    assert not heavy_modules
@@ -0,0 +1,263 @@
+import gc
+import sys
+import threading
+import time
+import tracemalloc
+
+import mock
+import pytest
+from six.moves import builtins
+
+from intracing import profiling
+from intracing.profiling import (
+    PROFILE_CPU_TIME,
+    PROFILE_GC_COLLECTIONS,
+    PROFILE_GC_PAUSE_TIME,
+    PROFILE_MEMORY_DELTA,
+    PROFILE_MEMORY_PEAK,
+    PROFILE_WALL_TIME,
+    GCMonitor,
+    MemoryProfiles,
+    RequestProfile,
+    StackSampler,
+    StackSamples,
+    collapse_stack,
+    start_memory_tracing,
+)
+
+original_import = __import__
+
+
+@pytest.fixture
+def memory_tracing():
+    start_memory_tracing()
+    yield
+    tracemalloc.stop()
+
+
+@pytest.fixture
+def gc_monitor():
+    monitor = GCMonitor()
+    with mock.patch.object(profiling, 'gc_monitor', monitor):
+        yield monitor
+    if monitor.installed:
+        gc.callbacks.remove(monitor.callback)
+
+
+@pytest.fixture
+def stack_sampler():
+    sampler = StackSampler(0, interval=3600)
+    yield sampler
+    sampler.stop()
+
+
+class TestGCMonitor(object):
+
+    def test_collections(self, gc_monitor):
+        gc_monitor.install()
+        gc_monitor.install()
+        assert gc.callbacks.count(gc_monitor.callback) == 1
+
+        gc.collect()
+        gc.collect()
+        assert gc_monitor.collections == 2
+        assert gc_monitor.pause_time > 0
+
+    def test_not_started(self, gc_monitor):
+        gc_monitor.callback('stop', {})
+        assert gc_monitor.collections == 0
+
+
+class TestRequestProfile(object):
+
+    def test_profile(self, gc_monitor):
+        gc_monitor.install()
+        profile = RequestProfile()
+        sum(range(100000))
+        gc.collect()
+
+        values = dict(profile.finish())
+        assert set(values) == {
+            PROFILE_WALL_TIME,
+            PROFILE_CPU_TIME,
+            PROFILE_GC_COLLECTIONS,
+            PROFILE_GC_PAUSE_TIME,
+        }
+        assert 0 < values[PROFILE_CPU_TIME]
+        # other threads may trigger collections as well
+        assert values[PROFILE_GC_COLLECTIONS] >= 1
+        assert values[PROFILE_GC_PAUSE_TIME] <= values[PROFILE_WALL_TIME]
+
+    @mock.patch.object(profiling, 'thread_time', None)
+    def test_without_thread_time(self, gc_monitor):
+        assert dict(RequestProfile().finish()).keys() == {PROFILE_WALL_TIME}
+
+    def test_memory(self, memory_tracing):
+        profile = RequestProfile(memory=True)
+        data = [object() for _ in range(1000)]
+
+        values = dict(profile.finish())
+        assert values[PROFILE_MEMORY_DELTA] > 0
+        # the peak is only known since Python 3.9
+        assert (PROFILE_MEMORY_PEAK in values) is hasattr(tracemalloc,
+                                                          'reset_peak')
+        del data
+
+    def test_memory_without_peak(self, memory_tracing):
+        # tracemalloc of Python before 3.9
+        tracemalloc_mock = mock.Mock(
+            spec=['is_tracing', 'get_traced_memory'], wraps=tracemalloc
+        )
+        with mock.patch.object(profiling, 'tracemalloc', tracemalloc_mock):
+            values = dict(RequestProfile(memory=True).finish())
+        assert PROFILE_MEMORY_DELTA in values
+        assert PROFILE_MEMORY_PEAK not in values
+
+    def test_memory_peak(self, memory_tracing):
+        with mock.patch.object(tracemalloc, 'reset_peak', create=True) as (
+                reset_peak
+        ):
+            profile = RequestProfile(memory=True)
+            reset_peak.assert_called_once_with()
+            data = [object() for _ in range(1000)]
+            del data
+            values = dict(profile.finish())
+        assert values[PROFILE_MEMORY_PEAK] >= values[PROFILE_MEMORY_DELTA]
+
+    @mock.patch.object(tracemalloc, 'reset_peak', create=True)
+    def test_concurrent_memory_peak(self, reset_peak, memory_tracing):
+        first = RequestProfile(memory=True)
+        second = RequestProfile(memory=True)
+        reset_peak.assert_called_once_with()
+        for profile in (second, first):
+            values = dict(profile.finish())
+            assert PROFILE_MEMORY_DELTA in values
+            assert PROFILE_MEMORY_PEAK not in values
+
+        # abandoned requests don't overlap later ones
+        RequestProfile(memory=True)
+        gc.collect()
+        assert PROFILE_MEMORY_PEAK in dict(
+            RequestProfile(memory=True).finish()
+        )
+
+    def test_memory_profiles_after_fork(self):
+        profiles = MemoryProfiles()
+        lock = profiles._lock
+        profiles.reset_after_fork()
+        assert profiles._lock is not lock
+
+    def test_memory_not_traced(self):
+        assert PROFILE_MEMORY_DELTA not in dict(
+            RequestProfile(memory=True).finish()
+        )
+
+    @mock.patch.dict(sys.modules)
+    def test_tracemalloc_not_available(self):
+
+        def custom_import(name, *args):
+            if name == 'tracemalloc':
+                raise ImportError
+            return original_import(name, *args)
+
+        with mock.patch.object(builtins, '__import__', custom_import):
+            del sys.modules['intracing.profiling']
+            from intracing.profiling import (
+                RequestProfile, start_memory_tracing
+            )
+
+        start_memory_tracing()
+        assert not tracemalloc.is_tracing()
+        assert RequestProfile(memory=True).memory is None
+
+
+def sampled_function(sampler):
+    sampler.sample()
+
+
+class TestStackSampler(object):
+
+    def test_collapse_stack(self):
+        stack = collapse_stack(sys._getframe())
+        assert stack.endswith(';tests.test_profiling:test_collapse_stack')
+        assert collapse_stack(sys._getframe(), depth=1) == (
+            'tests.test_profiling:test_collapse_stack'
+        )
+
+    def test_format(self):
+        samples = StackSamples(None)
+        for stack in ('a;b', 'a;c', 'a;c', 'a;d'):
+            samples.add(stack)
+        assert samples.count == 4
+        assert samples.format(limit=2) == 'a;c 2\na;b 1'
+
+    def test_sample(self, stack_sampler):
+        span = object()
+        stack_sampler.track(span)
+        sampled_function(stack_sampler)
+        sampled_function(stack_sampler)
+
+        samples = stack_sampler.untrack(span)
+        assert samples.span is span
+        assert samples.count == 2
+        stack, = samples.stacks
+        assert stack.endswith(
+            ';tests.test_profiling:sampled_function'
+            ';intracing.profiling:sample'
+        )
+        assert stack_sampler.untrack(span) is None
+
+    def test_threshold(self, stack_sampler):
+        stack_sampler.threshold = 3600
+        stack_sampler.track(None)
+        stack_sampler.sample()
+        assert stack_sampler.untrack(None).count == 0
+
+    def test_other_thread(self, stack_sampler):
+        spans = [object(), object()]
+        thread = threading.Thread(target=stack_sampler.track,
+                                  args=(spans[0],))
+        thread.start()
+        thread.join()
+        stack_sampler.track(spans[1])
+
+        assert stack_sampler.untrack(spans[0]).span is spans[0]
+        assert stack_sampler.untrack(spans[1]).span is spans[1]
+
+    def test_finished_thread(self, stack_sampler):
+        thread = threading.Thread(target=stack_sampler.track, args=(None,))
+        thread.start()
+        thread.join()
+        stack_sampler.sample()
+        assert not stack_sampler._samples
+
+    @pytest.mark.parametrize('stopped', (False, True))
+    def test_reset_after_fork(self, stack_sampler, stopped):
+        stack_sampler.track(None)
+        if stopped:
+            stack_sampler.stop()
+        lock = stack_sampler._lock
+        stack_sampler.reset_after_fork()
+
+        assert stack_sampler._lock is not lock
+        assert stack_sampler._stopped.is_set() is stopped
+        assert stack_sampler._samples == {}
+        assert stack_sampler._thread is None
+
+    def test_background_thread(self, stack_sampler):
+        stack_sampler.interval = 0.001
+        stack_sampler.track(None)
+        samples = stack_sampler._samples[threading.current_thread().ident]
+        deadline = time.time() + 10
+        while not samples.count and time.time() < deadline:
+            time.sleep(0.001)
+        assert stack_sampler.untrack(None).count
+
+        stack_sampler.stop()
+        thread = stack_sampler._thread
+        thread.join()
+        # the thread is started again, e.g. in a forked process
+        stack_sampler._stopped.clear()
+        stack_sampler.track(None)
+        assert stack_sampler._thread is not thread
+        assert stack_sampler._thread.is_alive()
@@ -0,0 +1,828 @@
+# -*- coding: utf-8 -*-
+import binascii
+import os
+import socket
+import subprocess
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+
+import mock
+import pytest
+from jaeger_client import Tracer, thrift
+from jaeger_client.reporter import InMemoryReporter
+from jaeger_client.sampler import ConstSampler
+from jaeger_client.thrift_gen.jaeger.ttypes import (
+    Batch,
+    Span,
+    SpanRef,
+    SpanRefType,
+    Tag,
+    TagType,
+)
+from six.moves import builtins, http_client
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.protocol.TCompactProtocol import VALUE_WRITE, TCompactProtocol
+from thrift.transport.TTransport import TMemoryBuffer
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from intracing.base import TracingHelper
+from intracing.cache import make_tag
+from intracing.config import StatsMetricsFactory
+from intracing import reporter as reporter_module
+from intracing.reporter import (
+    DROP_NEWEST,
+    DROP_OLDEST,
+    ENCODED_STRING_MAX_LENGTH,
+    CollectorError,
+    IntracingAgentSender,
+    IntracingHTTPReporter,
+    IntracingReporter,
+    encode,
+    encode_varint,
+    estimate_size,
+    get_size,
+    trim_tags,
+    write_string,
+)
+from intracing.spool import Spool, open_spool
+from intracing.stats import TracingStats
+
+original_import = __import__
+
+
+@pytest.fixture
+def io_loop():
+    # the loop is never started, just like a stalled one
+    io_loop = IOLoop()
+    yield io_loop
+    io_loop.close(all_fds=True)
+
+
+def get_reporter(io_loop, drop_policy=DROP_NEWEST):
+    reporter = IntracingReporter(channel=mock.Mock(io_loop=io_loop),
+                                 queue_capacity=2, batch_size=1,
+                                 drop_policy=drop_policy)
+    reporter.metrics = mock.Mock()
+    return reporter
+
+
+def encode_tag(key, value):
+    buffer = TMemoryBuffer()
+    make_tag(key, value).write(TCompactProtocol(buffer))
+    return buffer.getvalue()
+
+
+def get_spans(*bodies):
+    tracer = Tracer(service_name='test-service', reporter=InMemoryReporter(),
+                    sampler=ConstSampler(True))
+    for body in bodies:
+        span = tracer.start_span('test')
+        span.tags.append(make_tag('http.response.body', body))
+        span.finish()
+    return tracer.reporter.get_spans()
+
+
+def get_budget_reporter(io_loop, stats, max_packet_size=1000):
+    reporter = IntracingReporter(channel=mock.Mock(io_loop=io_loop),
+                                 metrics_factory=StatsMetricsFactory(stats),
+                                 max_packet_size=max_packet_size)
+    reporter.set_process('test-service', {}, 1024)
+    return reporter
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.client_address, self.path,
+                                     self.headers, body))
+        status, headers = (self.server.responses.pop(0)
+                           if self.server.responses else (202, {}))
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class CollectorServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), CollectorHandler)
+        self.requests = []
+        self.responses = []
+
+    @property
+    def endpoint(self):
+        return 'http://127.0.0.1:{}/api/traces?format=jaeger.thrift'.format(
+            self.server_address[1]
+        )
+
+
+@pytest.fixture
+def collector():
+    server = CollectorServer()
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'poll_interval': 0.01})
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def get_http_reporter(io_loop, endpoint, stats=None, **kwargs):
+    reporter = IntracingHTTPReporter(
+        channel=mock.Mock(io_loop=io_loop), endpoint=endpoint,
+        metrics_factory=StatsMetricsFactory(stats or TracingStats()),
+        **kwargs
+    )
+    reporter.set_process('test-service', {}, 1024)
+    return reporter
+
+
+def decode_batch(body):
+    batch = Batch()
+    batch.read(TBinaryProtocol(TMemoryBuffer(body)))
+    return batch
+
+
+class UDPAgent(object):
+    """Local UDP listener standing for the agent"""
+
+    def __init__(self):
+        self.sock = None
+        self.port = None
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', self.port or 0))
+        self.sock.settimeout(1)
+        self.port = self.sock.getsockname()[1]
+
+    def stop(self):
+        self.sock.close()
+
+    def receive(self, count):
+        return [self.sock.recv(65536) for _ in range(count)]
+
+
+@pytest.fixture
+def agent():
+    agent = UDPAgent()
+    agent.start()
+    yield agent
+    agent.stop()
+
+
+def get_spool_reporter(io_loop, agent, spool, stats):
+    channel = IntracingAgentSender('127.0.0.1', 5778, agent.port,
+                                   io_loop=io_loop, throttling_port=5779)
+    reporter = IntracingReporter(channel=channel, spool=spool,
+                                 spool_drain_interval=3600,
+                                 metrics_factory=StatsMetricsFactory(stats))
+    reporter.set_process('test-service', {}, 1024)
+    return reporter
+
+
+def get_queued_spans(reporter):
+    return [reporter.queue.get_nowait()
+            for _ in range(reporter.queue.qsize())]
+
+
+class TestIntracingReporter(object):
+
+    def test_unknown_drop_policy(self, io_loop):
+        with pytest.raises(ValueError):
+            get_reporter(io_loop, drop_policy='random')
+
+    def test_pending_spans_limit(self, io_loop):
+        reporter = get_reporter(io_loop)
+        for span in range(5):
+            reporter.report_span(span)
+
+        assert reporter.pending == 2
+        assert reporter.metrics.reporter_dropped.call_count == 3
+
+        submitted_spans = []
+
+        @gen.coroutine
+        def submit(spans):
+            submitted_spans.extend(spans)
+
+        with mock.patch.object(reporter, '_submit', submit):
+            io_loop.run_sync(lambda: None)
+        assert reporter.pending == 0
+        assert submitted_spans == [0, 1]
+
+    @pytest.mark.parametrize('drop_policy,expected', (
+            (DROP_NEWEST, [0, 1]),
+            (DROP_OLDEST, [2, 3]),
+    ))
+    def test_drop_policy(self, io_loop, drop_policy, expected):
+        reporter = get_reporter(io_loop, drop_policy)
+        with mock.patch.object(IOLoop, 'current', return_value=io_loop):
+            for span in range(4):
+                reporter.report_span(span)
+
+        assert reporter.pending == 0
+        assert reporter.metrics.reporter_dropped.call_count == 2
+        assert get_queued_spans(reporter) == expected
+
+    def test_stopped(self, io_loop):
+        reporter = get_reporter(io_loop, DROP_OLDEST)
+        reporter._report_span_from_ioloop(0)
+        reporter._report_span_from_ioloop(1)
+        reporter.stopped = True
+        reporter._report_span_from_ioloop(2)
+
+        assert get_queued_spans(reporter) == [0, 1]
+
+    @mock.patch.dict(os.environ, TRACING_REPORTER_QUEUE_SIZE='1000',
+                     TRACING_REPORTER_BATCH_SIZE='50',
+                     TRACING_REPORTER_FLUSH_INTERVAL='0.5',
+                     TRACING_REPORTER_DROP_POLICY=DROP_OLDEST)
+    def test_configuration(self, io_loop):
+        TracingHelper.init_config()
+        reporter = TracingHelper.config.create_reporter(
+            mock.Mock(io_loop=io_loop)
+        )
+        assert isinstance(reporter, IntracingReporter)
+        assert reporter.queue_capacity == 1000
+        assert reporter.batch_size == 50
+        assert reporter.flush_interval == 0.5
+        assert reporter.drop_policy == DROP_OLDEST
+        assert reporter.max_packet_size == 65000
+
+    @mock.patch.dict(os.environ, TRACING_REPORTER_MAX_PACKET_SIZE='8192')
+    def test_max_packet_size_configuration(self, io_loop):
+        TracingHelper.init_config()
+        reporter = TracingHelper.config.create_reporter(
+            mock.Mock(io_loop=io_loop)
+        )
+        assert reporter.max_packet_size == 8192
+
+    def test_bytes_counting(self, io_loop):
+        stats = TracingStats()
+        reporter = IntracingReporter(channel=mock.Mock(io_loop=io_loop),
+                                     metrics_factory=StatsMetricsFactory(stats))
+        transport = mock.Mock()
+        protocol = reporter.getProtocol(transport)
+        protocol.trans.write(b'foo')
+        protocol.trans.flush()
+
+        transport.write.assert_called_once_with(b'foo')
+        transport.flush.assert_called_once_with()
+        assert stats.as_dict()['counters'] == {'intracing_reporter_bytes': 3}
+
+        reporter.report_span(0)
+        assert stats.as_dict()['gauges'] == {
+            'intracing_reporter_pending_spans': 1,
+        }
+
+
+class TestPacketBudget(object):
+
+    def test_trim_tags(self):
+        method = make_tag('http.method', 'GET')
+        url = make_tag('http.url', 'u' * 50)
+        request_body = make_tag('http.request.body', 'q' * 100)
+        response_body = make_tag('http.response.body', 'r' * 200)
+        tags = [method, url, request_body, response_body]
+
+        trimmed_tags, trimmed = trim_tags(tags, 150)
+        assert trimmed == 150
+        assert trimmed_tags[:3] == [method, url, request_body]
+        assert trimmed_tags[3].vStr == 'r' * 50
+        assert trimmed_tags[4] == Tag(key='http.response.body.truncated',
+                                      vType=TagType.BOOL, vBool=True)
+        # tags may be shared with other spans
+        assert response_body.vStr == 'r' * 200
+
+        trimmed_tags, trimmed = trim_tags(trimmed_tags, 180)
+        assert trimmed == 180
+        assert [tag.vStr for tag in trimmed_tags[:4]] == [
+            'GET', 'u' * 20, '', '',
+        ]
+        assert [tag.key for tag in trimmed_tags[4:]] == [
+            'http.response.body.truncated',
+            'http.request.body.truncated',
+            'http.url.truncated',
+        ]
+
+    def test_trim_multibyte_characters(self):
+        tags, trimmed = trim_tags([make_tag('http.request.body', u'é' * 10)],
+                                  3)
+        assert tags[0].vStr == u'é' * 8
+        assert trimmed == 4
+
+    def test_trim_binary_strings(self):
+        tags, trimmed = trim_tags([Tag(key='http.request.body',
+                                       vType=TagType.STRING, vStr=b'x' * 10)],
+                                  3)
+        assert tags[0].vStr == b'x' * 7
+        assert trimmed == 3
+
+    def test_nothing_to_trim(self):
+        tags = [make_tag('http.status_code', 200)]
+        assert trim_tags(tags, 10) == (tags, 0)
+
+    def test_estimate_size(self):
+        tracer = Tracer(service_name='test-service',
+                        reporter=InMemoryReporter(),
+                        sampler=ConstSampler(True))
+        parent = tracer.start_span(u'pâŕent')
+        span = tracer.start_span('child', child_of=parent)
+        span.set_tag('http.url', u'http://localhost/é' * 10)
+        span.set_tag('http.status_code', 200)
+        span.set_tag('profile.cpu_time', 0.25)
+        span.set_tag('error', True)
+        span.log_kv({'event': 'error', 'message': 'x' * 300})
+        span.finish()
+        parent.finish()
+        spans = thrift.make_jaeger_batch(
+            spans=tracer.reporter.get_spans(), process=None
+        ).spans
+        spans[0].tags.append(Tag(key='binary', vType=TagType.BINARY,
+                                 vBinary=b'\xff' * 10))
+        # jaeger client never sets references
+        spans.append(Span(traceIdLow=1, traceIdHigh=0, spanId=2,
+                          parentSpanId=0, operationName='follower',
+                          flags=1, startTime=3, duration=4,
+                          references=[SpanRef(refType=SpanRefType.FOLLOWS_FROM,
+                                              traceIdLow=1, traceIdHigh=0,
+                                              spanId=1)]))
+        spans.append(Span(traceIdLow=1, traceIdHigh=0, spanId=3,
+                          parentSpanId=0, operationName='bare', flags=1,
+                          startTime=3, duration=4))
+
+        for span in spans:
+            assert get_size(span) <= estimate_size(span)
+        # the estimate is close for spans with long values
+        assert estimate_size(spans[0]) < get_size(spans[0]) * 1.5
+
+    def test_estimated_batches(self, io_loop):
+        reporter = get_budget_reporter(io_loop, TracingStats())
+        with mock.patch.object(reporter_module, 'get_size',
+                               wraps=get_size) as get_size_mock:
+            batches = reporter.make_batches(get_spans('x' * 100, 'y' * 100),
+                                            reporter._process)
+        assert [len(batch.spans) for batch in batches] == [2]
+        # only the empty batch is measured
+        get_size_mock.assert_called_once_with(mock.ANY)
+
+    def test_fit_span(self, io_loop):
+        stats = TracingStats()
+        reporter = get_budget_reporter(io_loop, stats)
+        span, = reporter.make_batches(get_spans('x' * 5000),
+                                      reporter._process)[0].spans
+
+        body, truncated = span.tags[-2:]
+        assert 700 < len(body.vStr) < 1000
+        assert truncated.key == 'http.response.body.truncated'
+        counters = stats.as_dict()['counters']
+        assert counters['intracing_reporter_trimmed_bytes'] == (
+            5000 - len(body.vStr)
+        )
+        assert counters['intracing_reporter_trimmed_spans'] == 1
+
+    def test_split_batches(self, io_loop):
+        stats = TracingStats()
+        reporter = get_budget_reporter(io_loop, stats)
+        spans = get_spans('x' * 300, 'y' * 300, 'z' * 300, 'w' * 10)
+        batches = reporter.make_batches(spans, reporter._process)
+
+        assert [len(batch.spans) for batch in batches] == [2, 2]
+        assert 'intracing_reporter_trimmed_bytes' not in (
+            stats.as_dict()['counters']
+        )
+
+    def test_drop_span(self, io_loop):
+        stats = TracingStats()
+        reporter = get_budget_reporter(io_loop, stats)
+        spans = get_spans('x' * 10, 'y' * 10)
+        spans[0].log_kv({'event': 'e' * 2000})
+
+        batch, = reporter.make_batches(spans, reporter._process)
+        assert len(batch.spans) == 1
+        assert stats.as_dict()['counters'][
+            'jaeger_reporter_spans{result="dropped"}'
+        ] == 1
+
+    def test_drop_all_spans(self, io_loop):
+        stats = TracingStats()
+        reporter = get_budget_reporter(io_loop, stats)
+        span, = get_spans('x')
+        del span.tags[:]
+        span.log_kv({'event': 'e' * 2000})
+
+        assert reporter.make_batches([span], reporter._process) == []
+        assert 'intracing_reporter_trimmed_spans' not in (
+            stats.as_dict()['counters']
+        )
+
+    def test_submit(self, io_loop):
+        reporter = get_budget_reporter(io_loop, TracingStats())
+        reporter.metrics = mock.Mock()
+        sent_batches = []
+
+        @gen.coroutine
+        def send(batch):
+            sent_batches.append(batch)
+
+        with mock.patch.object(reporter, '_send', send):
+            io_loop.run_sync(lambda: reporter._submit([]))
+            io_loop.run_sync(lambda: reporter._submit(
+                get_spans('x' * 600, 'y' * 600)
+            ))
+
+        assert [len(batch.spans) for batch in sent_batches] == [1, 1]
+        reporter.metrics.reporter_success.assert_called_once_with(2)
+
+    @pytest.mark.parametrize('error', (socket.error, ValueError))
+    def test_submit_failure(self, io_loop, error):
+        reporter = get_budget_reporter(io_loop, TracingStats())
+        reporter.metrics = mock.Mock()
+        reporter.error_reporter = mock.Mock()
+
+        with mock.patch.object(reporter, '_send', side_effect=error):
+            io_loop.run_sync(lambda: reporter._submit(get_spans('x')))
+
+        reporter.metrics.reporter_failure.assert_called_once_with(1)
+        reporter.error_reporter.error.assert_called_once()
+
+    def test_submit_without_process(self, io_loop):
+        reporter = get_budget_reporter(io_loop, TracingStats())
+        reporter._process = None
+
+        with mock.patch.object(reporter, 'make_batches') as make_batches:
+            io_loop.run_sync(lambda: reporter._submit(get_spans('x')))
+        make_batches.assert_not_called()
+
+
+class TestWriteString(object):
+
+    @pytest.mark.parametrize('value,expected', (
+            ('test', b'\x04test'),
+            (b'test', b'\x04test'),
+            (u't\xe9st', b'\x05t\xc3\xa9st'),
+            ('x' * 200, b'\xc8\x01' + b'x' * 200),
+    ))
+    def test_write_string(self, value, expected):
+        proto = mock.Mock(state=VALUE_WRITE)
+        # the second call hits the cache
+        for _ in range(2):
+            proto.reset_mock()
+            write_string(proto, value)
+            proto.trans.write.assert_called_once_with(expected)
+
+    @pytest.mark.parametrize('value', (
+            'x' * (ENCODED_STRING_MAX_LENGTH + 1),
+            b'x' * (ENCODED_STRING_MAX_LENGTH + 1),
+    ))
+    def test_write_long_string(self, value):
+        proto = mock.Mock(state=VALUE_WRITE)
+        write_string(proto, value)
+        proto.writeBinary.assert_called_once_with(
+            b'x' * (ENCODED_STRING_MAX_LENGTH + 1)
+        )
+        assert value not in reporter_module._encoded_strings
+
+    def test_encoded_tag(self):
+        # the same bytes as written by the original `writeBinary`
+        key = b'http.method'
+        assert encode_tag('http.method', 'GET') == (
+            b'\x18' + encode_varint(len(key)) + key +
+            b'\x15\x00\x18\x03GET\x00'
+        )
+
+    def test_cache_size(self):
+        with mock.patch.object(reporter_module, 'ENCODED_STRINGS_CACHE_SIZE',
+                               2), \
+                mock.patch.object(reporter_module, '_encoded_strings',
+                                  OrderedDict()):
+            # the least recently written string is evicted
+            for value in ('foo', 'bar', 'foo', 'baz'):
+                write_string(mock.Mock(state=VALUE_WRITE), value)
+            assert list(reporter_module._encoded_strings.items()) == [
+                ('foo', b'\x03foo'), ('baz', b'\x03baz'),
+            ]
+
+
+@mock.patch('intracing.reporter.COLLECTOR_BACKOFF', 0)
+class TestIntracingHTTPReporter(object):
+
+    def test_send(self, io_loop, collector):
+        stats = TracingStats()
+        reporter = get_http_reporter(io_loop, collector.endpoint, stats,
+                                     gzip=True)
+        for _ in range(2):
+            io_loop.run_sync(lambda: reporter._submit(
+                get_spans('x' * 10, 'y' * 10)
+            ))
+
+        (first_client, path, headers, body), (second_client, _, _, _) = (
+            collector.requests
+        )
+        sent_bytes = sum(len(request[3]) for request in collector.requests)
+        # the connection is kept alive
+        assert first_client == second_client
+        assert path == '/api/traces?format=jaeger.thrift'
+        assert headers['Content-Type'] == 'application/x-thrift'
+        assert headers['Content-Encoding'] == 'gzip'
+
+        batch = decode_batch(zlib.decompress(body, 16 + zlib.MAX_WBITS))
+        assert batch.process.serviceName == 'test-service'
+        assert [span.tags[-1].vStr for span in batch.spans] == [
+            'x' * 10, 'y' * 10
+        ]
+        counters = stats.as_dict()['counters']
+        assert counters['intracing_reporter_bytes'] == sent_bytes
+        assert counters['jaeger_reporter_spans{result="ok"}'] == 4
+
+    def test_large_batch(self, io_loop, collector):
+        reporter = get_http_reporter(io_loop, collector.endpoint)
+        io_loop.run_sync(lambda: reporter._submit(
+            get_spans(*['x' * 50000] * 3)
+        ))
+
+        (_, _, headers, body), = collector.requests
+        assert 'Content-Encoding' not in headers
+        assert len(decode_batch(body).spans) == 3
+
+    def test_retry(self, io_loop, collector):
+        collector.responses = [(503, {}), (429, {})]
+        reporter = get_http_reporter(io_loop, collector.endpoint)
+        reporter.metrics = mock.Mock()
+        io_loop.run_sync(lambda: reporter._submit(get_spans('x')))
+
+        assert len(collector.requests) == 3
+        reporter.metrics.reporter_success.assert_called_once_with(1)
+
+    @pytest.mark.parametrize('retries,responses,requests', (
+            (3, [(400, {})], 1),
+            (1, [(500, {}), (500, {})], 2),
+    ))
+    def test_failure(self, io_loop, collector, retries, responses,
+                     requests):
+        status = responses[0][0]
+        collector.responses = responses
+        reporter = get_http_reporter(io_loop, collector.endpoint,
+                                     retries=retries)
+        reporter.metrics = mock.Mock()
+        reporter.error_reporter = mock.Mock()
+        io_loop.run_sync(lambda: reporter._submit(get_spans('x')))
+
+        assert len(collector.requests) == requests
+        reporter.metrics.reporter_failure.assert_called_once_with(1)
+        error = reporter.error_reporter.error.call_args[0][1]
+        assert isinstance(error, CollectorError)
+        assert error.status == status
+
+    def test_connection_error(self, io_loop, collector):
+        endpoint = collector.endpoint
+        collector.shutdown()
+        collector.server_close()
+
+        reporter = get_http_reporter(io_loop, endpoint, retries=1)
+        reporter.metrics = mock.Mock()
+        reporter.error_reporter = mock.Mock()
+        io_loop.run_sync(lambda: reporter._submit(get_spans('x')))
+
+        reporter.metrics.reporter_failure.assert_called_once_with(1)
+        assert reporter._connection is None
+
+    def test_connection_close(self, io_loop, collector):
+        collector.responses = [(202, {'Connection': 'close'})]
+        reporter = get_http_reporter(io_loop, collector.endpoint)
+        for _ in range(2):
+            io_loop.run_sync(lambda: reporter._submit(get_spans('x')))
+
+        (first_client, _, _, _), (second_client, _, _, _) = (
+            collector.requests
+        )
+        assert first_client != second_client
+
+    def test_close(self, io_loop, collector):
+        reporter = get_http_reporter(io_loop, collector.endpoint)
+        reporter.report_span(get_spans('x')[0])
+        io_loop.run_sync(reporter.close)
+        reporter._executor.shutdown()
+
+        assert len(collector.requests) == 1
+        assert reporter._connection is None
+
+    def test_https(self, io_loop):
+        reporter = get_http_reporter(io_loop, 'https://collector')
+        connection = reporter.get_connection()
+        assert isinstance(connection, http_client.HTTPSConnection)
+        assert reporter.path == '/'
+        assert reporter.get_connection() is connection
+        reporter.close_connection()
+        reporter.close_connection()
+        assert reporter._connection is None
+
+    @mock.patch.dict(os.environ,
+                     TRACING_COLLECTOR_ENDPOINT='http://collector/api/traces',
+                     TRACING_COLLECTOR_GZIP='1',
+                     TRACING_COLLECTOR_RETRIES='5',
+                     TRACING_COLLECTOR_TIMEOUT='0.5')
+    def test_configuration(self, io_loop):
+        TracingHelper.init_config()
+        reporter = TracingHelper.config.create_reporter(
+            mock.Mock(io_loop=io_loop)
+        )
+        assert isinstance(reporter, IntracingHTTPReporter)
+        assert reporter.netloc == 'collector'
+        assert reporter.path == '/api/traces'
+        assert reporter.gzip
+        assert reporter.retries == 5
+        assert reporter.timeout == 0.5
+
+
+class TestSpooling(object):
+
+    def test_agent_restart(self, io_loop, agent, tmpdir):
+        stats = TracingStats()
+        spool = Spool(str(tmpdir.join('spool')), 65536)
+        reporter = get_spool_reporter(io_loop, agent, spool, stats)
+
+        with mock.patch.object(io_loop, 'spawn_callback') as spawn_callback:
+            io_loop.run_sync(lambda: reporter._submit(get_spans('x')))
+        agent.receive(1)
+        # the spool is empty
+        spawn_callback.assert_not_called()
+
+        agent.stop()
+        # the first datagram is silently lost,
+        # sending fails once the socket is notified
+        for _ in range(5):
+            io_loop.run_sync(lambda: reporter._submit(get_spans('y')))
+            if spool:
+                break
+        assert len(spool) == 1
+
+        # the spool is kept while the agent is unavailable,
+        # even if sending doesn't fail right away
+        for _ in range(2):
+            io_loop.run_sync(reporter.drain_spool)
+            assert len(spool) == 1
+
+        agent.start()
+        with mock.patch.object(io_loop, 'spawn_callback') as spawn_callback:
+            io_loop.run_sync(lambda: reporter._submit(get_spans('z')))
+        spawn_callback.assert_called_once_with(reporter.drain_spool)
+        io_loop.run_sync(reporter.drain_spool)
+        assert not spool
+
+        packets = agent.receive(2)
+        assert b'z' in packets[0]
+        assert b'y' in packets[1]
+        counters = stats.as_dict()['counters']
+        assert counters['intracing_spooled_spans'] == 1
+        assert counters['intracing_drained_spans'] == 1
+        assert stats.as_dict()['gauges']['intracing_spooled_batches'] == 0
+
+    def test_spool_overflow(self, io_loop, agent, tmpdir):
+        stats = TracingStats()
+        spool = Spool(str(tmpdir.join('spool')), 1024)
+        reporter = get_spool_reporter(io_loop, agent, spool, stats)
+        batches = reporter.make_batches(get_spans('x' * 300),
+                                        reporter._process)
+        reporter.spool_batches(batches * 3)
+
+        assert len(spool) == 2
+        assert stats.as_dict()['counters'][
+            'intracing_spool_dropped_batches'
+        ] == 1
+
+    def test_batch_too_large(self, io_loop, agent, tmpdir):
+        stats = TracingStats()
+        spool = Spool(str(tmpdir.join('spool')), 64)
+        reporter = get_spool_reporter(io_loop, agent, spool, stats)
+        reporter.spool_batches(reporter.make_batches(get_spans('x' * 300),
+                                                     reporter._process))
+
+        assert not spool
+        counters = stats.as_dict()['counters']
+        assert counters['intracing_spool_dropped_batches'] == 1
+        assert 'intracing_spooled_spans' not in counters
+
+    def test_drain_other_channel(self, io_loop, tmpdir):
+        spool = Spool(str(tmpdir.join('spool')), 1024)
+        reporter = IntracingReporter(
+            channel=mock.Mock(spec=['io_loop'], io_loop=io_loop), spool=spool
+        )
+        reporter.set_process('test-service', {}, 1024)
+        reporter.spool_batches(reporter.make_batches(get_spans('x'),
+                                                     reporter._process))
+
+        with mock.patch.object(reporter, '_send',
+                               return_value=gen.maybe_future(None)) as send:
+            io_loop.run_sync(reporter.drain_spool)
+        send.assert_called_once()
+        assert not spool
+
+    def test_concurrent_drain(self, io_loop, agent, tmpdir):
+        spool = Spool(str(tmpdir.join('spool')), 1024)
+        reporter = get_spool_reporter(io_loop, agent, spool, TracingStats())
+        spool.push(b'')
+        reporter._draining = True
+        io_loop.run_sync(reporter.drain_spool)
+        assert len(spool) == 1
+
+    def test_periodic_drain(self, io_loop, agent, tmpdir):
+        spool = Spool(str(tmpdir.join('spool')), 1024)
+        reporter = get_spool_reporter(io_loop, agent, spool, TracingStats())
+        reporter.spool_drain_interval = 0.01
+        drains = []
+
+        @gen.coroutine
+        def drain_spool():
+            drains.append(None)
+            if len(drains) == 2:
+                reporter.stopped = True
+
+        with mock.patch.object(reporter, 'drain_spool', drain_spool):
+            io_loop.run_sync(lambda: gen.sleep(0.1))
+        assert len(drains) == 2
+
+    def test_restart(self, io_loop, agent, tmpdir):
+        path = str(tmpdir.join('spool'))
+        reporter = get_spool_reporter(io_loop, agent, None, TracingStats())
+        batch, = reporter.make_batches(get_spans('x' * 10),
+                                       reporter._process)
+        code = (
+            'import binascii, sys; from intracing.spool import open_spool; '
+            'open_spool(sys.argv[1], 65536).push('
+            'binascii.unhexlify(sys.argv[2]))'
+        )
+        subprocess.check_call([
+            sys.executable, '-c', code, path,
+            binascii.hexlify(encode(batch)).decode('ascii'),
+        ])
+
+        # batches spooled by the exited process are drained
+        stats = TracingStats()
+        spool = open_spool(path, 65536)
+        reporter = get_spool_reporter(io_loop, agent, spool, stats)
+        io_loop.run_sync(reporter.drain_spool)
+        assert not spool
+        packet, = agent.receive(1)
+        assert b'x' * 10 in packet
+        assert stats.as_dict()['counters']['intracing_drained_spans'] == 1
+
+    def test_configuration(self, io_loop, tmpdir):
+        path = str(tmpdir.join('spool'))
+        with mock.patch.dict(os.environ, TRACING_SPOOL_PATH=path,
+                             TRACING_SPOOL_SIZE='4096'):
+            TracingHelper.init_config()
+        config = TracingHelper.config
+
+        channel = config._create_local_agent_channel(io_loop)
+        assert isinstance(channel, IntracingAgentSender)
+        reporter = config.create_reporter(channel)
+        assert reporter.spool.path == path + '.0'
+        assert reporter.spool.capacity == 4096
+        channel.close()
+
+    def test_default_configuration(self, io_loop):
+        TracingHelper.init_config()
+        config = TracingHelper.config
+        channel = config._create_local_agent_channel(io_loop)
+        assert not isinstance(channel, IntracingAgentSender)
+        assert config.create_reporter(channel).spool is None
+        channel.close()
+
+    @mock.patch.dict(sys.modules)
+    def test_fcntl_not_available(self, io_loop):
+
+        def custom_import(name, *args):
+            if name == 'fcntl':
+                raise ImportError
+            return original_import(name, *args)
+
+        with mock.patch.object(builtins, '__import__', custom_import):
+            for name in ('fcntl', 'intracing.config', 'intracing.spool'):
+                sys.modules.pop(name, None)
+            from intracing.config import IntracingConfig
+
+            config = IntracingConfig({'spool': {}}, service_name='test')
+            channel = config._create_local_agent_channel(io_loop)
+            assert config.create_reporter(channel).spool is None
+            channel.close()
+
+            config = IntracingConfig({'spool': {'path': 'spool'}},
+                                     service_name='test')
+            with pytest.raises(ImportError):
+                config.create_spool()
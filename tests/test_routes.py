@@ -0,0 +1,73 @@
+import pytest
+
+from intracing.routes import (
+    RouteNames, compile_path_patterns, get_route_name, normalize_url
+)
+
+
+@pytest.mark.parametrize('url,expected', (
+        ('http://localhost/', 'http://localhost/'),
+        ('http://localhost:8080/users/42', 'http://localhost:8080/users/{id}'),
+        ('http://localhost/users/42/orders/7?page=2',
+         'http://localhost/users/{id}/orders/{id}?page=2'),
+        ('http://localhost/items/0F8FAD5B-D9CB-469F-A165-70867728950E/',
+         'http://localhost/items/{uuid}/'),
+        ('http://localhost/v2/users/42x', 'http://localhost/v2/users/42x'),
+        ('http://localhost/login?next=/orders/123#/items/7',
+         'http://localhost/login?next=/orders/123#/items/7'),
+        ('http://localhost/orders/123?id=/456',
+         'http://localhost/orders/{id}?id=/456'),
+))
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
+
+
+@pytest.mark.parametrize('route,expected', (
+        ('/users/<int:user_id>', '/users/<int:user_id>'),
+        ('users/<int:pk>/', '/users/<int:pk>/'),
+        ('^$', '/'),
+        ('^stream$', '/stream'),
+))
+def test_get_route_name(route, expected):
+    assert get_route_name(route) == expected
+
+
+def test_route_names():
+    route_names = RouteNames()
+    assert route_names['^stream$'] == '/stream'
+    assert route_names == {'^stream$': '/stream'}
+
+
+@pytest.mark.parametrize('path,excluded', (
+        ('/health', True),
+        ('/healthz', True),
+        ('/ready', True),
+        ('/ready/', False),
+        ('/static/app.css', True),
+        ('/static/app.js', False),
+        ('/api/users', False),
+        ('/api/v1/health', False),
+        ('/v12/status', True),
+        ('/v1234/status', False),
+))
+@pytest.mark.parametrize('patterns', (
+        '/health ^/ready$\n/static/*.css ^/v\\d{1,3}/status$',
+        ['/health', '^/ready$', '/static/*.css', r'^/v\d{1,3}/status$'],
+        ('/health', '^/ready$', '/static/*.css', r'^/v\d{1,3}/status$'),
+))
+def test_compile_path_patterns(patterns, path, excluded):
+    pattern = compile_path_patterns(patterns)
+    assert bool(pattern.match(path)) is excluded
+
+
+@pytest.mark.parametrize('patterns', ('', ' \n ', '\t', [], ['', ' ']))
+def test_compile_no_path_patterns(patterns):
+    assert compile_path_patterns(patterns) is None
+
+
+def test_compile_path_patterns_with_commas():
+    pattern = compile_path_patterns('/a,b /static/[,]*')
+    assert pattern.match('/a,b')
+    assert pattern.match('/static/,x')
+    assert not pattern.match('/b')
+    assert not pattern.match('/static/x')
@@ -0,0 +1,201 @@
+import errno
+import fcntl
+import mmap
+import os
+import subprocess
+import sys
+
+import mock
+import pytest
+
+from intracing import spool as spool_module
+from intracing.spool import (
+    HEADER,
+    Spool,
+    SpoolLocked,
+    get_slot_paths,
+    open_spool,
+)
+
+# a process which spools a record and exits without closing the spool
+SPOOLING_CODE = (
+    'import sys; from intracing.spool import open_spool; '
+    'spool = open_spool(sys.argv[1], 64); spool.push(sys.argv[2].encode())'
+)
+
+
+def spool_in_process(path, record):
+    subprocess.check_call([sys.executable, '-c', SPOOLING_CODE, path, record])
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join('intracing.spool'))
+
+
+class TestSpool(object):
+
+    def test_records(self, path):
+        spool = Spool(path, 64)
+        assert not spool
+        assert spool.peek() is None
+        spool.remove()
+
+        assert spool.push(b'foo')
+        assert spool.push(b'')
+        assert spool.push(b'bar')
+        assert len(spool) == 3
+
+        records = []
+        while spool:
+            records.append(spool.peek())
+            spool.remove()
+        assert records == [b'foo', b'', b'bar']
+        assert spool.used == 0
+        spool.close()
+
+    def test_wrap_around(self, path):
+        spool = Spool(path, 32)
+        spool.push(b'a' * 11)
+        spool.push(b'b' * 11)
+        spool.remove()
+        # the length prefix is split by the end of the buffer
+        spool.push(b'c' * 11)
+        spool.remove()
+        spool.push(b'd' * 11)
+
+        assert spool.peek() == b'c' * 11
+        spool.remove()
+        assert spool.peek() == b'd' * 11
+        assert spool.dropped == 0
+
+    def test_overwrite_oldest(self, path):
+        spool = Spool(path, 32)
+        for record in (b'a' * 10, b'b' * 10, b'c' * 10):
+            assert spool.push(record)
+
+        assert len(spool) == 2
+        assert spool.dropped == 1
+        assert spool.peek() == b'b' * 10
+
+    def test_record_too_large(self, path):
+        spool = Spool(path, 32)
+        spool.push(b'a')
+        assert not spool.push(b'x' * 29)
+        assert spool.dropped == 1
+        assert spool.peek() == b'a'
+
+    def test_reopen(self, path):
+        spool = Spool(path, 64)
+        spool.push(b'foo')
+        spool.push(b'bar')
+        spool.remove()
+        spool.close()
+
+        spool = Spool(path, 64)
+        assert len(spool) == 1
+        assert spool.peek() == b'bar'
+        spool.close()
+
+        # the records are dropped along with the old size
+        spool = Spool(path, 128)
+        assert not spool
+        spool.close()
+
+    def test_corrupted_header(self, path):
+        Spool(path, 64).close()
+        with open(path, 'r+b') as spool_file:
+            spool_file.write(b'\xff' * HEADER.size)
+
+        spool = Spool(path, 64)
+        assert not spool
+        assert spool.push(b'foo')
+        assert spool.peek() == b'foo'
+
+    def test_locked(self, path):
+        spool = Spool(path, 64)
+        with pytest.raises(SpoolLocked):
+            Spool(path, 64)
+        spool.close()
+        Spool(path, 64).close()
+
+    def test_deleted_while_opening(self, path):
+        # another process deleted the file before it's locked
+        with mock.patch.object(spool_module, '_is_linked',
+                               side_effect=[False, True]):
+            spool = Spool(path, 64)
+        assert spool.push(b'foo')
+        spool.close()
+        assert len(Spool(path, 64)) == 1
+
+    def test_lock_error(self, path):
+        error = OSError(errno.EBADF, 'Bad file descriptor')
+        with mock.patch.object(fcntl, 'flock', side_effect=error), \
+                mock.patch('os.close', wraps=os.close) as close_mock:
+            with pytest.raises(OSError):
+                Spool(path, 64)
+        close_mock.assert_called_once_with(mock.ANY)
+
+    def test_map_error(self, path):
+        with mock.patch.object(mmap, 'mmap', side_effect=ValueError), \
+                mock.patch('os.close', wraps=os.close) as close_mock:
+            with pytest.raises(ValueError):
+                Spool(path, 64)
+        close_mock.assert_called_once_with(mock.ANY)
+        # the lock is released
+        Spool(path, 64).close()
+
+    def test_delete(self, path):
+        spool = Spool(path, 64)
+        assert spool_module._is_linked(spool._fd, path)
+        os.unlink(path)
+        assert not spool_module._is_linked(spool._fd, path)
+        spool.close()
+
+        Spool(path, 64).delete()
+        assert not os.path.exists(path)
+
+
+class TestSpoolSlots(object):
+
+    def test_restart(self, path):
+        spool_in_process(path, 'foo')
+        spool_in_process(path, 'bar')
+
+        # the slot of the exited process is opened again
+        spool = open_spool(path, 64)
+        assert spool.path == path + '.0'
+        assert len(spool) == 2
+        assert spool.peek() == b'foo'
+
+    def test_concurrent_processes(self, path):
+        spool = open_spool(path, 64)
+        spool_in_process(path, 'foo')
+        assert get_slot_paths(path) == [path + '.0', path + '.1']
+        assert not spool
+
+    def test_adopt_orphans(self, path, tmpdir):
+        first = open_spool(path, 64)
+        spool_in_process(path, 'foo')
+        # a slot of a running process isn't adopted
+        running = Spool(path + '.2', 64)
+        running.push(b'bar')
+        first.push(b'baz')
+        first.close()
+        tmpdir.join('intracing.spool.old').write('')
+
+        spool = open_spool(path, 64)
+        assert spool.path == path + '.0'
+        records = []
+        while spool:
+            records.append(spool.peek())
+            spool.remove()
+        assert records == [b'baz', b'foo']
+        assert get_slot_paths(path) == [path + '.0', path + '.2']
+        assert running.peek() == b'bar'
+
+    def test_slot_paths(self, tmpdir, monkeypatch):
+        for name in ('spool.10', 'spool.2', 'spool.x', 'spool', 'other.1'):
+            tmpdir.join(name).write('')
+        monkeypatch.chdir(tmpdir)
+        assert get_slot_paths('spool') == ['spool.2', 'spool.10']
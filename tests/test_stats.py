@@ -0,0 +1,119 @@
+import mock
+import pytest
+
+from intracing.base import TracingHelper
+from intracing.config import StatsMetricsFactory
+from intracing.stats import Histogram, TracingStats, format_series, timed
+
+
+@pytest.fixture
+def stats():
+    return TracingStats()
+
+
+@pytest.mark.parametrize('name,labels,expected', (
+        ('jaeger:finished_spans', (), 'jaeger_finished_spans'),
+        ('foo', (('a', 'b'), ('c', 'd')), 'foo{a="b",c="d"}'),
+))
+def test_format_series(name, labels, expected):
+    assert format_series(name, labels) == expected
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+
+    assert histogram.as_dict() == {
+        'buckets': {'0.1': 2, '1': 3, '+Inf': 4},
+        'sum': 5.65,
+        'count': 4,
+    }
+
+
+class TestTracingStats(object):
+
+    def test_reset_after_fork(self, stats):
+        stats.increment('foo')
+        lock = stats._lock
+        stats.reset_after_fork()
+        assert stats._lock is not lock
+        assert stats.as_dict()['counters'] == {'foo': 1}
+
+    def test_as_dict(self, stats):
+        stats.increment('foo')
+        stats.increment('foo', 2)
+        stats.increment('foo', labels=(('bar', 'baz'),))
+        stats.set_counter('qux', 5)
+        stats.set_gauge('quux', 7)
+        stats.observe('corge', 0.5)
+
+        stats_dict = stats.as_dict()
+        assert stats_dict['counters'] == {
+            'foo': 3, 'foo{bar="baz"}': 1, 'qux': 5,
+        }
+        assert stats_dict['gauges'] == {'quux': 7}
+        assert stats_dict['histograms']['corge']['count'] == 1
+
+        stats.reset()
+        assert stats.as_dict() == {
+            'counters': {}, 'gauges': {}, 'histograms': {},
+        }
+
+    def test_as_prometheus(self, stats):
+        stats.increment('foo:bar', labels=(('result', 'ok'),))
+        stats.increment('foo:bar', 2, labels=(('result', 'err'),))
+        stats.set_gauge('baz', 3)
+        stats.observe('qux', 0.5, labels=(('hook', 'view'),))
+
+        lines = stats.as_prometheus().splitlines()
+        assert lines[:5] == [
+            '# TYPE foo_bar counter',
+            'foo_bar{result="err"} 2',
+            'foo_bar{result="ok"} 1',
+            '# TYPE baz gauge',
+            'baz 3',
+        ]
+        assert lines[5] == '# TYPE qux histogram'
+        assert lines[6] == 'qux_bucket{hook="view",le="0.0001"} 0'
+        assert lines[-3] == 'qux_bucket{hook="view",le="+Inf"} 1'
+        assert lines[-2:] == [
+            'qux_sum{hook="view"} 0.5',
+            'qux_count{hook="view"} 1',
+        ]
+
+    def test_metrics_factory(self, stats):
+        factory = StatsMetricsFactory(stats)
+        factory.create_counter('foo', {'bar': 'baz'})(2)
+        factory.create_gauge('qux')(3)
+        factory.create_timer('quux')(4)
+
+        assert stats.as_dict()['counters'] == {'foo{bar="baz"}': 2}
+        assert stats.as_dict()['gauges'] == {'qux': 3}
+
+    def test_timed(self, stats):
+        helper = mock.Mock(stats=stats)
+
+        @timed('hook')
+        def hook(helper, value):
+            if value is None:
+                raise ValueError
+            return value
+
+        assert hook(helper, 'foo') == 'foo'
+        with pytest.raises(ValueError):
+            hook(helper, None)
+
+        histograms = stats.as_dict()['histograms']
+        assert histograms[
+            'intracing_request_hook_seconds{hook="hook"}'
+        ]['count'] == 2
+
+    @mock.patch.object(TracingHelper, 'tag_cache', None)
+    @mock.patch.object(TracingHelper, 'stats', TracingStats())
+    def test_tracing_not_configured(self):
+        assert TracingHelper.get_stats() == {
+            'counters': {},
+            'gauges': {},
+            'histograms': {},
+        }
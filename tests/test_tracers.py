@@ -1,6 +1,10 @@
+import threading
+import time
+
 import mock
 import pytest
 
+from intracing.base import IntracingTracer
 from intracing.django import IntracingDjangoTracer
 from intracing.flask import IntracingFlaskTracer
 
@@ -9,6 +13,7 @@ class TestTracers(object):
 
     @pytest.mark.parametrize('method', ('inject', 'extract', 'start_span'))
     @pytest.mark.parametrize('tracer_class', (
+            IntracingTracer,
             IntracingDjangoTracer,
             IntracingFlaskTracer,
     ))
@@ -22,3 +27,66 @@ class TestTracers(object):
         getattr(jaeger_tracer_mock, method).assert_called_once_with(
             *args, **kwargs
         )
+
+    @pytest.mark.parametrize('tracer_class', (
+            IntracingTracer,
+            IntracingDjangoTracer,
+            IntracingFlaskTracer,
+    ))
+    def test_reset_tracer(self, tracer_class):
+        tracer_getter_mock = mock.Mock(side_effect=lambda: mock.Mock())
+        tracer = tracer_class(tracer_getter_mock)
+        tracer_getter_mock.assert_not_called()
+
+        jaeger_tracer = tracer._tracer
+        assert tracer._tracer is jaeger_tracer
+        tracer_getter_mock.assert_called_once_with()
+
+        tracer.reset_tracer()
+        assert tracer._tracer is not jaeger_tracer
+        assert tracer_getter_mock.call_count == 2
+
+    @pytest.mark.parametrize('tracer_class', (
+            IntracingTracer,
+            IntracingDjangoTracer,
+            IntracingFlaskTracer,
+    ))
+    def test_tracer_attributes(self, tracer_class):
+        jaeger_tracer_mock = mock.Mock()
+        tracer = tracer_class(mock.Mock(return_value=jaeger_tracer_mock))
+        assert tracer.reporter is jaeger_tracer_mock.reporter
+        assert tracer.sampler is jaeger_tracer_mock.sampler
+        tracer.close()
+        jaeger_tracer_mock.close.assert_called_once_with()
+
+        for name in ('_missing_attribute', 'missing_attribute'):
+            with pytest.raises(AttributeError):
+                getattr(tracer, name)
+
+    def test_attribute_probe(self):
+        tracer_getter_mock = mock.Mock()
+        tracer = IntracingTracer(tracer_getter_mock)
+        # e.g. libraries checking for optional features
+        assert not hasattr(tracer, 'missing_attribute')
+        assert getattr(tracer, 'flush', None) is None
+        tracer_getter_mock.assert_not_called()
+
+    def test_concurrent_creation(self):
+        def create_tracer():
+            # other threads access the tracer meanwhile
+            time.sleep(0.01)
+            return mock.Mock()
+
+        tracer_getter_mock = mock.Mock(side_effect=create_tracer)
+        tracer = IntracingTracer(tracer_getter_mock)
+        jaeger_tracers = []
+        threads = [threading.Thread(
+            target=lambda: jaeger_tracers.append(tracer._tracer)
+        ) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        tracer_getter_mock.assert_called_once_with()
+        assert jaeger_tracers == [tracer._tracer] * 10
@@ -30,7 +30,7 @@ def assert_not_contain_tag(span_tags, key):
 
 
 def assert_http_view_span(
-        span, component, method, url, user_agent, status_code,
+        span, component, method, url, route, user_agent, status_code,
         request_content_type, request_body,
         response_content_type, response_body
 ):
@@ -41,6 +41,7 @@ def assert_http_view_span(
         (tags.COMPONENT, component),
         (tags.HTTP_METHOD, method),
         (tags.HTTP_URL, url),
+        ('http.route', route),
         ('http.user_agent', user_agent),
         ('http.request.content_type', request_content_type),
         ('http.request.body', request_body),